@@ -1,28 +1,42 @@
+# Imported first so the startup report's clock covers the imports below
+from startup import startup_report
+
+import logging
 import os
-import pickle
-import uuid
 
 import dash_bootstrap_components as dbc
 import dash_mantine_components as dmc
-from dash import Dash, Input, Output, State, callback, page_container
-from flask import request
+import redis
+from dash import Dash, Input, Output, State, callback, get_relative_path, no_update, page_container
+from flask import jsonify, request
 
 import utils
-from constants import redis_instance
+from background import create_background_manager
+from config import config
+from default_dataset import load_default_dataset
+from layout_codec import extract_figures
+from metrics import metrics
+from rate_limiter import rate_limiter
+from response_cache import response_cache
+from single_flight import single_flight
+from storage import layout_store
+
+startup_report.mark("imports")
+
+logger = logging.getLogger(__name__)
+
+# Kept at module level so the Celery worker can reach the same Celery app
+background_manager = create_background_manager()
 
 # print("API Key:", os.getenv('OPEN_AI_KEY'))
 
-app = Dash(
-    __name__,
-    suppress_callback_exceptions=True,
-    external_scripts=["https://cdn.plot.ly/plotly-2.18.2.min.js"],
-    external_stylesheets=[dbc.themes.BOOTSTRAP],
-    title="AI Data Insights",
-    use_pages=True,
-)
 
+def rate_limit_status():
+    return jsonify(rate_limiter.state())
 
-server = app.server
+
+def llm_cache_status():
+    return jsonify({**response_cache.stats(), "coalescing": single_flight.stats()})
 
 
 def layout():
@@ -35,7 +49,38 @@ def layout():
     )
 
 
-app.layout = layout
+def create_app() -> Dash:
+    """
+    Build the Dash app.
+
+    Run under gunicorn with --preload, this happens once in the master
+    process: imports, page registration and the default dataset are then
+    shared copy-on-write by the forked workers instead of being repeated in
+    each. Clients (Redis, OpenAI) are created lazily, so nothing holding a
+    socket is inherited across the fork.
+    """
+    app = Dash(
+        __name__,
+        suppress_callback_exceptions=True,
+        external_scripts=["https://cdn.plot.ly/plotly-2.18.2.min.js"],
+        external_stylesheets=[dbc.themes.BOOTSTRAP],
+        title="AI Data Insights",
+        use_pages=True,
+        background_callback_manager=background_manager,
+    )
+    app.layout = layout
+
+    server = app.server
+    server.add_url_rule("/status/rate-limit", view_func=rate_limit_status)
+    server.add_url_rule("/status/llm-cache", view_func=llm_cache_status)
+    startup_report.install(server)
+    metrics.install(server)
+    startup_report.mark("create_app")
+
+    if config.PRELOAD_DEFAULT_DATASET:
+        load_default_dataset()
+        startup_report.mark("default_dataset")
+    return app
 
 
 @callback(
@@ -45,10 +90,18 @@ app.layout = layout
     prevent_initial_call=True,
 )
 def copy_link_to_view(n, current):
-    figure_id = str(uuid.uuid4())
-    redis_instance.set(figure_id, pickle.dumps(current))
-    return request.host_url[:-1] + app.get_relative_path(f"/view?layout={figure_id}")
+    try:
+        layout_id = layout_store.save(extract_figures(current))
+    except redis.RedisError as e:
+        logger.warning(f"Could not save shared layout: {e}")
+        return no_update
+    return request.host_url[:-1] + get_relative_path(f"/view?layout={layout_id}")
+
 
+app = create_app()
+server = app.server
+# Worker entry point when BACKGROUND_BACKEND=celery: celery -A app:celery_app worker
+celery_app = background_manager.handle if config.BACKGROUND_BACKEND == "celery" else None
 
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,51 @@
+"""
+Background callback manager for long-running callbacks.
+
+Background callbacks run outside the request that triggered them and report
+progress while they run, which is how chat answers and /view summaries are
+streamed to the browser: the web worker starts the job, returns at once and
+the page polls for progress and the result, so slow completions never hold
+a gunicorn thread.
+
+BACKGROUND_BACKEND picks where jobs run. ``diskcache`` (the default) starts
+each job as a child process of the web worker and keeps progress in a local
+cache directory, which suits development and single-host deployments.
+``celery`` queues jobs on Redis for separate worker processes
+(``celery -A app:celery_app worker``), so the web tier only polls; it
+requires the dataset store and REDIS_URL to be a shared Redis, which is
+checked when the manager is created.
+"""
+
+import diskcache
+from dash import CeleryManager, DiskcacheManager
+
+from config import config
+
+
+def create_celery_app():
+    """
+    Create the Celery app that runs background callbacks.
+
+    Raises:
+        ImportError: If celery isn't installed
+    """
+    try:
+        from celery import Celery
+    except ImportError as e:
+        raise ImportError("BACKGROUND_BACKEND=celery needs the celery package (pip install 'celery[redis]')") from e
+    return Celery(__name__, broker=config.CELERY_BROKER_URL, backend=config.CELERY_BROKER_URL)
+
+
+def create_background_manager():
+    """
+    Create the manager shared by every background callback in the app.
+
+    Raises:
+        RuntimeError: If Celery is selected without a shared Redis
+    """
+    is_valid, error = config.validate_background_config()
+    if not is_valid:
+        raise RuntimeError(error)
+    if config.BACKGROUND_BACKEND == "celery":
+        return CeleryManager(create_celery_app())
+    return DiskcacheManager(diskcache.Cache(config.BACKGROUND_CACHE_DIR))
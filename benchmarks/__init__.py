@@ -0,0 +1,4 @@
+"""
+Offline benchmarks: the app's callbacks against a stub OpenAI server and an
+in-process Redis fake. Run ``python -m benchmarks.run --help``.
+"""
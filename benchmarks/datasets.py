@@ -0,0 +1,93 @@
+"""
+Benchmark datasets: synthetic financial ledgers and the bundled samples.
+
+Ledgers are scaled up from datasets/mock_financial_data.csv by resampling
+its rows across more companies and GA codes and jittering the amounts, so
+they keep the columns and shape the financial roll-ups expect. Generated
+files are cached by row count and seed.
+"""
+
+import base64
+import os
+import tempfile
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+DATASET_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "datasets")
+MOCK_LEDGER = os.path.join(DATASET_DIR, "mock_financial_data.csv")
+BUNDLED = {
+    "nba": "nba.csv",
+    "precipitation": "annual_precipitation.csv",
+    "rock": "classic-rock-song-list.csv",
+}
+CACHE_DIR = os.path.join(tempfile.gettempdir(), "dolfin-bench")
+
+# Roughly one company per this many rows, so larger ledgers also widen the roll-ups
+ROWS_PER_COMPANY = 2_000
+
+
+def _rows_label(rows: int) -> str:
+    if rows >= 1_000_000 and rows % 1_000_000 == 0:
+        return f"{rows // 1_000_000}M"
+    if rows >= 1_000 and rows % 1_000 == 0:
+        return f"{rows // 1_000}k"
+    return str(rows)
+
+
+@dataclass
+class BenchDataset:
+    """A CSV file to upload, with the name it is reported under."""
+
+    name: str
+    path: str
+
+    def upload_contents(self) -> str:
+        """The file as the dcc.Upload component sends it: a base64 data URL."""
+        with open(self.path, "rb") as f:
+            return "data:text/csv;base64," + base64.b64encode(f.read()).decode()
+
+
+def synthetic_ledger(rows: int, seed: int = 0) -> pd.DataFrame:
+    """
+    A ledger with the mock dataset's columns, scaled to a number of rows.
+
+    Args:
+        rows: Number of rows to generate
+        seed: Random seed, so runs are comparable
+
+    Returns:
+        The ledger
+    """
+    base = pd.read_csv(MOCK_LEDGER)
+    rng = np.random.default_rng(seed)
+
+    df = base.iloc[rng.integers(0, len(base), rows)].reset_index(drop=True)
+    companies = np.array(list(base["company"].unique()) + [
+        f"CO{i:03d}" for i in range(max(0, rows // ROWS_PER_COMPANY - base["company"].nunique()))
+    ])
+    df["company"] = companies[rng.integers(0, len(companies), rows)]
+    # Sub-accounts within each GA code keep the code's leading digits
+    df["ga_code"] = df["ga_code"] + rng.integers(0, 100, rows)
+
+    scale = rng.lognormal(0.0, 0.5, rows)
+    for column in ("consolidated_accounts", "sum_eje", "sum_upload"):
+        df[column] = (df[column] * scale).round(2)
+    df["sum_upload"] = (df["sum_upload"] + rng.normal(0, 1_000, rows)).round(2)
+    return df
+
+
+def ledger(rows: int, seed: int = 0) -> BenchDataset:
+    """A synthetic ledger written to the benchmark cache directory."""
+    path = os.path.join(CACHE_DIR, f"ledger-{rows}-{seed}.csv")
+    if not os.path.exists(path):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        synthetic_ledger(rows, seed).to_csv(tmp_path, index=False)
+        os.replace(tmp_path, path)
+    return BenchDataset(f"ledger-{_rows_label(rows)}", path)
+
+
+def bundled(name: str) -> BenchDataset:
+    return BenchDataset(name, os.path.join(DATASET_DIR, BUNDLED[name]))
@@ -0,0 +1,333 @@
+"""
+Benchmark the app's callbacks offline.
+
+Each dataset is benchmarked in a fresh Python process, so peak RSS is
+comparable between datasets. That process imports the app against a stub
+OpenAI server (benchmarks.stub_openai) and ``REDIS_URL=memory://``. It then
+runs concurrent simulated user sessions that call the real callbacks in the
+order a user triggers them:
+
+    update_output -> chat_window (x2) -> save_figure -> copy_link_to_view
+    -> view.layout -> load_summary
+
+Background callbacks (chat_window, load_summary) are called directly in the
+user's thread, so the figures are the job's own cost without the polling
+round trips. Payload bytes are the callback's JSON-encoded inputs and
+outputs, including streamed progress updates.
+
+Usage:
+    python -m benchmarks.run                       # 10k/100k/1M ledgers + bundled datasets
+    python -m benchmarks.run --ledgers 10000 --bundled nba --users 8
+    python -m benchmarks.run --json before.json
+    python -m benchmarks.run --compare before.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.datasets import BUNDLED, BenchDataset, bundled, ledger
+from benchmarks.stub_openai import StubOpenAI
+
+QUESTIONS = [
+    "What is the total of the largest numeric column?",
+    "Which rows stand out, and what trends do you see?",
+    "Summarize this dataset in three sentences.",
+    "What is the average of each numeric column by the first text column?",
+]
+
+CALLBACKS = ["update_output", "chat_window", "save_figure", "copy_link_to_view", "view.layout", "load_summary"]
+
+
+def _percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+# --- Worker: runs in its own process, one dataset ---------------------------
+
+
+class _Recorder:
+    """Latencies and payload sizes per callback, shared by the user threads."""
+
+    def __init__(self):
+        self.seconds = defaultdict(list)
+        self.bytes_in = defaultdict(list)
+        self.bytes_out = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float, bytes_in: int, bytes_out: int):
+        with self._lock:
+            self.seconds[name].append(seconds)
+            self.bytes_in[name].append(bytes_in)
+            self.bytes_out[name].append(bytes_out)
+
+    def error(self, name: str):
+        with self._lock:
+            self.errors[name] += 1
+
+    def summary(self) -> dict:
+        result = {}
+        for name in CALLBACKS:
+            seconds = self.seconds.get(name)
+            if not seconds:
+                result[name] = {"n": 0, "errors": self.errors.get(name, 0)}
+                continue
+            result[name] = {
+                "n": len(seconds),
+                "p50_ms": round(_percentile(seconds, 0.5) * 1000, 1),
+                "p95_ms": round(_percentile(seconds, 0.95) * 1000, 1),
+                "max_ms": round(max(seconds) * 1000, 1),
+                "in_bytes": int(statistics.median(self.bytes_in[name])),
+                "out_bytes": int(statistics.median(self.bytes_out[name])),
+                "errors": self.errors.get(name, 0),
+            }
+        return result
+
+
+def _figure(df) -> dict:
+    """A chart of the dataset's first numeric column, as the chart editor sends it."""
+    numeric = df.select_dtypes("number").columns
+    y = numeric[0]
+    x = next((c for c in df.columns if c not in numeric), df.columns[0])
+    return {
+        "data": [{"type": "bar", "x": df[x].tolist(), "y": df[y].tolist()}],
+        "layout": {"title": {"text": f"{y} by {x}"}},
+    }
+
+
+def _worker(dataset: BenchDataset, users: int, sessions: int, warmup: int) -> dict:
+    # Imported here so main() can adjust the configuration first
+    import app
+    import utils
+    from dash._callback_context import context_value
+    from dash._utils import AttributeDict, to_json
+    from datastore import dataset_store
+    from pages import home, view
+
+    contents = dataset.upload_contents()
+    filename = os.path.basename(dataset.path)
+    recorder = _Recorder()
+
+    def call(name, fn, *args, bytes_in=0, progress=None):
+        start = time.perf_counter()
+        try:
+            output = fn(*args)
+        except Exception:
+            recorder.error(name)
+            logging.exception(f"{name} failed")
+            return None
+        elapsed = time.perf_counter() - start
+        streamed = sum(progress) if progress else 0
+        recorder.record(name, elapsed, bytes_in, len(to_json(output)) + streamed)
+        return output
+
+    def session(user: int):
+        progress = []
+
+        def set_progress(value):
+            progress.append(len(to_json(value)))
+
+        result = call("update_output", utils.update_output, contents, filename, False, None, bytes_in=len(contents))
+        if result is None:
+            return
+        _, _, dataset_id = result
+        df = dataset_store.get(dataset_id)
+
+        cur = None
+        session_id = str(uuid.uuid4())
+        for i in range(2):
+            question = QUESTIONS[(user + i) % len(QUESTIONS)]
+            progress.clear()
+            answer = call(
+                "chat_window", home.chat_window, set_progress, 1, dataset_id, question, cur, session_id,
+                bytes_in=len(question) + len(to_json(cur)), progress=progress,
+            )
+            if answer is not None:
+                cur = answer[0]
+
+        figure = _figure(df)
+        children = call("save_figure", home.save_figure, 1, figure, None, bytes_in=len(to_json(figure)))
+        if children is None:
+            return
+        children_json = json.loads(to_json(children))
+
+        with app.server.test_request_context("/"):
+            url = call(
+                "copy_link_to_view", app.copy_link_to_view, 1, children_json,
+                bytes_in=len(to_json(children_json)),
+            )
+        if not isinstance(url, str):
+            return
+        layout_id = url.rsplit("layout=", 1)[1]
+
+        call("view.layout", view.layout, layout_id)
+        context_value.set(AttributeDict(triggered_inputs=[{"prop_id": "view-summary-start.n_intervals", "value": 1}]))
+        progress.clear()
+        call("load_summary", view.load_summary, set_progress, 1, None, layout_id, progress=progress)
+
+    for user in range(warmup):
+        session(user)
+    warm = recorder
+    recorder = _Recorder()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        list(pool.map(session, [u for u in range(users) for _ in range(sessions)]))
+    wall = time.perf_counter() - started
+
+    callbacks = recorder.summary()
+    calls = sum(v["n"] for v in callbacks.values())
+    return {
+        "dataset": dataset.name,
+        "users": users,
+        "sessions": users * sessions,
+        "wall_seconds": round(wall, 2),
+        "sessions_per_second": round(users * sessions / wall, 3),
+        "callbacks_per_second": round(calls / wall, 2),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "warmup_errors": sum(warm.errors.values()),
+        "callbacks": callbacks,
+    }
+
+
+# --- Driver -----------------------------------------------------------------
+
+
+def _run_dataset(dataset: BenchDataset, stub: StubOpenAI, args, scratch: str) -> dict:
+    env = dict(
+        os.environ,
+        OPEN_AI_KEY="sk-bench",
+        OPENAI_BASE_URL=stub.base_url,
+        REDIS_URL="memory://",
+        PRELOAD_DEFAULT_DATASET="false",
+        DATASET_STORE_DIR=os.path.join(scratch, "datasets"),
+        BACKGROUND_CACHE_DIR=os.path.join(scratch, "background"),
+        DEFAULT_DATASET_CACHE_DIR=os.path.join(scratch, "default"),
+    )
+    command = [
+        sys.executable, "-m", "benchmarks.run", "--worker", dataset.name, dataset.path,
+        "--users", str(args.users), "--sessions", str(args.sessions), "--warmup", str(args.warmup),
+    ]
+    if args.no_cache:
+        command.append("--no-cache")
+    if args.rate_limit:
+        command.append("--rate-limit")
+
+    requests_before, limited_before = stub.requests, stub.rate_limited
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.run(
+        command, env=env, cwd=root, capture_output=True, text=True,
+    )
+    if process.returncode != 0:
+        sys.stderr.write(process.stderr)
+        raise RuntimeError(f"Benchmark of {dataset.name} failed")
+    if args.verbose:
+        sys.stderr.write(process.stderr)
+
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    result["openai_requests"] = stub.requests - requests_before
+    result["openai_429s"] = stub.rate_limited - limited_before
+    return result
+
+
+def _print_report(results, baseline=None):
+    before = {(r["dataset"], name): cb for r in baseline or [] for name, cb in r["callbacks"].items()}
+    before_rss = {r["dataset"]: r["peak_rss_mb"] for r in baseline or []}
+
+    header = f"{'dataset':<16}{'callback':<20}{'n':>5}{'p50 ms':>10}{'p95 ms':>10}{'in KB':>10}{'out KB':>10}{'err':>5}"
+    if baseline:
+        header += f"{'p95 vs base':>13}"
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        for name, cb in result["callbacks"].items():
+            if not cb["n"]:
+                print(f"{result['dataset']:<16}{name:<20}{0:>5}{'-':>10}{'-':>10}{'-':>10}{'-':>10}{cb['errors']:>5}")
+                continue
+            line = (
+                f"{result['dataset']:<16}{name:<20}{cb['n']:>5}{cb['p50_ms']:>10.1f}{cb['p95_ms']:>10.1f}"
+                f"{cb['in_bytes'] / 1024:>10.1f}{cb['out_bytes'] / 1024:>10.1f}{cb['errors']:>5}"
+            )
+            old = before.get((result["dataset"], name))
+            if old and old.get("n"):
+                line += f"{(cb['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100:>+12.1f}%"
+            print(line)
+        rss = f"peak RSS {result['peak_rss_mb']} MB"
+        if result["dataset"] in before_rss:
+            rss += f" (base {before_rss[result['dataset']]} MB)"
+        print(
+            f"{'':<16}{result['sessions']} sessions by {result['users']} users in {result['wall_seconds']}s: "
+            f"{result['sessions_per_second']} sessions/s, {result['callbacks_per_second']} callbacks/s, "
+            f"{rss}, {result['openai_requests']} OpenAI requests ({result['openai_429s']} 429s)"
+        )
+        print()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ledgers", default="10000,100000,1000000", help="Synthetic ledger sizes, comma separated")
+    parser.add_argument("--bundled", default=",".join(BUNDLED), help="Bundled datasets, comma separated")
+    parser.add_argument("--users", type=int, default=4, help="Concurrent simulated users")
+    parser.add_argument("--sessions", type=int, default=2, help="Sessions per user")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed sessions before measuring")
+    parser.add_argument("--latency", type=float, default=0.5, help="Stub OpenAI response latency, seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of OpenAI requests answered with 429")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the LLM response cache and coalescing")
+    parser.add_argument("--rate-limit", action="store_true", help="Keep the OpenAI rate limiter's configured limits")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--compare", help="Show p95 and RSS changes against results saved with --json")
+    parser.add_argument("--verbose", action="store_true", help="Show the app's log output")
+    parser.add_argument("--worker", nargs=2, metavar=("NAME", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        logging.basicConfig(level=logging.WARNING)
+        # The app reads its configuration at import
+        from config import config
+
+        if args.no_cache:
+            config.RESPONSE_CACHE_ENABLED = False
+            config.COALESCE_ENABLED = False
+        config.RATE_LIMIT_ENABLED = args.rate_limit
+        result = _worker(BenchDataset(*args.worker), args.users, args.sessions, args.warmup)
+        print(json.dumps(result))
+        return
+
+    datasets = [ledger(int(rows), args.seed) for rows in args.ledgers.split(",") if rows]
+    datasets += [bundled(name) for name in args.bundled.split(",") if name]
+
+    stub = StubOpenAI(latency=args.latency, error_rate=args.error_rate, seed=args.seed).start()
+    results = []
+    with tempfile.TemporaryDirectory(prefix="dolfin-bench-") as scratch:
+        for dataset in datasets:
+            print(f"Benchmarking {dataset.name}...", file=sys.stderr)
+            results.append(_run_dataset(dataset, stub, args, os.path.join(scratch, dataset.name)))
+    stub.stop()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    _print_report(results, baseline)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": {k: v for k, v in vars(args).items() if k != "worker"}, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+A local stand-in for the OpenAI chat completions API.
+
+Answers every request after a configurable latency, streams when asked, and
+can reject a share of requests with a 429 so the client's retry, backoff and
+fallback paths are exercised. The answer quotes the end of the last message,
+so different prompts get different answers.
+"""
+
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubOpenAI:
+    """Threaded HTTP server speaking enough of /v1/chat/completions for the client."""
+
+    def __init__(self, latency: float = 0.5, error_rate: float = 0.0, token_delay: float = 0.01, seed: int = 0):
+        """
+        Args:
+            latency: Seconds before the first byte of each response
+            error_rate: Share of requests answered with a 429 rate limit error
+            token_delay: Seconds between streamed chunks
+            seed: Seed for choosing which requests fail
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.token_delay = token_delay
+        self.requests = 0
+        self.rate_limited = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status, payload):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with stub._lock:
+                    stub.requests += 1
+                    fail = stub._random.random() < stub.error_rate
+                    stub.rate_limited += fail
+                time.sleep(stub.latency)
+                if fail:
+                    return self._send_json(
+                        429,
+                        {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                    )
+
+                words = ("Stub answer about " + str(body["messages"][-1]["content"])[-200:]).split()
+                prompt_tokens = sum(len(str(m.get("content", ""))) for m in body["messages"]) // 4
+                usage = {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": len(words),
+                    "total_tokens": prompt_tokens + len(words),
+                }
+                if not body.get("stream"):
+                    return self._send_json(200, {
+                        "id": "stub", "object": "chat.completion", "created": 0, "model": body["model"],
+                        "choices": [{
+                            "index": 0,
+                            "message": {"role": "assistant", "content": " ".join(words)},
+                            "finish_reason": "stop",
+                        }],
+                        "usage": usage,
+                    })
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                for word in words:
+                    chunk = {
+                        "id": "stub", "object": "chat.completion.chunk", "created": 0, "model": body["model"],
+                        "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}],
+                    }
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                    self.wfile.flush()
+                    time.sleep(stub.token_delay)
+                final = {
+                    "id": "stub", "object": "chat.completion.chunk", "created": 0, "model": body["model"],
+                    "choices": [], "usage": usage,
+                }
+                self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode())
+
+        return Handler
+
+    def start(self, port: int = 0) -> "StubOpenAI":
+        """Serve on 127.0.0.1 (any free port by default) from a daemon thread."""
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="stub-openai", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,128 @@
+"""
+Server-side multi-turn chat sessions.
+
+Each browser tab holds a session ID; the session itself (the recent turns
+and a condensed record of older ones) is stored in Redis so the background
+job answering the next question can read it from any process.
+
+A conversation is sent to the model as:
+
+    system     dataset context (the same for every turn, so the provider's
+               prompt cache can reuse it)
+    system     condensed earlier turns, if any
+    user/asst  the most recent turns, verbatim
+    user       computed facts and the new question
+
+Turns beyond CHAT_HISTORY_TURNS (or CHAT_HISTORY_TOKEN_BUDGET) are condensed
+to the question and the start of the answer, and the oldest condensed turns
+are dropped to stay within CHAT_EARLIER_TOKEN_BUDGET, so the prompt stops
+growing however long the conversation runs. If Redis is unreachable, each
+question is answered on its own.
+"""
+
+import json
+import logging
+import re
+from dataclasses import asdict, dataclass, field
+from typing import List, Optional
+
+import redis
+
+from config import config
+from constants import redis_instance
+from prompt_builder import count_tokens, truncate_to_tokens
+
+logger = logging.getLogger(__name__)
+
+_SESSION_ID_RE = re.compile(r"^[0-9a-f-]{36}$")
+
+
+@dataclass
+class ChatSession:
+    """A conversation about one dataset."""
+
+    session_id: Optional[str]  # None for a question answered without history
+    dataset_id: Optional[str] = None
+    turns: List[List[str]] = field(default_factory=list)  # Recent [question, answer] pairs, oldest first
+    earlier: List[str] = field(default_factory=list)  # Condensed older turns, oldest first
+
+    def messages(self, context: str, question: str) -> list:
+        """
+        Build the chat messages for a new question.
+
+        Args:
+            context: System prompt with the dataset context
+            question: The new user message
+
+        Returns:
+            Messages for the chat completion
+        """
+        messages = [{"role": "system", "content": context}]
+        if self.earlier:
+            messages.append({
+                "role": "system",
+                "content": "Earlier in this conversation (condensed):\n" + "\n".join(self.earlier),
+            })
+        for asked, answered in self.turns:
+            messages.append({"role": "user", "content": asked})
+            messages.append({"role": "assistant", "content": answered})
+        messages.append({"role": "user", "content": question})
+        return messages
+
+    def add_turn(self, question: str, answer: str):
+        """Record a turn, condensing the oldest ones once the window is full."""
+        self.turns.append([question, answer])
+
+        def verbatim_tokens():
+            return count_tokens("\n".join(text for turn in self.turns for text in turn))
+
+        # The latest turn is always kept verbatim
+        while len(self.turns) > 1 and (
+            len(self.turns) > config.CHAT_HISTORY_TURNS or verbatim_tokens() > config.CHAT_HISTORY_TOKEN_BUDGET
+        ):
+            asked, answered = self.turns.pop(0)
+            answered = truncate_to_tokens(answered.strip(), config.CHAT_CONDENSED_ANSWER_TOKENS)
+            self.earlier.append(f"- Q: {asked.strip()} A: {answered}")
+        while self.earlier and count_tokens("\n".join(self.earlier)) > config.CHAT_EARLIER_TOKEN_BUDGET:
+            self.earlier.pop(0)
+
+
+class SessionStore:
+    """Chat sessions in Redis, expiring after a period without questions."""
+
+    def __init__(self):
+        self.ttl = config.CHAT_SESSION_TTL_SECONDS
+
+    def _redis_key(self, session_id: str) -> str:
+        return f"chat:session:{session_id}"
+
+    def load(self, session_id: str, dataset_id: str) -> ChatSession:
+        """
+        Return a session's history for a dataset.
+
+        A session that was about another dataset starts over, since its
+        turns describe data that is no longer in the context.
+        """
+        if not isinstance(session_id, str) or not _SESSION_ID_RE.match(session_id):
+            return ChatSession(None, dataset_id)
+        try:
+            payload = redis_instance.get(self._redis_key(session_id))
+        except redis.RedisError as e:
+            logger.warning(f"Chat session lookup failed: {e}")
+            payload = None
+        if payload is not None:
+            session = ChatSession(**json.loads(payload))
+            if session.dataset_id == dataset_id:
+                return session
+        return ChatSession(session_id, dataset_id)
+
+    def save(self, session: ChatSession):
+        if session.session_id is None:
+            return
+        try:
+            redis_instance.set(self._redis_key(session.session_id), json.dumps(asdict(session)), ex=self.ttl)
+        except redis.RedisError as e:
+            logger.warning(f"Chat session write failed: {e}")
+
+
+session_store = SessionStore()
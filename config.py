@@ -3,6 +3,7 @@ Configuration settings for the AI Data Insights application.
 """
 
 import os
+import tempfile
 from typing import Optional
 
 # Load environment variables from secrets.env if it exists
@@ -27,10 +28,27 @@ class Config:
     OPENAI_MODEL: str = "gpt-4o-mini"  # Default model to use
     OPENAI_MAX_RETRIES: int = 3
     OPENAI_BASE_DELAY: float = 1.0  # seconds
+    OPENAI_MAX_DELAY: float = 8.0  # Cap on a single backoff sleep, seconds
+    OPENAI_REQUEST_TIMEOUT: float = 30.0  # Per-attempt timeout, seconds
+    OPENAI_MAX_CONCURRENCY: int = 8  # In-flight completions per worker process
     
     # Rate Limiting
     RATE_LIMIT_ENABLED: bool = True
     MAX_REQUESTS_PER_MINUTE: int = 60
+    MAX_TOKENS_PER_MINUTE: int = 200_000
+    RATE_LIMIT_MAX_WAIT: float = 10.0  # Longest a request queues for capacity, seconds
+    RATE_LIMIT_COMPLETION_TOKENS: int = 512  # Completion budget assumed when max_tokens isn't set
+    
+    # LLM Response Cache
+    RESPONSE_CACHE_ENABLED: bool = True
+    RESPONSE_CACHE_TTL_SECONDS: int = 24 * 3600
+    RESPONSE_CACHE_MAX_ENTRIES: int = 5_000
+    
+    # Request Coalescing
+    COALESCE_ENABLED: bool = True  # Identical concurrent completions share one call
+    COALESCE_LOCK_TTL_SECONDS: float = 5.0  # How long a killed leader's lock blocks others; refreshed while it runs
+    COALESCE_MAX_WAIT_SECONDS: float = 90.0  # Waiters make their own call after this
+    COALESCE_POLL_INTERVAL: float = 0.1  # How often waiters in other workers check for the answer, seconds
     
     # Error Handling
     SHOW_DETAILED_ERRORS: bool = False  # Set to True for debugging
@@ -38,7 +56,121 @@ class Config:
     
     # Application Settings
     DEBUG: bool = os.getenv("DEBUG", "False").lower() == "true"
-    
+    WORKER_COUNT: int = int(os.getenv("WEB_CONCURRENCY", "4"))  # gunicorn worker processes
+
+    # Metrics
+    METRICS_ENABLED: bool = True  # Serve /metrics and time callbacks
+    METRICS_FLUSH_SECONDS: float = 10.0  # How often each process adds its counts to the shared totals
+    REQUEST_PROFILER: str = os.getenv("REQUEST_PROFILER", "")  # "", "cprofile" or "pyinstrument"
+    REQUEST_PROFILE_DIR: str = os.getenv(
+        "REQUEST_PROFILE_DIR", os.path.join(tempfile.gettempdir(), "dolfin-profiles")
+    )
+    REQUEST_PROFILE_MIN_SECONDS: float = 0.5  # Only slower requests are written out
+
+    # Redis
+    REDIS_URL: str = os.getenv("REDIS_URL", "redis://127.0.0.1:6379")  # memory:// runs an in-process fake
+    REDIS_MAX_CONNECTIONS: int = 16  # Connection pool size per worker process
+    REDIS_POOL_TIMEOUT: float = 2.0  # Longest wait for a free pooled connection, seconds
+    REDIS_SOCKET_TIMEOUT: float = 2.0  # Per-command timeout, seconds
+    REDIS_CONNECT_TIMEOUT: float = 1.0
+    REDIS_HEALTH_CHECK_INTERVAL: int = 30  # Ping connections idle longer than this before reuse
+    LAYOUT_LOCAL_CACHE_SIZE: int = 128  # Shared layouts kept in process memory per worker
+    LAYOUT_LOCAL_CACHE_TTL_SECONDS: int = 300
+
+    # Upload Preview Grid
+    PREVIEW_BLOCK_ROWS: int = 100  # Rows per block served to the grid
+    PREVIEW_ORDER_CACHE_SIZE: int = 16  # Sorted/filtered row orders kept per worker
+    PREVIEW_ORDER_CACHE_TTL_SECONDS: int = 600
+
+    # Figure Reduction
+    FIGURE_POINT_BUDGET: int = 5_000  # Points kept per saved figure, across traces
+    FIGURE_MIN_TRACE_POINTS: int = 500  # Floor for each trace's share of the budget
+    FIGURE_LINE_DOWNSAMPLER: str = "lttb"  # "lttb" or "minmax" for ordered line traces
+    FIGURE_MAX_CATEGORIES: int = 50  # Categories kept from an over-budget bar/histogram, the rest grouped as "Other"
+    FIGURE_HISTOGRAM_BINS: int = 50
+
+    # Prompt Budgets
+    CHAT_CONTEXT_TOKEN_BUDGET: int = 3_000  # Dataset context in a chat prompt
+    CHAT_HISTORY_TURNS: int = 4  # Most recent chat turns sent verbatim
+    CHAT_HISTORY_TOKEN_BUDGET: int = 1_500  # Cap on the verbatim turns
+    CHAT_EARLIER_TOKEN_BUDGET: int = 500  # Older turns, condensed; the oldest are dropped beyond this
+    CHAT_CONDENSED_ANSWER_TOKENS: int = 40  # Each older answer is cut to this
+    CHAT_SESSION_TTL_SECONDS: int = 24 * 3600  # Since the last question
+    VIEW_SUMMARY_TOKEN_BUDGET: int = 2_500  # Chart descriptions sent for a /view summary
+    VIEW_MIN_CHART_TOKENS: int = 120  # Floor for each chart's share of the summary budget
+    FIGURE_OUTLIER_ZSCORE: float = 3.0  # Points further than this from the mean are outliers
+
+    # Local Query Answering
+    QUERY_ENGINE_ENABLED: bool = True  # Compute aggregation answers with pandas before asking the model
+    QUERY_LLM_EXPRESSIONS: bool = False  # Ask the model for a pandas expression when the parser can't
+    QUERY_EVAL_TIMEOUT_SECONDS: float = 2.0
+    QUERY_EVAL_MEMORY_BYTES: int = 512 * 1024 * 1024  # Memory an expression may allocate on top of the frame
+    QUERY_MAX_EXPRESSION_CHARS: int = 500
+    QUERY_MAX_FILTER_CARDINALITY: int = 5_000  # Text columns searched for values named in a question
+    QUERY_MAX_RESULT_ROWS: int = 10  # Rows of a grouped result shown to the model
+
+    # Financial Aggregates Cube
+    CUBE_GA_PREFIX_LENGTH: int = 1  # Leading digits of ga_code grouped together (1 -> 1xxxx)
+    CUBE_CACHE_SIZE: int = 16  # Cubes kept in process memory per worker
+
+    # Shared Layouts
+    SHARED_LAYOUT_TTL_SECONDS: Optional[int] = 90 * 24 * 3600  # None keeps links forever
+    LAYOUT_ZSTD_LEVEL: int = 10
+    LAYOUT_ARRAY_MIN_LENGTH: int = 8  # Shorter lists are stored inline
+
+    # Background Callbacks
+    BACKGROUND_BACKEND: str = os.getenv("BACKGROUND_BACKEND", "diskcache")  # "diskcache" or "celery"
+    CELERY_BROKER_URL: str = os.getenv("CELERY_BROKER_URL", REDIS_URL)  # Also stores job results
+    BACKGROUND_CACHE_DIR: str = os.getenv(
+        "BACKGROUND_CACHE_DIR", os.path.join(tempfile.gettempdir(), "dolfin-background")
+    )
+    STREAM_PROGRESS_INTERVAL_MS: int = 250  # How often streamed answers are pushed to the page
+
+    # Default Dataset
+    DEFAULT_DATASET_PATH: str = os.getenv(
+        "DEFAULT_DATASET_PATH",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "datasets", "solar.csv"),
+    )
+    DEFAULT_DATASET_CACHE_DIR: str = os.getenv(
+        "DEFAULT_DATASET_CACHE_DIR", os.path.join(tempfile.gettempdir(), "dolfin-default")
+    )
+    # Load it while the app is built, so a --preload master shares it with its workers
+    PRELOAD_DEFAULT_DATASET: bool = os.getenv("PRELOAD_DEFAULT_DATASET", "True").lower() == "true"
+
+    # Dataset Store
+    DATASET_STORE_BACKEND: str = os.getenv("DATASET_STORE_BACKEND", "disk")  # "disk" or "redis"
+    DATASET_STORE_DIR: str = os.getenv(
+        "DATASET_STORE_DIR", os.path.join(tempfile.gettempdir(), "dolfin-datasets")
+    )
+    DATASET_TTL_SECONDS: int = 7 * 24 * 3600  # Redis backend only
+    DATASET_MEMORY_CACHE_SIZE: int = 4  # Frames kept in process memory per worker
+
+    # Dataset Profile Cache
+    PROFILE_CACHE_SIZE: int = 32  # Profiles kept in process memory per worker
+    PROFILE_CACHE_TTL_SECONDS: int = 24 * 3600
+
+    # Profiling Engine
+    PROFILE_CHUNK_ROWS: int = 100_000
+    PROFILE_ROW_BUDGET: Optional[int] = 250_000  # Larger frames are profiled from a sample
+    PROFILE_EXACT_DISTINCT_LIMIT: int = 65_536  # Switch to HyperLogLog beyond this
+    PROFILE_HLL_PRECISION: int = 14  # 2**14 registers, ~0.8% standard error
+    PROFILE_TOPK_CAPACITY: int = 1_000  # Values tracked per categorical column
+    PROFILE_QUANTILE_SAMPLE: int = 20_000  # Reservoir size used for quartiles
+
+    # Upload Ingestion
+    INGEST_CHUNK_ROWS: int = 50_000
+    INGEST_SPOOL_MAX_BYTES: int = 32 * 1024 * 1024  # Decoded uploads above this spill to disk
+    INGEST_CATEGORY_MAX_RATIO: float = 0.5  # Text columns more unique than this stay strings
+    INGEST_FLOAT32: bool = False  # Store float columns as float32
+    INGEST_TRACE_MEMORY: bool = False  # Report tracemalloc peak (slows parsing)
+    # Processes parsing workbook sheets in parallel; 1 parses them in the web worker
+    INGEST_SHEET_WORKERS: int = int(os.getenv("INGEST_SHEET_WORKERS", str(min(4, os.cpu_count() or 1))))
+    INGEST_PARALLEL_MIN_BYTES: int = 2 * 1024 * 1024  # Smaller workbooks are parsed in-process
+    INGEST_UPLOAD_CACHE: bool = True  # Serve identical re-uploads from the stored Parquet
+
+    # Append Uploads
+    APPEND_KEY_COLUMNS: tuple = ("company", "ga_code")  # Rows with the same key replace earlier ones
+
     @classmethod
     def validate_openai_config(cls) -> tuple[bool, str]:
         """
@@ -55,6 +187,28 @@ class Config:
         
         return True, ""
     
+    @classmethod
+    def validate_background_config(cls) -> tuple[bool, str]:
+        """
+        Check that background jobs can reach the data their callbacks read.
+
+        Celery jobs run in separate processes, possibly on other hosts, so
+        datasets, chat sessions and summaries must live in a shared Redis.
+
+        Returns:
+            Tuple of (is_valid, error_message)
+        """
+        if cls.BACKGROUND_BACKEND != "celery":
+            return True, ""
+        if cls.REDIS_URL.startswith("memory://"):
+            return False, "BACKGROUND_BACKEND=celery needs a shared Redis server; REDIS_URL=memory:// is per process."
+        if cls.DATASET_STORE_BACKEND != "redis":
+            return False, (
+                "BACKGROUND_BACKEND=celery needs DATASET_STORE_BACKEND=redis, "
+                "since Celery workers can't read datasets stored on the web host's disk."
+            )
+        return True, ""
+
     @classmethod
     def get_status_message(cls) -> str:
         """Get current configuration status message."""
@@ -1,7 +1,2 @@
-import os
-
-import redis
-
-redis_instance = redis.StrictRedis.from_url(
-    os.environ.get("REDIS_URL", "redis://127.0.0.1:6379")
-)
+# The shared Redis client is managed in storage (pooling, timeouts, memory://)
+from storage import redis_instance  # noqa: F401
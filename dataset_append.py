@@ -0,0 +1,136 @@
+"""
+Append uploads: fold a new upload into the current dataset.
+
+Each month the finance team uploads the YTD workbook again, which is last
+month's rows plus a new month. In append mode the upload is matched against
+the current dataset by key columns (APPEND_KEY_COLUMNS, company + ga_code)
+when they identify rows uniquely in both, and otherwise by a hash of the
+whole row. Rows already present are kept as they are, rows whose key
+matches but whose values differ replace the stored version, and the rest
+are appended.
+
+Only the new and changed rows are profiled and aggregated: their profile
+state is merged into the current dataset's, and their sums are added to
+(and the replaced rows' subtracted from) the current financial cube.
+"""
+
+import logging
+import time
+from dataclasses import dataclass
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from config import config
+from dataset_profile import extend_profile
+from datastore import DatasetStoreError, dataset_store
+from financial_cube import extend_cube, get_cube
+from ingest import IngestError, combine_frames
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class AppendResult:
+    """The combined dataset and how the upload was matched against the current one."""
+
+    dataset_id: str
+    df: pd.DataFrame
+    added: int
+    changed: int
+    unchanged: int
+    key: Optional[List[str]]  # Key columns rows were matched on, None for whole-row hashes
+    seconds: float
+
+    def summary(self) -> str:
+        matched_on = " + ".join(self.key) if self.key else "whole rows"
+        return (
+            f"Appended to the current dataset (matched on {matched_on}): {self.added} new, "
+            f"{self.changed} changed and {self.unchanged} unchanged rows, "
+            f"{len(self.df)} rows in total, {self.seconds:.2f}s"
+        )
+
+
+def _row_hashes(df: pd.DataFrame) -> np.ndarray:
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+
+def find_key(base: pd.DataFrame, upload: pd.DataFrame) -> Optional[List[str]]:
+    """The key columns, if both frames have them and they identify rows uniquely in each."""
+    key = list(config.APPEND_KEY_COLUMNS)
+    if not key or not all(col in base.columns and col in upload.columns for col in key):
+        return None
+    if base.duplicated(key).any() or upload.duplicated(key).any():
+        return None
+    return key
+
+
+def append_upload(base: pd.DataFrame, base_id: str, upload: pd.DataFrame) -> AppendResult:
+    """
+    Merge an uploaded frame into the current dataset and store the result.
+
+    Args:
+        base: The current dataset
+        base_id: Its dataset ID
+        upload: The parsed upload, with the same columns as the current dataset
+
+    Returns:
+        The combined dataset, already stored, profiled and aggregated
+
+    Raises:
+        IngestError: If the upload's columns don't match the current dataset's,
+            or the combined dataset can't be stored
+    """
+    started = time.perf_counter()
+    if set(upload.columns) != set(base.columns):
+        raise IngestError("The upload's columns don't match the current dataset, so it can't be appended.")
+
+    # One frame, so both halves share dtypes and categories and hash alike
+    combined = combine_frames([base, upload[list(base.columns)]])
+    size = len(base)
+    rows = _row_hashes(combined)
+    key = find_key(base, upload)
+
+    if key is not None:
+        keys = _row_hashes(combined[key])
+        # Position in the current dataset of each uploaded row's key, -1 if new
+        matches = pd.Index(keys[:size]).get_indexer(keys[size:])
+        new = matches < 0
+        changed = ~new & (rows[size:] != rows[:size][np.maximum(matches, 0)])
+        replaced = matches[changed]
+    else:
+        new = ~np.isin(rows[size:], rows[:size])
+        changed = np.zeros(len(upload), dtype=bool)
+        replaced = np.array([], dtype=np.intp)
+
+    added_count, changed_count = int(new.sum()), int(changed.sum())
+    if not added_count and not changed_count:
+        return AppendResult(base_id, base, 0, 0, len(upload), key, time.perf_counter() - started)
+
+    # Changed rows are replaced where they were, new rows go at the end
+    positions = np.arange(size)
+    positions[replaced] = size + np.flatnonzero(changed)
+    positions = np.concatenate([positions, size + np.flatnonzero(new)])
+    df = combined.take(positions).reset_index(drop=True)
+    try:
+        dataset_id = dataset_store.put(df)
+    except DatasetStoreError as e:
+        raise IngestError(str(e)) from e
+
+    added = combined.take(size + np.flatnonzero(new | changed))
+    removed = combined.take(replaced)
+    # Profile states can be merged but not subtracted, so replacing rows means
+    # a full profile (computed when the dataset is first asked about)
+    if not changed_count and extend_profile(base_id, dataset_id, df, added) is None:
+        logger.info(f"No profile state for {base_id} in this worker; {dataset_id} will be profiled in full")
+    cube = get_cube(base, base_id)
+    if cube is not None:
+        extend_cube(cube, dataset_id, added, removed)
+
+    result = AppendResult(
+        dataset_id, df, added_count, changed_count,
+        len(upload) - added_count - changed_count, key, time.perf_counter() - started,
+    )
+    logger.info(result.summary())
+    return result
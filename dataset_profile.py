@@ -0,0 +1,160 @@
+"""
+Per-dataset profile used as the chat prompt context.
+
+Profiling a wide frame is by far the slowest part of answering a question,
+and the result only depends on the dataset. Profiles are therefore computed
+once per content hash and cached in process memory and in Redis.
+
+The mergeable profile state behind each profile is also kept in process
+memory, so a dataset extended by an append upload is profiled by folding
+the appended rows into its base dataset's state.
+"""
+
+import copy
+import json
+import logging
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+import pandas as pd
+import redis
+
+from cache import TTLCache
+from config import config
+from constants import redis_instance
+from datastore import content_hash
+from metrics import metrics
+from profiler import ProfileState, profile_frame, render_sections
+
+logger = logging.getLogger(__name__)
+
+# Bump when the profile text changes so stale Redis entries are ignored
+PROFILE_VERSION = 3
+
+
+@dataclass
+class DatasetProfile:
+    """Pre-rendered description of a dataset."""
+
+    dataset_id: str
+    rows: int
+    columns: list
+    sections: list  # [name, text] pairs, in prompt order
+
+    @property
+    def text(self) -> str:
+        return "\n".join(text for _, text in self.sections)
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self))
+
+    @classmethod
+    def from_json(cls, payload) -> "DatasetProfile":
+        return cls(**json.loads(payload))
+
+
+class ProfileCache:
+    """Two-level (process LRU/TTL, then Redis) cache of dataset profiles."""
+
+    def __init__(self):
+        self.ttl = config.PROFILE_CACHE_TTL_SECONDS
+        self._local = TTLCache(config.PROFILE_CACHE_SIZE, ttl=self.ttl)
+
+    def _redis_key(self, dataset_id: str) -> str:
+        return f"profile:v{PROFILE_VERSION}:{dataset_id}"
+
+    def get(self, dataset_id: str) -> Optional[DatasetProfile]:
+        profile = self._local.get(dataset_id)
+        if profile is not None:
+            metrics.cache_lookup("profile", "local")
+            return profile
+
+        try:
+            payload = redis_instance.get(self._redis_key(dataset_id))
+        except redis.RedisError as e:
+            logger.warning(f"Profile cache lookup failed: {e}")
+            return None
+        if payload is None:
+            metrics.cache_lookup("profile", "miss")
+            return None
+        metrics.cache_lookup("profile", "shared")
+
+        profile = DatasetProfile.from_json(payload)
+        self._local.set(dataset_id, profile)
+        return profile
+
+    def set(self, profile: DatasetProfile):
+        self._local.set(profile.dataset_id, profile)
+        try:
+            redis_instance.set(self._redis_key(profile.dataset_id), profile.to_json(), ex=self.ttl)
+        except redis.RedisError as e:
+            logger.warning(f"Profile cache write failed: {e}")
+
+
+profile_cache = ProfileCache()
+
+# Profile states by dataset ID, for extend_profile; not shared between workers
+_states = TTLCache(config.PROFILE_CACHE_SIZE)
+
+
+def _render(dataset_id: str, df: pd.DataFrame, state: ProfileState) -> DatasetProfile:
+    _states.set(dataset_id, state)
+    profile = DatasetProfile(
+        dataset_id=dataset_id,
+        rows=len(df),
+        columns=[str(col) for col in df.columns],
+        sections=[list(section) for section in render_sections(state)],
+    )
+    profile_cache.set(profile)
+    return profile
+
+
+def get_profile(df: pd.DataFrame, dataset_id: str = None) -> DatasetProfile:
+    """
+    Return the cached profile for a dataset, computing it on a miss.
+
+    Args:
+        df: The dataset
+        dataset_id: Content hash from the dataset store, computed if omitted
+
+    Returns:
+        The dataset's profile
+    """
+    if dataset_id is None:
+        dataset_id = content_hash(df)
+
+    profile = profile_cache.get(dataset_id)
+    if profile is None:
+        profile = _render(dataset_id, df, profile_frame(df))
+    return profile
+
+
+def extend_profile(
+    base_id: str, dataset_id: str, df: pd.DataFrame, added: pd.DataFrame
+) -> Optional[DatasetProfile]:
+    """
+    Profile a dataset made of a profiled dataset plus appended rows.
+
+    Only the appended rows are profiled, sampled at the same rate as the
+    base dataset was so the merged counts stay unbiased.
+
+    Args:
+        base_id: Dataset ID of the rows that were appended to
+        dataset_id: Dataset ID of the combined dataset
+        df: The combined dataset
+        added: The appended rows
+
+    Returns:
+        The combined dataset's profile, or None if this worker doesn't hold
+        the base dataset's profile state
+    """
+    base = _states.get(base_id)
+    if base is None:
+        return None
+
+    # The base state still backs the base dataset's profile
+    state = copy.deepcopy(base)
+    rate = base.sampled_rows / base.rows if base.rows else 1.0
+    row_budget = max(1, round(len(added) * rate)) if rate < 1 else 0
+    state.merge(profile_frame(added, row_budget=row_budget))
+    return _render(dataset_id, df, state)
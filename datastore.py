@@ -0,0 +1,240 @@
+"""
+Server-side dataset store.
+
+Datasets are written once as Parquet, keyed by a hash of their content, so
+callbacks only pass a short dataset ID between the browser and the server
+instead of the whole frame.
+
+Uploads are also recorded by a hash of the uploaded file's bytes, mapping
+it to the datasets its sheets were parsed into, so an identical re-upload
+is served from the stored Parquet without being parsed again.
+"""
+
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+from typing import List, Optional, Tuple
+
+import pandas as pd
+import redis
+
+from cache import TTLCache
+from config import config
+from constants import redis_instance
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_DATASET_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+class DatasetStoreError(Exception):
+    """Raised when a dataset can't be written to the store."""
+
+
+def content_hash(df: pd.DataFrame) -> str:
+    """Return a stable hash of a DataFrame's columns, dtypes and values."""
+    digest = hashlib.sha256()
+    digest.update(repr([(str(col), str(dtype)) for col, dtype in df.dtypes.items()]).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return digest.hexdigest()[:32]
+
+
+def is_valid_dataset_id(dataset_id) -> bool:
+    """Dataset IDs come back from the browser, so only accept plain hex hashes."""
+    return isinstance(dataset_id, str) and bool(_DATASET_ID_RE.match(dataset_id))
+
+
+def _to_parquet_bytes(df: pd.DataFrame) -> bytes:
+    buffer = io.BytesIO()
+    try:
+        df.to_parquet(buffer, index=False)
+    except (TypeError, ValueError) as e:
+        # Mixed-type object columns (e.g. numbers and text in one CSV column)
+        # can't be written as Arrow; store them as strings instead.
+        logger.info(f"Coercing object columns to strings for Parquet: {e}")
+        buffer = io.BytesIO()
+        object_columns = df.select_dtypes(include=["object"]).columns
+        df.astype({col: "string" for col in object_columns}).to_parquet(buffer, index=False)
+    return buffer.getvalue()
+
+
+class DatasetStore:
+    """Content-addressed Parquet store backed by local disk or Redis."""
+
+    def __init__(self, backend: str = None, directory: str = None):
+        self.backend = backend or config.DATASET_STORE_BACKEND
+        self.directory = directory or config.DATASET_STORE_DIR
+        self.ttl = config.DATASET_TTL_SECONDS
+        self._frames = TTLCache(config.DATASET_MEMORY_CACHE_SIZE)
+
+    def _path(self, dataset_id: str) -> str:
+        return os.path.join(self.directory, f"{dataset_id}.parquet")
+
+    def _redis_key(self, dataset_id: str) -> str:
+        return f"dataset:{dataset_id}"
+
+    def exists(self, dataset_id: str) -> bool:
+        if not is_valid_dataset_id(dataset_id):
+            return False
+        if dataset_id in self._frames:
+            return True
+        return self._stored(dataset_id)
+
+    def _stored(self, dataset_id: str) -> bool:
+        """Whether the shared store (not just this worker's memory) has the dataset."""
+        if self.backend == "redis":
+            try:
+                return bool(redis_instance.exists(self._redis_key(dataset_id)))
+            except redis.RedisError as e:
+                logger.warning(f"Dataset store lookup failed: {e}")
+                return False
+        return os.path.exists(self._path(dataset_id))
+
+    def put(self, df: pd.DataFrame, dataset_id: str = None) -> str:
+        """
+        Store a DataFrame and return its dataset ID.
+
+        Storing a frame whose content is already present is a no-op apart
+        from refreshing the in-process cache. A frame that is only left in
+        this worker's memory (its stored copy expired) is written again.
+
+        Args:
+            df: DataFrame to store
+            dataset_id: The frame's content hash, if already known
+
+        Returns:
+            Content-hash dataset ID
+
+        Raises:
+            DatasetStoreError: If the dataset store can't be written
+        """
+        dataset_id = dataset_id or content_hash(df)
+        if not self._stored(dataset_id):
+            payload = _to_parquet_bytes(df)
+            try:
+                if self.backend == "redis":
+                    redis_instance.set(self._redis_key(dataset_id), payload, ex=self.ttl)
+                else:
+                    os.makedirs(self.directory, exist_ok=True)
+                    # Write then rename so other workers never read a partial file
+                    tmp_path = f"{self._path(dataset_id)}.{os.getpid()}.tmp"
+                    with open(tmp_path, "wb") as f:
+                        f.write(payload)
+                    os.replace(tmp_path, self._path(dataset_id))
+            except (OSError, redis.RedisError) as e:
+                logger.error(f"Failed to store dataset {dataset_id} ({len(payload)} bytes): {e}")
+                raise DatasetStoreError("The dataset couldn't be saved on the server. Please try again.") from e
+            logger.info(f"Stored dataset {dataset_id} ({len(df)} rows, {len(payload)} bytes)")
+        self._frames.set(dataset_id, df)
+        return dataset_id
+
+    def get(self, dataset_id: str) -> Optional[pd.DataFrame]:
+        """
+        Load a stored DataFrame.
+
+        The returned frame may be shared with other callbacks in this worker
+        and must be treated as read-only.
+
+        Args:
+            dataset_id: ID returned by put()
+
+        Returns:
+            The DataFrame, or None if the ID is unknown or has expired
+        """
+        if not is_valid_dataset_id(dataset_id):
+            return None
+
+        df = self._frames.get(dataset_id)
+        if df is not None:
+            metrics.cache_lookup("dataset", "local")
+            return df
+
+        try:
+            if self.backend == "redis":
+                payload = redis_instance.get(self._redis_key(dataset_id))
+                if payload is None:
+                    metrics.cache_lookup("dataset", "miss")
+                    return None
+                df = pd.read_parquet(io.BytesIO(payload))
+            else:
+                path = self._path(dataset_id)
+                if not os.path.exists(path):
+                    metrics.cache_lookup("dataset", "miss")
+                    return None
+                df = pd.read_parquet(path)
+        except (OSError, redis.RedisError) as e:
+            logger.error(f"Failed to load dataset {dataset_id}: {e}")
+            return None
+
+        metrics.cache_lookup("dataset", "shared")
+        self._frames.set(dataset_id, df)
+        return df
+
+    def _upload_path(self, upload_id: str) -> str:
+        return os.path.join(self.directory, f"upload-{upload_id}.json")
+
+    def put_upload(self, upload_id: str, sheets: List[Tuple[str, str, int]]):
+        """
+        Record the datasets an uploaded file was parsed into.
+
+        Args:
+            upload_id: Hash of the uploaded file's bytes
+            sheets: (sheet name, dataset ID, rows) for each sheet, in workbook order
+        """
+        if not is_valid_dataset_id(upload_id):
+            return
+        payload = json.dumps(sheets)
+        try:
+            if self.backend == "redis":
+                redis_instance.set(f"upload:{upload_id}", payload, ex=self.ttl)
+            else:
+                os.makedirs(self.directory, exist_ok=True)
+                tmp_path = f"{self._upload_path(upload_id)}.{os.getpid()}.tmp"
+                with open(tmp_path, "w") as f:
+                    f.write(payload)
+                os.replace(tmp_path, self._upload_path(upload_id))
+        except (OSError, redis.RedisError) as e:
+            logger.warning(f"Failed to record upload {upload_id}: {e}")
+
+    def get_upload(self, upload_id: str) -> Optional[List[Tuple[str, str, int]]]:
+        """
+        Look up the datasets a previously uploaded file was parsed into.
+
+        Args:
+            upload_id: Hash of the uploaded file's bytes
+
+        Returns:
+            (sheet name, dataset ID, rows) for each sheet, or None if the file
+            hasn't been seen or any of its datasets has expired
+        """
+        if not is_valid_dataset_id(upload_id):
+            return None
+        try:
+            if self.backend == "redis":
+                payload = redis_instance.get(f"upload:{upload_id}")
+            elif os.path.exists(self._upload_path(upload_id)):
+                with open(self._upload_path(upload_id)) as f:
+                    payload = f.read()
+            else:
+                payload = None
+        except (OSError, redis.RedisError) as e:
+            logger.warning(f"Upload lookup failed: {e}")
+            return None
+        if payload is None:
+            metrics.cache_lookup("upload", "miss")
+            return None
+
+        sheets = [tuple(sheet) for sheet in json.loads(payload)]
+        if not all(self.exists(dataset_id) for _, dataset_id, _ in sheets):
+            metrics.cache_lookup("upload", "miss")
+            return None
+        metrics.cache_lookup("upload", "shared")
+        return sheets
+
+
+# Global instance
+dataset_store = DatasetStore()
@@ -0,0 +1,129 @@
+"""
+The sample dataset shown on the home page, loaded lazily from a local file.
+
+The bundled CSV is parsed once and cached as an uncompressed Arrow (Feather
+v2) file keyed by the source's size and modification time, with the content
+hash stored in the file's schema metadata. Later loads memory-map the cache
+instead of parsing, so workers share the pages through the OS page cache,
+and a frame loaded before gunicorn forks (``--preload``) is shared
+copy-on-write. Nothing is read at import: the app factory loads it when
+PRELOAD_DEFAULT_DATASET is set, and otherwise the first page view does.
+"""
+
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import pandas as pd
+import pyarrow as pa
+from pyarrow import feather
+
+from config import config
+from datastore import DatasetStoreError, content_hash, dataset_store
+
+logger = logging.getLogger(__name__)
+
+_METADATA_KEY = b"dolfin.dataset_id"
+
+
+@dataclass
+class DefaultDataset:
+    """The home page's sample frame and its dataset store ID."""
+
+    df: pd.DataFrame
+    dataset_id: str
+
+
+_lock = threading.Lock()
+_loaded: Optional[DefaultDataset] = None
+
+
+def _cache_path(source: str) -> str:
+    stat = os.stat(source)
+    stem = os.path.splitext(os.path.basename(source))[0]
+    return os.path.join(
+        config.DEFAULT_DATASET_CACHE_DIR, f"{stem}-{stat.st_size}-{stat.st_mtime_ns}.arrow"
+    )
+
+
+def _read_cache(path: str) -> Optional[DefaultDataset]:
+    try:
+        table = feather.read_table(path, memory_map=True)
+    except (OSError, pa.ArrowInvalid) as e:
+        logger.warning(f"Ignoring unreadable default dataset cache {path}: {e}")
+        return None
+    dataset_id = (table.schema.metadata or {}).get(_METADATA_KEY)
+    if dataset_id is None:
+        return None
+    return DefaultDataset(table.to_pandas(split_blocks=True), dataset_id.decode())
+
+
+def _write_cache(path: str, dataset: DefaultDataset):
+    table = pa.Table.from_pandas(dataset.df, preserve_index=False)
+    table = table.replace_schema_metadata(
+        {**(table.schema.metadata or {}), _METADATA_KEY: dataset.dataset_id.encode()}
+    )
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write then rename so other workers never map a partial file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        # Memory-mapping needs uncompressed buffers
+        feather.write_feather(table, tmp_path, compression="uncompressed")
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Could not cache the default dataset: {e}")
+
+
+def _store(dataset: DefaultDataset) -> DefaultDataset:
+    """Put the frame in the dataset store, again if its stored copy has expired."""
+    try:
+        dataset_store.put(dataset.df, dataset.dataset_id)
+    except DatasetStoreError as e:
+        logger.warning(f"Could not store the default dataset: {e}")
+    return dataset
+
+
+def load_default_dataset() -> DefaultDataset:
+    """
+    Return the default dataset, loading it on first use.
+
+    The parsed frame is kept for the life of the process, but it is put in
+    the dataset store again on every call, so the ID handed to the page is
+    still stored after the earlier copy expires.
+
+    Returns:
+        The frame and its dataset store ID (the frame is also put in the store)
+
+    Raises:
+        OSError: If the configured DEFAULT_DATASET_PATH can't be read
+    """
+    global _loaded
+    if _loaded is not None:
+        return _store(_loaded)
+
+    with _lock:
+        if _loaded is not None:
+            return _store(_loaded)
+
+        start = time.perf_counter()
+        source = config.DEFAULT_DATASET_PATH
+        path = _cache_path(source)
+        dataset = _read_cache(path) if os.path.exists(path) else None
+        if dataset is None:
+            df = pd.read_csv(source)
+            dataset = DefaultDataset(df, content_hash(df))
+            _write_cache(path, dataset)
+            how = "parsed"
+        else:
+            how = "memory-mapped"
+
+        _store(dataset)
+        logger.info(
+            f"Default dataset {os.path.basename(source)} {how} in "
+            f"{time.perf_counter() - start:.3f}s ({len(dataset.df)} rows)"
+        )
+        _loaded = dataset
+        return _loaded
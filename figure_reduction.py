@@ -0,0 +1,228 @@
+"""
+Reduce chart editor figures to a point budget before they are saved.
+
+Saved figures are embedded in the page, stored for shared links and sent to
+the model for summaries, so every trace point is paid for several times.
+Line traces are downsampled with LTTB (or min/max decimation), unordered
+scatter clouds with min/max decimation, and bar and histogram traces over
+the budget with text categories are pre-aggregated to the categories with
+the largest absolute totals plus "Other". Bars on a number or date axis are
+min/max decimated instead. Traces within the budget are left as they are.
+"""
+
+import copy
+import logging
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Per-point attributes that must be subset together with x/y
+_POINT_KEYS = ("x", "y", "text", "hovertext", "customdata", "ids")
+_MARKER_POINT_KEYS = ("color", "size", "symbol", "opacity")
+
+
+def _as_float(values) -> Optional[np.ndarray]:
+    """Numeric positions for x values (numbers or dates), or None if they're categories."""
+    series = pd.Series(values)
+    numeric = pd.to_numeric(series, errors="coerce")
+    if numeric.notna().all():
+        return numeric.to_numpy(dtype=np.float64)
+    dates = pd.to_datetime(series, errors="coerce", format="mixed")
+    if dates.notna().all():
+        return dates.astype("int64").to_numpy(dtype=np.float64)
+    return None
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+
+    Args:
+        x: Sorted x positions
+        y: y values (NaN points are never picked)
+        threshold: Number of points to keep
+
+    Returns:
+        Indices of the kept points, in order
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        # Average of the next bucket is the third triangle vertex
+        next_start, next_end = end, edges[i + 2] if i + 2 < len(edges) else n
+        next_x = x[next_start:next_end].mean()
+        next_y = np.nanmean(y[next_start:next_end]) if np.isfinite(y[next_start:next_end]).any() else y[previous]
+
+        area = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        area = np.where(np.isnan(area), -1, area)
+        previous = start + int(np.argmax(area))
+        selected[i + 1] = previous
+    return selected
+
+
+def minmax_decimate(y: np.ndarray, threshold: int) -> np.ndarray:
+    """Keep the minimum and maximum of each of threshold/2 equal buckets."""
+    n = len(y)
+    if threshold >= n or threshold < 2:
+        return np.arange(n)
+
+    filled = np.where(np.isnan(y), np.nanmean(y) if np.isfinite(y).any() else 0, y)
+    keep = [0, n - 1]
+    # Two points per bucket plus both ends stays within the threshold
+    for bucket in np.array_split(np.arange(n), max(1, (threshold - 2) // 2)):
+        if len(bucket):
+            keep.append(bucket[int(np.argmin(filled[bucket]))])
+            keep.append(bucket[int(np.argmax(filled[bucket]))])
+    return np.unique(keep)
+
+
+def _subset_points(trace: dict, indices: np.ndarray, n: int) -> dict:
+    def take(values):
+        if isinstance(values, (list, tuple)) and len(values) == n:
+            return [values[i] for i in indices.tolist()]
+        return values
+
+    for key in _POINT_KEYS:
+        if key in trace:
+            trace[key] = take(trace[key])
+    if isinstance(trace.get("marker"), dict):
+        for key in _MARKER_POINT_KEYS:
+            if key in trace["marker"]:
+                trace["marker"][key] = take(trace["marker"][key])
+    return trace
+
+
+def _reduce_scatter(trace: dict, budget: int) -> dict:
+    y_values = trace.get("y")
+    if not isinstance(y_values, (list, tuple)) or len(y_values) <= budget:
+        return trace
+    n = len(y_values)
+    y = pd.to_numeric(pd.Series(y_values), errors="coerce").to_numpy(dtype=np.float64)
+
+    x_values = trace.get("x")
+    x = _as_float(x_values) if isinstance(x_values, (list, tuple)) and len(x_values) == n else None
+    ordered = x is None or bool(np.all(np.diff(x) >= 0))
+    if x is None:
+        x = np.arange(n, dtype=np.float64)
+
+    lines = "lines" in str(trace.get("mode", "lines"))
+    if lines and ordered and config.FIGURE_LINE_DOWNSAMPLER == "lttb":
+        indices = lttb(x, y, budget)
+    else:
+        indices = minmax_decimate(y, budget)
+    return _subset_points(trace, indices, n)
+
+
+def _top_categories(categories: pd.Series, values: pd.Series, limit: int):
+    totals = values.groupby(categories, sort=False).sum()
+    if len(totals) > limit:
+        # By magnitude, so large negative totals (expenses, write-downs) are kept
+        top = totals.loc[totals.abs().nlargest(limit - 1).index]
+        totals = pd.concat([top, pd.Series({"Other": totals.drop(top.index).sum()})])
+    return [str(c) for c in totals.index], totals.tolist()
+
+
+def _reduce_bar(trace: dict, budget: int) -> dict:
+    horizontal = trace.get("orientation") == "h"
+    category_key, value_key = ("y", "x") if horizontal else ("x", "y")
+    categories, values = trace.get(category_key), trace.get(value_key)
+    if not isinstance(categories, (list, tuple)) or not isinstance(values, (list, tuple)):
+        return trace
+    if len(categories) != len(values) or len(values) <= budget:
+        return trace
+
+    if _as_float(categories) is not None:
+        # Number and date axes keep their positions and type; only the point
+        # count is reduced, like a line
+        y = pd.to_numeric(pd.Series(values), errors="coerce").to_numpy(dtype=np.float64)
+        return _subset_points(trace, minmax_decimate(y, budget), len(values))
+
+    numeric = pd.to_numeric(pd.Series(values), errors="coerce").fillna(0)
+    labels, totals = _top_categories(pd.Series(categories).astype(str), numeric, config.FIGURE_MAX_CATEGORIES)
+    reduced = {k: v for k, v in trace.items() if k not in _POINT_KEYS}
+    reduced[category_key], reduced[value_key] = labels, totals
+    return reduced
+
+
+def _reduce_histogram(trace: dict) -> dict:
+    horizontal = trace.get("orientation") == "h" or ("y" in trace and "x" not in trace)
+    key = "y" if horizontal else "x"
+    samples = trace.get(key)
+    if not isinstance(samples, (list, tuple)) or len(samples) <= config.FIGURE_POINT_BUDGET:
+        return trace
+    if trace.get("histfunc", "count") != "count" or ("x" in trace and "y" in trace):
+        # Aggregating histograms depend on the paired values; leave them alone
+        return trace
+
+    series = pd.Series(samples)
+    numeric = pd.to_numeric(series, errors="coerce")
+    if numeric.notna().all():
+        counts, edges = np.histogram(numeric.to_numpy(dtype=np.float64), bins=config.FIGURE_HISTOGRAM_BINS)
+        centers = ((edges[:-1] + edges[1:]) / 2).tolist()
+        positions, totals = centers, counts.tolist()
+        width = float(edges[1] - edges[0])
+    else:
+        positions, totals = _top_categories(
+            series.astype(str), pd.Series(1, index=series.index), config.FIGURE_MAX_CATEGORIES
+        )
+        width = None
+
+    reduced = {
+        k: v for k, v in trace.items()
+        if k not in _POINT_KEYS + ("histfunc", "histnorm", "nbinsx", "nbinsy", "xbins", "ybins", "autobinx", "autobiny")
+    }
+    reduced["type"] = "bar"
+    reduced["x" if not horizontal else "y"] = positions
+    reduced["y" if not horizontal else "x"] = totals
+    if horizontal:
+        reduced["orientation"] = "h"
+    if width is not None:
+        reduced["width"] = width
+    return reduced
+
+
+def reduce_figure(figure: dict, point_budget: int = None) -> dict:
+    """
+    Return a copy of a figure whose traces fit within a point budget.
+
+    Args:
+        figure: Plotly figure dict from the chart editor
+        point_budget: Points allowed across all traces (defaults to config setting)
+
+    Returns:
+        Reduced figure dict (the input is not modified)
+    """
+    if not isinstance(figure, dict) or not figure.get("data"):
+        return figure
+    point_budget = point_budget or config.FIGURE_POINT_BUDGET
+
+    data = figure["data"]
+    per_trace = max(config.FIGURE_MIN_TRACE_POINTS, point_budget // len(data))
+    reduced = []
+    for trace in data:
+        trace = copy.deepcopy(trace)
+        kind = trace.get("type", "scatter")
+        if kind in ("scatter", "scattergl"):
+            trace = _reduce_scatter(trace, per_trace)
+        elif kind == "bar":
+            trace = _reduce_bar(trace, per_trace)
+        elif kind == "histogram":
+            trace = _reduce_histogram(trace)
+        reduced.append(trace)
+
+    return {**figure, "data": reduced}
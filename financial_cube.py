@@ -0,0 +1,247 @@
+"""
+Pre-aggregated roll-ups of the YTD financial ledger.
+
+Ledgers with the workbook's columns (company, ga_code, consolidated_accounts,
+sum_eje, sum_upload, category) are summed once per dataset into a cube of
+company x category x GA code prefix cells, with every coarser roll-up
+(by company, by category, ..., grand total) computed alongside. Roll-up
+questions are then answered from a handful of rows instead of rescanning
+the ledger, and the cube also feeds the prompt context and an aggregated
+data source in the chart editor.
+
+Two variances are carried with the amounts:
+
+    variance     = sum_upload - consolidated_accounts
+    unreconciled = consolidated_accounts - sum_upload - sum_eje
+
+i.e. how far the upload is from the consolidated figure, and how much of
+that gap the sum_eje adjustments don't explain.
+"""
+
+import itertools
+import logging
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from cache import TTLCache
+from config import config
+from datastore import content_hash
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_COLUMNS = ("company", "ga_code", "category", "consolidated_accounts", "sum_eje", "sum_upload")
+DIMENSIONS = ("company", "category", "ga_prefix")
+AMOUNTS = ("consolidated_accounts", "sum_eje", "sum_upload")
+MEASURES = AMOUNTS + ("variance", "unreconciled", "rows")
+
+# Prefix for the cube's columns in the chart editor's data sources
+DATA_SOURCE_PREFIX = "agg_"
+
+
+def is_financial(df: pd.DataFrame) -> bool:
+    """Whether a frame has the YTD workbook's ledger columns."""
+    return all(col in df.columns for col in REQUIRED_COLUMNS) and all(
+        pd.api.types.is_numeric_dtype(df[col]) for col in AMOUNTS
+    )
+
+
+def _ga_prefix(codes: pd.Series) -> pd.Series:
+    numeric = pd.to_numeric(codes, errors="coerce")
+    text = numeric.astype("Int64").astype(str) if numeric.notna().all() else codes.astype(str).str.strip()
+    return text.str[: config.CUBE_GA_PREFIX_LENGTH]
+
+
+@dataclass
+class FinancialCube:
+    """Roll-ups of a ledger keyed by the tuple of dimensions they're grouped by."""
+
+    dataset_id: str
+    rollups: Dict[tuple, pd.DataFrame]
+
+    def __post_init__(self):
+        # Plain dicts of label tuple -> measure vector, so lookups skip pandas indexing
+        self._cells = {
+            dimensions: {
+                (labels if isinstance(labels, tuple) else (labels,)): values
+                for labels, values in zip(frame.index, frame.to_numpy(dtype=np.float64))
+            }
+            for dimensions, frame in self.rollups.items()
+        }
+
+    @property
+    def cells(self) -> pd.DataFrame:
+        """The finest level: one row per company x category x GA prefix."""
+        return self.rollups[DIMENSIONS]
+
+    def rollup(self, dimensions=()) -> pd.DataFrame:
+        """
+        Totals grouped by some of the cube's dimensions.
+
+        Args:
+            dimensions: Any of "company", "category", "ga_prefix", in any order
+
+        Returns:
+            Frame indexed by the dimensions (a single "total" row for none)
+        """
+        key = tuple(d for d in DIMENSIONS if d in dimensions)
+        return self.rollups[key]
+
+    def query(self, filters: Dict[str, list] = None, group: str = None,
+              measures: List[str] = None) -> Optional[pd.DataFrame]:
+        """
+        Sum measures for the rows matching filters, optionally per group.
+
+        Args:
+            filters: Dimension -> allowed values
+            group: Dimension to group by, or None for a single total
+            measures: Measures to return (defaults to all)
+
+        Returns:
+            The totals, or None if the request uses something the cube doesn't have
+        """
+        filters = filters or {}
+        measures = list(measures or MEASURES)
+        needed = set(filters) | ({group} if group else set())
+        if not needed <= set(DIMENSIONS) or not set(measures) <= set(MEASURES):
+            return None
+
+        key = tuple(d for d in DIMENSIONS if d in needed)
+        allowed = [(key.index(d), {str(v) for v in values}) for d, values in filters.items()]
+        position = key.index(group) if group else None
+
+        totals = {}
+        for labels, values in self._cells[key].items():
+            if all(labels[i] in accepted for i, accepted in allowed):
+                label = labels[position] if group else "total"
+                totals[label] = totals[label] + values if label in totals else values
+
+        columns = [MEASURES.index(m) for m in measures]
+        frame = pd.DataFrame(
+            [values[columns] for values in totals.values()] or np.zeros((0, len(columns))),
+            index=pd.Index(list(totals), name=group),
+            columns=measures,
+        )
+        if "rows" in measures:
+            frame["rows"] = frame["rows"].astype("int64")
+        return frame
+
+    def data_source(self) -> dict:
+        """Cube cells as agg_* columns for the chart editor."""
+        cells = self.cells.reset_index()
+        return {f"{DATA_SOURCE_PREFIX}{col}": cells[col].tolist() for col in cells.columns}
+
+    def render_context(self) -> str:
+        """Prompt section with the main roll-ups."""
+        columns = ["sum_upload", "consolidated_accounts", "sum_eje", "variance", "unreconciled"]
+
+        def table(frame):
+            return frame[columns].to_string(float_format=lambda v: f"{v:,.2f}")
+
+        return "\n".join([
+            "\nFinancial Roll-ups (exact totals over all rows; variance = sum_upload - "
+            "consolidated_accounts, unreconciled = consolidated_accounts - sum_upload - sum_eje):",
+            "\nBy category:",
+            table(self.rollup(("category",))),
+            "\nBy company:",
+            table(self.rollup(("company",))),
+            "\nBy company and category:",
+            table(self.rollup(("company", "category"))),
+        ])
+
+
+def _cells(df: pd.DataFrame) -> pd.DataFrame:
+    """Sum a ledger's rows into company x category x GA prefix cells."""
+    frame = pd.DataFrame({
+        "company": df["company"].astype(str),
+        "category": df["category"].astype(str),
+        "ga_prefix": _ga_prefix(df["ga_code"]),
+    })
+    for col in AMOUNTS:
+        frame[col] = pd.to_numeric(df[col], errors="coerce").fillna(0.0).astype("float64")
+    frame["variance"] = frame["sum_upload"] - frame["consolidated_accounts"]
+    frame["unreconciled"] = frame["consolidated_accounts"] - frame["sum_upload"] - frame["sum_eje"]
+    frame["rows"] = 1
+    return frame.groupby(list(DIMENSIONS), sort=True)[list(MEASURES)].sum()
+
+
+def _from_cells(cells: pd.DataFrame, dataset_id: str) -> FinancialCube:
+    # Coarser roll-ups are sums of the (small) cell table, not of the ledger
+    rollups = {DIMENSIONS: cells}
+    flat = cells.reset_index()
+    for size in range(len(DIMENSIONS) - 1, 0, -1):
+        for dimensions in itertools.combinations(DIMENSIONS, size):
+            rollups[dimensions] = flat.groupby(list(dimensions), sort=True)[list(MEASURES)].sum()
+    rollups[()] = cells.sum().to_frame("total").T
+    return FinancialCube(dataset_id=dataset_id, rollups=rollups)
+
+
+def build_cube(df: pd.DataFrame, dataset_id: str) -> FinancialCube:
+    """
+    Aggregate a financial ledger into a cube of roll-ups.
+
+    Args:
+        df: Ledger with the REQUIRED_COLUMNS
+        dataset_id: Dataset store ID of the ledger
+
+    Returns:
+        The cube
+    """
+    return _from_cells(_cells(df), dataset_id)
+
+
+def extend_cube(
+    cube: FinancialCube, dataset_id: str, added: pd.DataFrame, removed: pd.DataFrame = None
+) -> FinancialCube:
+    """
+    Update a cube for rows added to (and removed from) its ledger without rescanning it.
+
+    The measures are sums, so the cells of the added rows are added and
+    those of the removed rows subtracted; the coarser roll-ups are then
+    re-summed from the cells.
+
+    Args:
+        cube: Cube of the original ledger
+        dataset_id: Dataset store ID of the updated ledger
+        added: Rows added to the ledger, including the new versions of changed rows
+        removed: Rows removed from the ledger, including the old versions of changed rows
+
+    Returns:
+        The updated cube, which is also cached under dataset_id
+    """
+    cells = cube.cells.add(_cells(added), fill_value=0)
+    if removed is not None and len(removed):
+        cells = cells.sub(_cells(removed), fill_value=0)
+    cells = cells[cells["rows"] > 0].sort_index()
+    cells["rows"] = cells["rows"].astype("int64")
+    updated = _from_cells(cells, dataset_id)
+    _cubes.set(dataset_id, updated)
+    return updated
+
+
+_cubes = TTLCache(config.CUBE_CACHE_SIZE)
+
+
+def get_cube(df: pd.DataFrame, dataset_id: str = None) -> Optional[FinancialCube]:
+    """
+    Return the cached cube for a financial dataset, building it on a miss.
+
+    Args:
+        df: The dataset
+        dataset_id: Content hash from the dataset store, computed if omitted
+
+    Returns:
+        The cube, or None if the dataset isn't a financial ledger
+    """
+    if not is_financial(df):
+        return None
+    if dataset_id is None:
+        dataset_id = content_hash(df)
+
+    cube = _cubes.get(dataset_id)
+    if cube is None:
+        cube = build_cube(df, dataset_id)
+        _cubes.set(dataset_id, cube)
+    return cube
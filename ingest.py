@@ -0,0 +1,383 @@
+"""
+Incremental ingestion of uploaded CSV and Excel files.
+
+The base64 upload is decoded in slices into a spooled temporary file, parsed
+in row chunks (chunked read_csv, openpyxl read-only mode for workbooks) and
+each chunk is shrunk to compact dtypes before the chunks are combined, so the
+full decoded text and an object-typed copy of the frame never sit in memory
+together.
+
+Every sheet is stored in the dataset store, and the upload is recorded by a
+hash of its bytes: uploading an identical file again loads the stored
+Parquet instead of parsing it. Large workbooks with several sheets are
+parsed one sheet per process in a small pool.
+"""
+
+import base64
+import concurrent.futures
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from config import config
+from datastore import DatasetStoreError, dataset_store
+
+logger = logging.getLogger(__name__)
+
+CSV_EXTENSIONS = {".csv", ".txt"}
+EXCEL_EXTENSIONS = {".xlsx", ".xlsm"}
+SUPPORTED_EXTENSIONS = CSV_EXTENSIONS | EXCEL_EXTENSIONS
+
+# Decode slice size; must be a multiple of 4 so slices split on base64 quanta
+_DECODE_SLICE = 4 * 1024 * 1024
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+class IngestError(ValueError):
+    """Raised when an upload can't be parsed into a dataset."""
+
+
+@dataclass
+class IngestResult:
+    """Stored sheets of an upload plus memory and timing figures."""
+
+    filename: str
+    sheets: List[Tuple[str, str, int]]  # (sheet name, dataset ID, rows) in workbook order
+    df: pd.DataFrame  # The first sheet, used as the active dataset
+    bytes_in: int
+    seconds: float
+    process_peak_rss_bytes: int  # The worker's lifetime high-water mark, not this upload's
+    peak_traced_bytes: Optional[int] = None
+    frame_bytes: Dict[str, int] = field(default_factory=dict)
+    cached: bool = False  # Served from an earlier upload of the same file
+
+    @property
+    def dataset_id(self) -> str:
+        return self.sheets[0][1]
+
+    def summary(self) -> str:
+        rows = sum(sheet_rows for _, _, sheet_rows in self.sheets)
+        text = f"{self.filename}: {rows} rows in {len(self.sheets)} sheet(s), {self.bytes_in / 1e6:.1f} MB uploaded, "
+        if self.cached:
+            return text + f"unchanged since it was last uploaded, loaded in {self.seconds:.2f}s"
+        text += (
+            f"{sum(self.frame_bytes.values()) / 1e6:.1f} MB in memory, "
+            f"process peak RSS {self.process_peak_rss_bytes / 1e6:.0f} MB, {self.seconds:.2f}s"
+        )
+        if self.peak_traced_bytes is not None:
+            text += f", peak traced {self.peak_traced_bytes / 1e6:.1f} MB"
+        return text
+
+
+def decode_upload(contents: str, digest=None):
+    """
+    Decode a dcc.Upload data URL into a seekable binary file.
+
+    Small files stay in memory; larger ones spill to disk.
+
+    Args:
+        contents: "data:<type>;base64,<payload>" string from dcc.Upload
+        digest: hashlib object updated with the decoded bytes
+
+    Returns:
+        Binary file object positioned at the start
+    """
+    try:
+        header_end = contents.index(",")
+    except ValueError:
+        raise IngestError("Upload is not a base64 data URL.")
+
+    spool = tempfile.SpooledTemporaryFile(max_size=config.INGEST_SPOOL_MAX_BYTES)
+    for start in range(header_end + 1, len(contents), _DECODE_SLICE):
+        data = base64.b64decode(contents[start:start + _DECODE_SLICE])
+        if digest is not None:
+            digest.update(data)
+        spool.write(data)
+    spool.seek(0)
+    return spool
+
+
+def compact_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Shrink a chunk to compact dtypes.
+
+    Text columns become categoricals, integer columns that fit become int32
+    and, if enabled, floats become float32.
+    """
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_bool_dtype(series):
+            continue
+        if pd.api.types.is_integer_dtype(series):
+            if len(series) and series.min() >= -(2 ** 31) and series.max() < 2 ** 31:
+                df[col] = series.astype("int32")
+        elif pd.api.types.is_float_dtype(series):
+            if config.INGEST_FLOAT32:
+                df[col] = series.astype("float32")
+        elif pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series):
+            df[col] = series.astype("category")
+    return df
+
+
+def combine_frames(chunks: list) -> pd.DataFrame:
+    """Concatenate compacted chunks, unifying categoricals across chunks."""
+    if not chunks:
+        return pd.DataFrame()
+    if len(chunks) == 1:
+        df = chunks[0]
+    else:
+        columns = {}
+        for col in chunks[0].columns:
+            parts = [chunk[col] for chunk in chunks]
+            if all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+                columns[col] = pd.Series(union_categoricals(parts, ignore_order=True))
+            else:
+                columns[col] = pd.concat(parts, ignore_index=True)
+        df = pd.DataFrame(columns)
+
+    # Mostly-unique text (ids, free text) is cheaper as plain strings
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype) and len(df):
+            if len(df[col].cat.categories) / len(df) > config.INGEST_CATEGORY_MAX_RATIO:
+                df[col] = df[col].astype(df[col].cat.categories.dtype)
+    return df
+
+
+def _read_csv(stream) -> Dict[str, pd.DataFrame]:
+    text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+    try:
+        reader = pd.read_csv(text, chunksize=config.INGEST_CHUNK_ROWS)
+        chunks = [compact_dtypes(chunk) for chunk in reader]
+    except UnicodeDecodeError:
+        raise IngestError("CSV files must be UTF-8 encoded.")
+    except (pd.errors.ParserError, pd.errors.EmptyDataError) as e:
+        raise IngestError(f"Could not parse CSV: {e}")
+    finally:
+        text.detach()
+    return {"Sheet1": combine_frames(chunks)}
+
+
+def _unique_columns(header) -> List[str]:
+    """Sheet header names, with blanks named and duplicates mangled as read_csv does (a, a.1)."""
+    columns, seen = [], set()
+    for i, name in enumerate(header):
+        base = str(name).strip() if name is not None else ""
+        base = base or f"Unnamed: {i}"
+        column, suffix = base, 0
+        while column in seen:
+            suffix += 1
+            column = f"{base}.{suffix}"
+        seen.add(column)
+        columns.append(column)
+    return columns
+
+
+def _iter_sheet_chunks(worksheet) -> Iterator[pd.DataFrame]:
+    rows = worksheet.iter_rows(values_only=True)
+    header = next(rows, None)
+    if header is None:
+        return
+    columns = _unique_columns(header)
+
+    batch = []
+    for row in rows:
+        if any(value is not None for value in row):
+            batch.append(row)
+        if len(batch) >= config.INGEST_CHUNK_ROWS:
+            yield compact_dtypes(pd.DataFrame.from_records(batch, columns=columns).infer_objects())
+            batch = []
+    if batch:
+        yield compact_dtypes(pd.DataFrame.from_records(batch, columns=columns).infer_objects())
+
+
+def _parse_sheets(source, titles: List[str] = None) -> Dict[str, pd.DataFrame]:
+    """Parse a workbook's sheets (all of them, or those named), in workbook order."""
+    import openpyxl
+
+    try:
+        workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    except Exception as e:
+        raise IngestError(f"Could not open workbook: {e}")
+
+    frames = {}
+    try:
+        for worksheet in workbook.worksheets:
+            if titles is None or worksheet.title in titles:
+                frames[worksheet.title] = combine_frames(list(_iter_sheet_chunks(worksheet)))
+    finally:
+        workbook.close()
+    return frames
+
+
+def _sheet_titles(path: str) -> List[str]:
+    import openpyxl
+
+    try:
+        workbook = openpyxl.load_workbook(path, read_only=True)
+    except Exception as e:
+        raise IngestError(f"Could not open workbook: {e}")
+    titles = workbook.sheetnames
+    workbook.close()
+    return titles
+
+
+def _sheet_pool() -> concurrent.futures.ProcessPoolExecutor:
+    """The worker process's sheet parsing pool, started on first use."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # forkserver children start clean instead of copying the web
+            # worker's threads, sockets and loaded datasets
+            _pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=config.INGEST_SHEET_WORKERS,
+                mp_context=multiprocessing.get_context("forkserver"),
+            )
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _discard_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _parse_sheets_parallel(stream, extension: str) -> Dict[str, pd.DataFrame]:
+    # The sheet workers open the workbook themselves, so it needs a path
+    with tempfile.NamedTemporaryFile(suffix=extension) as f:
+        shutil.copyfileobj(stream, f)
+        f.flush()
+        titles = _sheet_titles(f.name)
+        if len(titles) < 2:
+            return _parse_sheets(f.name)
+
+        started = time.perf_counter()
+        try:
+            futures = [_sheet_pool().submit(_parse_sheets, f.name, [title]) for title in titles]
+            frames = {}
+            for future in futures:
+                frames.update(future.result())
+        except BrokenProcessPool as e:
+            logger.warning(f"Sheet parsing pool failed, parsing in-process: {e}")
+            _discard_pool()
+            return _parse_sheets(f.name)
+        logger.info(f"Parsed {len(titles)} sheets in parallel in {time.perf_counter() - started:.2f}s")
+        return frames
+
+
+def _read_excel(stream, extension: str, size: int) -> Dict[str, pd.DataFrame]:
+    if config.INGEST_SHEET_WORKERS > 1 and size >= config.INGEST_PARALLEL_MIN_BYTES:
+        frames = _parse_sheets_parallel(stream, extension)
+    else:
+        frames = _parse_sheets(stream)
+
+    frames = {title: df for title, df in frames.items() if len(df.columns)}
+    if not frames:
+        raise IngestError("The workbook has no sheets with data.")
+    return frames
+
+
+def _load_cached(upload_id: str) -> Optional[Tuple[list, pd.DataFrame]]:
+    """The stored sheets of an identical earlier upload, and its first sheet."""
+    if not config.INGEST_UPLOAD_CACHE:
+        return None
+    sheets = dataset_store.get_upload(upload_id)
+    if sheets is None:
+        return None
+    df = dataset_store.get(sheets[0][1])
+    return (sheets, df) if df is not None else None
+
+
+def ingest_upload(contents: str, filename: str) -> IngestResult:
+    """
+    Decode, parse and store an uploaded CSV or Excel file.
+
+    Each sheet is stored as its own dataset. If the same file was uploaded
+    before and its datasets are still stored, parsing is skipped.
+
+    Args:
+        contents: Data URL from dcc.Upload
+        filename: Uploaded file name, used to pick the parser
+
+    Returns:
+        The stored sheets, the first sheet's frame, and memory and timing figures
+
+    Raises:
+        IngestError: If the file type is unsupported, the file can't be parsed
+            or it can't be stored
+    """
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension not in SUPPORTED_EXTENSIONS:
+        raise IngestError(
+            f"Unsupported file type '{extension or filename}'. Upload a CSV or Excel (.xlsx) file."
+        )
+
+    tracing = config.INGEST_TRACE_MEMORY and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+    started = time.perf_counter()
+
+    digest = hashlib.sha256()
+    stream = decode_upload(contents, digest)
+    upload_id = digest.hexdigest()[:32]
+    bytes_in = stream.seek(0, io.SEEK_END)
+    stream.seek(0)
+    frames = None
+    try:
+        cached = _load_cached(upload_id)
+        if cached is None:
+            if extension in CSV_EXTENSIONS:
+                frames = _read_csv(stream)
+            else:
+                frames = _read_excel(stream, extension, bytes_in)
+    finally:
+        stream.close()
+
+    peak_traced = None
+    if tracing:
+        peak_traced = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    if cached is not None:
+        sheets, df = cached
+    else:
+        try:
+            sheets = [(title, dataset_store.put(frame), len(frame)) for title, frame in frames.items()]
+        except DatasetStoreError as e:
+            raise IngestError(str(e)) from e
+        dataset_store.put_upload(upload_id, sheets)
+        df = frames[sheets[0][0]]
+
+    result = IngestResult(
+        filename=filename,
+        sheets=sheets,
+        df=df,
+        bytes_in=bytes_in,
+        seconds=time.perf_counter() - started,
+        # ru_maxrss is reported in kilobytes on Linux
+        process_peak_rss_bytes=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        peak_traced_bytes=peak_traced,
+        frame_bytes={title: int(frame.memory_usage(deep=True).sum()) for title, frame in (frames or {}).items()},
+        cached=cached is not None,
+    )
+    logger.info(f"Ingested {result.summary()}")
+    return result
@@ -0,0 +1,144 @@
+"""
+Compact, pickle-free serialization of saved chart layouts.
+
+Only the figure specs of a saved layout are stored. Data arrays inside the
+figures are pulled out into a shared table so identical arrays (e.g. the same
+x axis used by several charts) are stored once, and all-numeric arrays are
+stored as typed binary buffers rather than lists of numbers. The result is
+msgpack, compressed with zstd, behind a magic/version header:
+
+    b"DLFN" | version (1 byte) | zstd(msgpack({"figures": [...], "arrays": [...]}))
+"""
+
+import hashlib
+import struct
+from numbers import Number
+from typing import List
+
+import msgpack
+import numpy as np
+import zstandard
+
+from config import config
+
+MAGIC = b"DLFN"
+VERSION = 1
+_HEADER = struct.Struct("4sB")
+
+_ARRAY_REF = "__array__"
+
+
+class LayoutDecodeError(ValueError):
+    """Raised when a stored layout blob is not in a format we can read."""
+
+
+def extract_figures(children) -> List[dict]:
+    """Pull the figure dicts out of the current-charts children (header first)."""
+    return [i["props"]["children"][0]["props"]["figure"] for i in children[1:]]
+
+
+def _numeric_buffer(values: list):
+    """Return (dtype, bytes) for an all-numeric list, or None."""
+    if not all(isinstance(v, Number) and not isinstance(v, bool) for v in values):
+        return None
+    array = np.asarray(values)
+    if array.dtype.kind == "i":
+        if array.min() >= np.iinfo(np.int32).min and array.max() <= np.iinfo(np.int32).max:
+            array = array.astype("<i4")
+        else:
+            array = array.astype("<i8")
+    else:
+        array = array.astype("<f8")
+    return array.dtype.str, array.tobytes()
+
+
+class _Encoder:
+    def __init__(self):
+        self.arrays = []
+        self._index = {}
+
+    def _intern(self, values: list) -> dict:
+        buffer = _numeric_buffer(values)
+        if buffer is not None:
+            entry = {"dtype": buffer[0], "data": buffer[1]}
+            digest = hashlib.sha1(buffer[0].encode() + buffer[1]).digest()
+        else:
+            entry = {"list": values}
+            digest = hashlib.sha1(msgpack.packb(values, default=str)).digest()
+
+        if digest not in self._index:
+            self._index[digest] = len(self.arrays)
+            self.arrays.append(entry)
+        return {_ARRAY_REF: self._index[digest]}
+
+    def encode(self, value):
+        if isinstance(value, dict):
+            return {key: self.encode(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            if len(value) >= config.LAYOUT_ARRAY_MIN_LENGTH and not any(
+                isinstance(item, (dict, list, tuple)) for item in value
+            ):
+                return self._intern(list(value))
+            return [self.encode(item) for item in value]
+        return value
+
+
+def _decode(value, arrays: list):
+    if isinstance(value, dict):
+        if len(value) == 1 and _ARRAY_REF in value:
+            return arrays[value[_ARRAY_REF]]
+        return {key: _decode(item, arrays) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_decode(item, arrays) for item in value]
+    return value
+
+
+def encode_figures(figures: List[dict]) -> bytes:
+    """
+    Serialize figure specs into the compact layout format.
+
+    Args:
+        figures: Plotly figure dicts
+
+    Returns:
+        Compressed, versioned blob
+    """
+    encoder = _Encoder()
+    body = {"figures": [encoder.encode(figure) for figure in figures], "arrays": encoder.arrays}
+    packed = msgpack.packb(body, use_bin_type=True, default=str)
+    compressed = zstandard.ZstdCompressor(level=config.LAYOUT_ZSTD_LEVEL).compress(packed)
+    return _HEADER.pack(MAGIC, VERSION) + compressed
+
+
+def decode_figures(blob: bytes) -> List[dict]:
+    """
+    Deserialize figure specs written by encode_figures.
+
+    Args:
+        blob: Stored layout blob
+
+    Returns:
+        Plotly figure dicts
+
+    Raises:
+        LayoutDecodeError: If the blob has an unknown header or version, or is corrupt
+    """
+    if len(blob) < _HEADER.size:
+        raise LayoutDecodeError("Layout blob is truncated")
+    magic, version = _HEADER.unpack_from(blob)
+    if magic != MAGIC:
+        raise LayoutDecodeError("Not a saved layout (bad magic)")
+    if version != VERSION:
+        raise LayoutDecodeError(f"Unsupported saved layout version {version}")
+
+    try:
+        packed = zstandard.ZstdDecompressor().decompress(blob[_HEADER.size:])
+        body = msgpack.unpackb(packed, raw=False)
+        arrays = [
+            np.frombuffer(entry["data"], dtype=np.dtype(entry["dtype"])).tolist()
+            if "data" in entry else entry["list"]
+            for entry in body["arrays"]
+        ]
+        return [_decode(figure, arrays) for figure in body["figures"]]
+    except (zstandard.ZstdError, msgpack.UnpackException, ValueError, TypeError, KeyError, IndexError) as e:
+        raise LayoutDecodeError(f"Saved layout is corrupt: {e}") from e
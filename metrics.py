@@ -0,0 +1,292 @@
+"""
+Counters and latency histograms, served in Prometheus text format at /metrics.
+
+Each process records into an in-memory registry and periodically adds what
+it recorded since the last flush to a Redis hash (HINCRBYFLOAT), so the
+figures at /metrics cover every gunicorn worker and background job process,
+whichever worker answers the scrape. If Redis is unreachable, /metrics
+shows this process's own totals.
+
+Dash callbacks are timed by Flask hooks on /_dash-update-component and
+labelled with the callback's outputs, along with the request and response
+sizes. Other hot paths use ``timed``; OpenAI calls, Redis commands and the
+caches record through ``observe``/``inc`` directly.
+
+REQUEST_PROFILER turns on a per-request profiler (cProfile or pyinstrument)
+whose output is written to REQUEST_PROFILE_DIR for requests slower than
+REQUEST_PROFILE_MIN_SECONDS.
+"""
+
+import cProfile
+import functools
+import logging
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Tuple
+
+import redis
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+_SERIES_KEY = "metrics:series"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# name -> (type, help, buckets)
+METRICS = {
+    "dolfin_callback_seconds": ("histogram", "Dash callback request latency", LATENCY_BUCKETS),
+    "dolfin_callback_request_bytes": ("histogram", "Dash callback request body size", SIZE_BUCKETS),
+    "dolfin_callback_response_bytes": ("histogram", "Dash callback response body size", SIZE_BUCKETS),
+    "dolfin_function_seconds": ("histogram", "Latency of instrumented functions", LATENCY_BUCKETS),
+    "dolfin_openai_seconds": ("histogram", "OpenAI completion latency, including retries", LATENCY_BUCKETS),
+    "dolfin_openai_first_token_seconds": ("histogram", "Time to the first streamed token", LATENCY_BUCKETS),
+    "dolfin_openai_tokens_total": ("counter", "OpenAI tokens by direction", None),
+    "dolfin_openai_retries_total": ("counter", "OpenAI attempts that were retried", None),
+    "dolfin_openai_requests_total": ("counter", "OpenAI completions by outcome", None),
+    "dolfin_redis_seconds": ("histogram", "Redis command and pipeline latency", LATENCY_BUCKETS),
+    "dolfin_cache_lookups_total": ("counter", "Cache lookups by cache and where they were answered", None),
+}
+
+_CALLBACK_PATH = "/_dash-update-component"
+_LE_RE = re.compile(r',?le="([^"]*)"')
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _series(name: str, labels: Dict[str, str]) -> str:
+    if not labels:
+        return name
+    body = ",".join(f'{key}="{_escape(value)}"' for key, value in sorted(labels.items()))
+    return f"{name}{{{body}}}"
+
+
+def _family(series: str) -> str:
+    name = series.split("{", 1)[0]
+    for suffix in ("_bucket", "_sum", "_count"):
+        base = name[: -len(suffix)]
+        if name.endswith(suffix) and METRICS.get(base, ("",))[0] == "histogram":
+            return base
+    return name
+
+
+def _sort_key(series: str):
+    # Keep each label set's buckets together and in ascending order
+    match = _LE_RE.search(series)
+    le = float(match.group(1)) if match else 0.0
+    name = series.split("{", 1)[0]
+    return _family(series), _LE_RE.sub("", series[len(name):]), name, le
+
+
+class Metrics:
+    """Per-process registry that flushes increments to a shared Redis hash."""
+
+    def __init__(self):
+        self.enabled = config.METRICS_ENABLED
+        self.flush_interval = config.METRICS_FLUSH_SECONDS
+        self._totals = defaultdict(float)
+        self._pending = defaultdict(float)
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _after_fork(self):
+        # A forked job process starts empty; the parent still owns its own counts
+        self._totals = defaultdict(float)
+        self._pending = defaultdict(float)
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _add(self, increments):
+        with self._lock:
+            for series, amount in increments:
+                self._totals[series] += amount
+                self._pending[series] += amount
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        """Add to a counter."""
+        if self.enabled:
+            self._add([(_series(name, labels), amount)])
+
+    def observe(self, name: str, value: float, **labels):
+        """Record a histogram observation."""
+        if not self.enabled:
+            return
+        increments = [
+            (_series(f"{name}_bucket", {**labels, "le": str(bound)}), 1)
+            for bound in METRICS[name][2]
+            if value <= bound
+        ]
+        increments.append((_series(f"{name}_bucket", {**labels, "le": "+Inf"}), 1))
+        increments.append((_series(f"{name}_sum", labels), value))
+        increments.append((_series(f"{name}_count", labels), 1))
+        self._add(increments)
+
+    def cache_lookup(self, cache: str, result: str):
+        """Count a cache lookup answered locally, from the shared store, or missed."""
+        self.inc("dolfin_cache_lookups_total", cache=cache, result=result)
+
+    def timed(self, name: str, flush: bool = False):
+        """
+        Decorator recording a function's latency under dolfin_function_seconds.
+
+        Args:
+            name: Value of the ``function`` label
+            flush: Flush when the call returns, for functions run as background
+                jobs whose process may exit before the next interval
+        """
+
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.observe("dolfin_function_seconds", time.perf_counter() - start, function=name)
+                    if flush:
+                        self.flush()
+
+            return wrapper
+
+        return decorator
+
+    def flush(self):
+        """Add this process's increments since the last flush to the shared totals."""
+        # storage times its Redis commands through this module
+        from storage import redis_instance
+
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(float)
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+        try:
+            pipe = redis_instance.pipeline(transaction=False)
+            for series, amount in pending.items():
+                pipe.hincrbyfloat(_SERIES_KEY, series, amount)
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Metrics flush failed: {e}")
+            with self._lock:
+                for series, amount in pending.items():
+                    self._pending[series] += amount
+
+    def collect(self) -> Tuple[Dict[str, float], bool]:
+        """Return (series -> value, whether they cover all processes)."""
+        from storage import redis_instance
+
+        self.flush()
+        try:
+            shared = redis_instance.hgetall(_SERIES_KEY)
+            return {k.decode(): float(v) for k, v in shared.items()}, True
+        except redis.RedisError as e:
+            logger.warning(f"Metrics read failed, serving this process only: {e}")
+            with self._lock:
+                return dict(self._totals), False
+
+    def render(self) -> str:
+        """The collected series in Prometheus text exposition format."""
+        series, shared = self.collect()
+        lines = [] if shared else [f"# Redis unavailable: series cover process {os.getpid()} only"]
+        family = None
+        for key in sorted(series, key=_sort_key):
+            if _family(key) != family:
+                family = _family(key)
+                kind, description, _ = METRICS.get(family, ("untyped", "", None))
+                lines.append(f"# HELP {family} {description}")
+                lines.append(f"# TYPE {family} {kind}")
+            value = series[key]
+            lines.append(f"{key} {int(value) if value == int(value) else value}")
+        return "\n".join(lines) + "\n"
+
+    def _before_request(self):
+        from flask import g
+
+        g.metrics_started = time.perf_counter()
+        g.request_profiler = _start_profiler() if config.REQUEST_PROFILER else None
+
+    def _after_request(self, response):
+        from flask import g, request
+
+        started = g.pop("metrics_started", None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+
+        callback = None
+        if request.path.endswith(_CALLBACK_PATH):
+            body = request.get_json(silent=True) or {}
+            callback = str(body.get("output", "unknown"))
+            self.observe("dolfin_callback_seconds", elapsed, callback=callback)
+            self.observe("dolfin_callback_request_bytes", request.content_length or 0, callback=callback)
+            if not response.direct_passthrough:
+                self.observe(
+                    "dolfin_callback_response_bytes", response.calculate_content_length() or 0, callback=callback
+                )
+
+        profiler = g.pop("request_profiler", None)
+        if profiler is not None:
+            _stop_profiler(profiler, elapsed, callback or request.path)
+        return response
+
+    def install(self, server):
+        """Time Dash callbacks and serve the metrics at /metrics."""
+        from flask import Response
+
+        if not self.enabled:
+            return
+        server.before_request(self._before_request)
+        server.after_request(self._after_request)
+        server.add_url_rule(
+            "/metrics", "metrics", lambda: Response(self.render(), mimetype="text/plain; version=0.0.4")
+        )
+
+
+def _start_profiler():
+    if config.REQUEST_PROFILER == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError as e:
+            raise ImportError("REQUEST_PROFILER=pyinstrument needs the pyinstrument package") from e
+        profiler = Profiler()
+        profiler.start()
+        return profiler
+
+    # Profiles the request's thread only, like the pyinstrument profiler
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def _stop_profiler(profiler, elapsed: float, label: str):
+    if isinstance(profiler, cProfile.Profile):
+        profiler.disable()
+    else:
+        profiler.stop()
+    if elapsed < config.REQUEST_PROFILE_MIN_SECONDS:
+        return
+    os.makedirs(config.REQUEST_PROFILE_DIR, exist_ok=True)
+    stem = f"{time.strftime('%Y%m%d-%H%M%S')}-{int(elapsed * 1000)}ms-{re.sub(r'[^A-Za-z0-9_-]+', '_', label)[:80]}"
+    path = os.path.join(config.REQUEST_PROFILE_DIR, stem)
+    try:
+        if isinstance(profiler, cProfile.Profile):
+            profiler.dump_stats(f"{path}.prof")
+        else:
+            with open(f"{path}.html", "w") as f:
+                f.write(profiler.output_html())
+    except OSError as e:
+        logger.warning(f"Could not write request profile: {e}")
+
+
+# Global instance
+metrics = Metrics()
+os.register_at_fork(after_in_child=metrics._after_fork)
@@ -1,35 +1,300 @@
+import asyncio
+import concurrent.futures
+import logging
 import os
+import queue
+import random
+import threading
 import time
-import logging
-from typing import Optional, Dict, Any
-from openai import OpenAI, RateLimitError, APIError, APIConnectionError, APITimeoutError
+from typing import AsyncIterator, Iterator, Optional, Dict, Any
 import dash_mantine_components as dmc
 from dash import html, dcc
 
 from config import config
+from metrics import metrics
+from rate_limiter import estimate_tokens, rate_limiter
+from response_cache import cache_key, response_cache
+from single_flight import single_flight
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class OpenAIClient:
+def _sdk():
+    """The OpenAI SDK, imported on first use (it is the slowest import in the app)."""
+    import openai
+    return openai
+
+
+class StreamInterrupted(Exception):
+    """A streamed completion could not be started or stopped part way."""
+
+
+def _record_call(model: str, started: float, outcome: str, usage=None):
+    """Record a completion's latency, outcome and token usage."""
+    metrics.observe("dolfin_openai_seconds", time.perf_counter() - started, model=model, outcome=outcome)
+    metrics.inc("dolfin_openai_requests_total", model=model, outcome=outcome)
+    if usage is not None:
+        metrics.inc("dolfin_openai_tokens_total", usage.prompt_tokens, model=model, direction="prompt")
+        metrics.inc("dolfin_openai_tokens_total", usage.completion_tokens, model=model, direction="completion")
+
+
+def _is_quota_error(error: Exception) -> bool:
+    return isinstance(error, _sdk().RateLimitError) and (
+        "quota" in str(error).lower() or "insufficient_quota" in str(error).lower()
+    )
+
+
+class AsyncOpenAIClient:
+    """
+    Non-blocking chat completions.
+
+    One AsyncOpenAI client (and so one HTTP connection pool) is shared by all
+    requests on the event loop that first uses it. Retries back off with
+    jittered asyncio sleeps, each attempt has its own timeout, and a
+    semaphore bounds the number of completions in flight.
+    """
+
     def __init__(self):
-        self.client = OpenAI(api_key=config.OPENAI_API_KEY)
+        # Retries are handled here so the backoff never blocks the loop
+        openai = _sdk()
+        self.client = openai.AsyncOpenAI(
+            api_key=config.OPENAI_API_KEY,
+            max_retries=0,
+            timeout=config.OPENAI_REQUEST_TIMEOUT,
+        )
         self.max_retries = config.OPENAI_MAX_RETRIES
         self.base_delay = config.OPENAI_BASE_DELAY
-        
+        self.max_delay = config.OPENAI_MAX_DELAY
+        self.timeout = config.OPENAI_REQUEST_TIMEOUT
+        self._semaphore = asyncio.Semaphore(config.OPENAI_MAX_CONCURRENCY)
+        self._retryable = (
+            openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, asyncio.TimeoutError
+        )
+
+    def _backoff_delay(self, attempt: int) -> float:
+        """Full-jitter exponential backoff."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    async def chat_completion(self, messages: list, model: str = None,
+                              timeout: float = None, **kwargs) -> Optional[str]:
+        """
+        Make a chat completion request with error handling and retry logic.
+
+        Args:
+            messages: List of message dictionaries
+            model: Model to use for completion (defaults to config setting)
+            timeout: Per-attempt timeout in seconds (defaults to config setting)
+            **kwargs: Additional arguments for the completion request
+
+        Returns:
+            Response content or None if all retries failed
+        """
+        if model is None:
+            model = config.OPENAI_MODEL
+        if timeout is None:
+            timeout = self.timeout
+
+        estimated_tokens = estimate_tokens(messages, kwargs.get("max_tokens"))
+        started = time.perf_counter()
+
+        for attempt in range(self.max_retries):
+            try:
+                # Queue briefly for shared capacity rather than provoking a 429
+                if not await rate_limiter.acquire(estimated_tokens):
+                    _record_call(model, started, "throttled")
+                    return None
+                async with self._semaphore:
+                    response = await asyncio.wait_for(
+                        self.client.chat.completions.create(
+                            model=model,
+                            messages=messages,
+                            **kwargs
+                        ),
+                        timeout,
+                    )
+                if response.usage is not None:
+                    rate_limiter.reconcile(estimated_tokens, response.usage.total_tokens)
+                _record_call(model, started, "ok", response.usage)
+                return response.choices[0].message.content
+
+            except self._retryable as e:
+                logger.warning(f"API error on attempt {attempt + 1}: {e}")
+
+                if _is_quota_error(e):
+                    # Retrying can't help until the quota resets
+                    logger.error(f"API quota exceeded: {e}")
+                    _record_call(model, started, "quota")
+                    return None
+                if attempt < self.max_retries - 1:
+                    metrics.inc("dolfin_openai_retries_total", model=model)
+                    delay = self._backoff_delay(attempt)
+                    logger.info(f"Retrying in {delay:.2f} seconds...")
+                    await asyncio.sleep(delay)
+                else:
+                    logger.error(f"All retry attempts failed: {e}")
+                    _record_call(model, started, "failed")
+                    return None
+
+            except _sdk().APIError as e:
+                logger.error(f"API error: {e}")
+                _record_call(model, started, "error")
+                return None
+            except Exception as e:
+                logger.error(f"Unexpected error: {e}")
+                _record_call(model, started, "error")
+                return None
+
+        return None
+
+    async def stream_chat_completion(self, messages: list, model: str = None,
+                                     timeout: float = None, **kwargs) -> AsyncIterator[str]:
+        """
+        Stream a chat completion as content deltas.
+
+        Failures before the first token are retried like chat_completion;
+        once tokens have been yielded the request can't be replayed.
+
+        Args:
+            messages: List of message dictionaries
+            model: Model to use for completion (defaults to config setting)
+            timeout: Timeout in seconds for the first token and for each
+                later one (defaults to config setting)
+            **kwargs: Additional arguments for the completion request
+
+        Yields:
+            Content deltas
+
+        Raises:
+            StreamInterrupted: If the stream could not be started or broke off
+        """
+        if model is None:
+            model = config.OPENAI_MODEL
+        if timeout is None:
+            timeout = self.timeout
+        estimated_tokens = estimate_tokens(messages, kwargs.get("max_tokens"))
+        request_started = time.perf_counter()
+        usage = None
+
+        for attempt in range(self.max_retries):
+            started = False
+            try:
+                if not await rate_limiter.acquire(estimated_tokens):
+                    _record_call(model, request_started, "throttled")
+                    raise StreamInterrupted("No rate limit capacity available")
+                async with self._semaphore:
+                    stream = await asyncio.wait_for(
+                        self.client.chat.completions.create(
+                            model=model,
+                            messages=messages,
+                            stream=True,
+                            stream_options={"include_usage": True},
+                            **kwargs
+                        ),
+                        timeout,
+                    )
+                    iterator = stream.__aiter__()
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(iterator.__anext__(), timeout)
+                        except StopAsyncIteration:
+                            break
+                        if chunk.usage is not None:
+                            usage = chunk.usage
+                            rate_limiter.reconcile(estimated_tokens, chunk.usage.total_tokens)
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            if not started:
+                                metrics.observe(
+                                    "dolfin_openai_first_token_seconds",
+                                    time.perf_counter() - request_started,
+                                    model=model,
+                                )
+                            started = True
+                            yield chunk.choices[0].delta.content
+                _record_call(model, request_started, "ok", usage)
+                return
+
+            except StreamInterrupted:
+                raise
+            except self._retryable as e:
+                logger.warning(f"API error on attempt {attempt + 1}: {e}")
+                if started or _is_quota_error(e) or attempt == self.max_retries - 1:
+                    _record_call(model, request_started, "quota" if _is_quota_error(e) else "failed")
+                    raise StreamInterrupted(str(e)) from e
+                metrics.inc("dolfin_openai_retries_total", model=model)
+                delay = self._backoff_delay(attempt)
+                logger.info(f"Retrying in {delay:.2f} seconds...")
+                await asyncio.sleep(delay)
+            except Exception as e:
+                logger.error(f"Streaming error: {e}")
+                _record_call(model, request_started, "error")
+                raise StreamInterrupted(str(e)) from e
+
+
+class _EventLoopThread:
+    """Per-process background event loop that runs coroutines for sync callers."""
+
+    def __init__(self):
+        self._loop = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            # Threads don't survive a fork, so each gunicorn worker starts its own loop
+            if self._loop is None or self._pid != os.getpid():
+                self._loop = asyncio.new_event_loop()
+                self._pid = os.getpid()
+                threading.Thread(
+                    target=self._loop.run_forever, name="openai-event-loop", daemon=True
+                ).start()
+            return self._loop
+
+    def submit(self, coro) -> concurrent.futures.Future:
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+
+    def run(self, coro, timeout: float = None):
+        return self.submit(coro).result(timeout)
+
+
+class OpenAIClient:
+    """
+    Synchronous facade used by Dash callbacks.
+
+    Calls are executed on a shared background event loop, so the calling
+    thread only waits on a future while backoff sleeps and network I/O for
+    every caller in the process are multiplexed on one connection pool.
+    """
+
+    def __init__(self):
+        self._runner = _EventLoopThread()
+        self._async_client = None
+        self._async_pid = None
+        self._async_lock = threading.Lock()
+
+    @property
+    def async_client(self) -> AsyncOpenAIClient:
+        with self._async_lock:
+            # The HTTP pool is bound to this process's background loop
+            if self._async_client is None or self._async_pid != os.getpid():
+                self._async_client = AsyncOpenAIClient()
+                self._async_pid = os.getpid()
+            return self._async_client
+
+
     def _handle_api_error(self, error: Exception) -> str:
         """Handle different types of OpenAI API errors and return user-friendly messages."""
-        if isinstance(error, RateLimitError):
+        openai = _sdk()
+        if isinstance(error, openai.RateLimitError):
             if "quota" in str(error).lower() or "insufficient_quota" in str(error).lower():
                 return "⚠️ **API Quota Exceeded**\n\nYour OpenAI API quota has been exceeded. Please check your billing details and plan limits. You can:\n\n- Check your usage at [OpenAI Platform](https://platform.openai.com/usage)\n- Upgrade your plan if needed\n- Wait for your quota to reset\n\nFor now, I'll provide a basic analysis of your data instead."
             else:
                 return "⚠️ **Rate Limit Exceeded**\n\nToo many requests to the AI service. Please wait a moment and try again."
-        elif isinstance(error, APIConnectionError):
+        elif isinstance(error, openai.APIConnectionError):
             return "⚠️ **Connection Error**\n\nUnable to connect to the AI service. Please check your internet connection and try again."
-        elif isinstance(error, APITimeoutError):
+        elif isinstance(error, openai.APITimeoutError):
             return "⚠️ **Request Timeout**\n\nThe AI service is taking too long to respond. Please try again with a simpler question."
-        elif isinstance(error, APIError):
+        elif isinstance(error, openai.APIError):
             return f"⚠️ **API Error**\n\nAn error occurred with the AI service: {str(error)}"
         else:
             return f"⚠️ **Unexpected Error**\n\nAn unexpected error occurred: {str(error)}"
@@ -45,13 +310,15 @@ Here's what I can tell you about your dataset:
 
 **Note:** For more detailed AI-powered insights, please ensure your OpenAI API key is valid and has sufficient quota."""
     
-    def chat_completion(self, messages: list, model: str = None, **kwargs) -> Optional[str]:
+    def chat_completion(self, messages: list, model: str = None,
+                        use_cache: bool = True, **kwargs) -> Optional[str]:
         """
         Make a chat completion request with error handling and retry logic.
         
         Args:
             messages: List of message dictionaries
             model: Model to use for completion (defaults to config setting)
+            use_cache: Serve and store the answer in the response cache
             **kwargs: Additional arguments for the completion request
             
         Returns:
@@ -59,39 +326,131 @@ Here's what I can tell you about your dataset:
         """
         if model is None:
             model = config.OPENAI_MODEL
-            
-        for attempt in range(self.max_retries):
+
+        key = cache_key(model, messages, **kwargs)
+        if use_cache:
+            cached = response_cache.get(key)
+            if cached is not None:
+                return cached
+
+        # An identical request already in flight shares its answer
+        flight, response = single_flight.join(key, fresh=not use_cache)
+        if flight is None:
+            return response
+
+        client = self.async_client
+        try:
+            response = self._runner.run(client.chat_completion(messages, model, **kwargs))
+        except BaseException:
+            single_flight.abandon(flight)
+            raise
+        single_flight.finish(flight, response)
+        # Failures return None, so fallback and error text never reach the cache
+        if use_cache and response:
+            response_cache.set(key, response)
+        return response
+    
+    def stream_chat_completion(self, messages: list, model: str = None,
+                               use_cache: bool = True, **kwargs) -> Iterator[str]:
+        """
+        Stream a chat completion as content deltas.
+
+        Tokens are produced on the background event loop and handed to the
+        calling thread through a queue. Closing the generator early (e.g.
+        because a newer question replaced this one) cancels the request.
+
+        Args:
+            messages: List of message dictionaries
+            model: Model to use for completion (defaults to config setting)
+            use_cache: Serve and store the answer in the response cache
+            **kwargs: Additional arguments for the completion request
+
+        Yields:
+            Content deltas (a cached or coalesced answer is yielded in one piece)
+
+        Raises:
+            StreamInterrupted: If the stream could not be started or broke off
+        """
+        if model is None:
+            model = config.OPENAI_MODEL
+
+        key = cache_key(model, messages, **kwargs)
+        if use_cache:
+            cached = response_cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+
+        # An identical request already in flight shares its answer, in one piece
+        flight, response = single_flight.join(key, fresh=not use_cache)
+        if flight is None:
+            if response is None:
+                raise StreamInterrupted("The identical request this one waited on failed")
+            yield response
+            return
+
+        deltas = queue.Queue()
+        done = object()
+
+        async def pump():
             try:
-                response = self.client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    **kwargs
-                )
-                return response.choices[0].message.content
-                
-            except (RateLimitError, APIConnectionError, APITimeoutError) as e:
-                logger.warning(f"API error on attempt {attempt + 1}: {e}")
-                
-                if attempt < self.max_retries - 1:
-                    # Exponential backoff
-                    delay = self.base_delay * (2 ** attempt)
-                    logger.info(f"Retrying in {delay} seconds...")
-                    time.sleep(delay)
-                else:
-                    logger.error(f"All retry attempts failed: {e}")
-                    return None
-                    
-            except APIError as e:
-                logger.error(f"API error: {e}")
-                return None
+                async for delta in self.async_client.stream_chat_completion(messages, model, **kwargs):
+                    deltas.put(delta)
             except Exception as e:
-                logger.error(f"Unexpected error: {e}")
-                return None
-        
-        return None
-    
+                deltas.put(e)
+            finally:
+                deltas.put(done)
+
+        future = self._runner.submit(pump())
+        parts = []
+        try:
+            while True:
+                item = deltas.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                parts.append(item)
+                yield item
+        except Exception:
+            single_flight.finish(flight, None)
+            raise
+        except BaseException:
+            # Closed early: whoever was waiting makes the call instead
+            single_flight.abandon(flight)
+            raise
+        finally:
+            future.cancel()
+
+        response = "".join(parts)
+        single_flight.finish(flight, response or None)
+        if use_cache and parts:
+            response_cache.set(key, response)
+
+    def safe_stream_chat_completion(self, messages: list, model: str = None,
+                                    fallback_info: str = "", question: str = "",
+                                    use_cache: bool = True, **kwargs) -> Iterator[str]:
+        """
+        Stream a chat completion, falling back like safe_chat_completion.
+
+        Yields:
+            The accumulated response text after each delta
+        """
+        text = ""
+        try:
+            for delta in self.stream_chat_completion(messages, model, use_cache=use_cache, **kwargs):
+                text += delta
+                yield text
+        except StreamInterrupted as e:
+            logger.error(f"Error in safe_stream_chat_completion: {e}")
+            if text:
+                yield text + "\n\n⚠️ *The response was interrupted.*"
+            else:
+                yield self._get_fallback_response(question, fallback_info)
+
     def safe_chat_completion(self, messages: list, model: str = None, 
-                           fallback_info: str = "", question: str = "", **kwargs) -> str:
+                           fallback_info: str = "", question: str = "",
+                           use_cache: bool = True, **kwargs) -> str:
         """
         Make a chat completion request with fallback response.
         
@@ -100,13 +459,14 @@ Here's what I can tell you about your dataset:
             model: Model to use for completion
             fallback_info: Information to include in fallback response
             question: User's question for fallback response
+            use_cache: Serve and store the answer in the response cache
             **kwargs: Additional arguments for the completion request
             
         Returns:
             Response content or fallback response
         """
         try:
-            response = self.chat_completion(messages, model, **kwargs)
+            response = self.chat_completion(messages, model, use_cache=use_cache, **kwargs)
             if response:
                 return response
             else:
@@ -120,6 +480,10 @@ Here's what I can tell you about your dataset:
 # Global instance
 openai_client = OpenAIClient()
 
+def is_error_response(response: str) -> bool:
+    """Whether a safe_chat_completion result is an error or fallback message."""
+    return "⚠️" in response or "API" in response or "quota" in response.lower()
+
 def create_error_notification(message: str) -> html.Div:
     """Create a styled error notification component."""
     return html.Div(
@@ -1,140 +1,186 @@
 import random
+import uuid
 
 import dash_chart_editor as dce
 import dash_mantine_components as dmc
-import pandas as pd
 from dash import Input, Output, State, callback, dcc, html, no_update, register_page
 
 import utils
-from openai_client import openai_client, create_error_notification
-
-df = pd.read_csv("https://raw.githubusercontent.com/plotly/datasets/master/solar.csv")
-
+from chat_sessions import session_store
+from config import config
+from datastore import dataset_store
+from default_dataset import load_default_dataset
+from figure_reduction import reduce_figure
+from metrics import metrics
+from openai_client import openai_client, create_error_notification, is_error_response
+from query_engine import answer_question
 
 register_page(__name__, path="/")
 
-layout = html.Div(
-    [
-        utils.jumbotron(),
-        dmc.Paper(
-            [
-                html.Div(
-                    [
-                        dce.DashChartEditor(
-                            id="chart-editor",
-                            dataSources=df.to_dict("list"),
-                        ),
-                        dmc.Affix(
-                            dmc.Button("Save this chart", id="add-to-layout"),
-                            position={"bottom": 20, "left": 20},
-                        ),
-                    ],
-                ),
-                html.Div(
-                    [
-                        html.Div(
-                            [
-                                html.Img(
-                                    src="/assets/chat-gpt.png",
-                                    height="28px",
-                                    style={"marginRight": "1px"}
-                                ),
-                                html.P("Ask OpenAI", className="lead", style={"margin": 0}),
-                                html.Span(
-                                    "gpt-4o-mini",
-                                    style={
-                                        "background": "#edf1f2",
-                                        "color": "#333",
-                                        "borderRadius": "12px",
-                                        "padding": "2px 10px",
-                                        "fontSize": "0.85rem",
-                                        "marginLeft": "auto",
-                                        "fontWeight": 200,
-                                        "letterSpacing": "0.02em",
-                                        "alignSelf": "center"
-                                    }
-                                ),
-                            ],
-                            style={"display": "flex", "alignItems": "center", "marginBottom": "8px", "gap": "0.5rem"}
-                        ),
-                        dmc.Textarea(
-                            placeholder=random.choice(
+
+def layout():
+    # The sample dataset is loaded on the first page view, not at import
+    default = load_default_dataset()
+    return html.Div(
+        [
+            utils.jumbotron(),
+            dcc.Store(id="dataset-id", data=default.dataset_id),
+            # Each page view is a new conversation; its turns are kept on the server
+            dcc.Store(id="chat-session-id", data=str(uuid.uuid4())),
+            dmc.Paper(
+                [
+                    html.Div(
+                        [
+                            dce.DashChartEditor(
+                                id="chart-editor",
+                                dataSources=utils.data_sources(default.df, default.dataset_id),
+                            ),
+                            dmc.Affix(
+                                dmc.Button("Save this chart", id="add-to-layout"),
+                                position={"bottom": 20, "left": 20},
+                            ),
+                        ],
+                    ),
+                    html.Div(
+                        [
+                            html.Div(
                                 [
-                                    '"Are there any outliers in this dataset?"',
-                                    '"What trends do you see in this dataset?"',
-                                    '"Anything stand out about this dataset?"',
-                                    '"Do you recommend specific charts given this dataset?"',
-                                    '"What columns should I investigate further?"',
-                                ]
+                                    html.Img(
+                                        src="/assets/chat-gpt.png",
+                                        height="28px",
+                                        style={"marginRight": "1px"}
+                                    ),
+                                    html.P("Ask OpenAI", className="lead", style={"margin": 0}),
+                                    html.Span(
+                                        "gpt-4o-mini",
+                                        style={
+                                            "background": "#edf1f2",
+                                            "color": "#333",
+                                            "borderRadius": "12px",
+                                            "padding": "2px 10px",
+                                            "fontSize": "0.85rem",
+                                            "marginLeft": "auto",
+                                            "fontWeight": 200,
+                                            "letterSpacing": "0.02em",
+                                            "alignSelf": "center"
+                                        }
+                                    ),
+                                ],
+                                style={
+                                    "display": "flex", "alignItems": "center", "marginBottom": "8px", "gap": "0.5rem"
+                                }
                             ),
-                            autosize=True,
-                            minRows=2,
-                            id="question",
-                        ),
-                        dmc.Group(
-                            [
-                                dmc.Button(
-                                    "Submit",
-                                    id="chat-submit",
-                                    disabled=True,
+                            dmc.Textarea(
+                                placeholder=random.choice(
+                                    [
+                                        '"Are there any outliers in this dataset?"',
+                                        '"What trends do you see in this dataset?"',
+                                        '"Anything stand out about this dataset?"',
+                                        '"Do you recommend specific charts given this dataset?"',
+                                        '"What columns should I investigate further?"',
+                                    ]
                                 ),
-                            ],
-                            position="right",
-                        ),
-                        dmc.LoadingOverlay(
+                                autosize=True,
+                                minRows=2,
+                                id="question",
+                            ),
+                            dmc.Group(
+                                [
+                                    dmc.Button(
+                                        "Submit",
+                                        id="chat-submit",
+                                        disabled=True,
+                                    ),
+                                ],
+                                position="right",
+                            ),
+                            # Partial answer while it is being streamed
+                            html.Div(id="chat-stream"),
                             html.Div(
                                 id="chat-output",
                             ),
-                        ),
-                    ],
-                    id="chat-container",
-                ),
-            ],
-            shadow="xs",
-            id="flex",
-        ),
-        utils.upload_modal(),
-        html.Div(id="current-charts"),
-        html.Div(
-            html.A(
-                "Chat gpt icons created by Freepik - Flaticon",
-                href="https://www.flaticon.com/free-icons/chat-gpt",
-                title="chat gpt icons",
-                target="_blank",
-                style={"fontSize": "0.9rem", "color": "#888", "textAlign": "center", "display": "block", "marginTop": "40px"}
-            )
-        ),
-    ],
-    id="padded",
-)
+                        ],
+                        id="chat-container",
+                    ),
+                ],
+                shadow="xs",
+                id="flex",
+            ),
+            utils.upload_modal(),
+            html.Div(id="current-charts"),
+            html.Div(
+                html.A(
+                    "Chat gpt icons created by Freepik - Flaticon",
+                    href="https://www.flaticon.com/free-icons/chat-gpt",
+                    title="chat gpt icons",
+                    target="_blank",
+                    style={
+                        "fontSize": "0.9rem", "color": "#888", "textAlign": "center", "display": "block", "marginTop": "40px"
+                    }
+                )
+            ),
+        ],
+        id="padded",
+    )
 
 
 @callback(
     Output("chat-output", "children"),
     Output("question", "value"),
     Input("chat-submit", "n_clicks"),
-    State("chart-editor", "dataSources"),
+    State("dataset-id", "data"),
     State("question", "value"),
     State("chat-output", "children"),
+    State("chat-session-id", "data"),
+    # Runs as a background job: tokens are pushed to chat-stream as they
+    # arrive, and a new question terminates the job still answering the last
+    background=True,
+    progress=Output("chat-stream", "children"),
+    progress_default=None,
+    interval=config.STREAM_PROGRESS_INTERVAL_MS,
     prevent_initial_call=True,
 )
-def chat_window(n_clicks, data, question, cur):
-    df = pd.DataFrame(data)
-    prompt = utils.generate_prompt(df, question)
-    
+@metrics.timed("chat_window", flush=True)
+def chat_window(set_progress, n_clicks, dataset_id, question, cur, session_id):
+    df = dataset_store.get(dataset_id)
+    if df is None:
+        notification = create_error_notification(
+            "This dataset is no longer available on the server. Please upload it again."
+        )
+        question_response = [notification, dcc.Markdown(question, className="chat-item question")]
+        return (question_response + cur if cur else question_response), None
+
+    # Aggregation questions are computed exactly; the model narrates the result
+    facts = answer_question(df, question, dataset_id)
+    # The dataset context leads every request unchanged; earlier turns follow it
+    session = session_store.load(session_id, dataset_id)
+    messages = session.messages(utils.generate_context(df, dataset_id), utils.generate_question(question, facts))
+
     # Generate fallback info for error cases
     fallback_info = f"Dataset has {len(df)} rows and {len(df.columns)} columns. Columns: {', '.join(df.columns)}"
     
-    # Use the safe chat completion with error handling
-    response = openai_client.safe_chat_completion(
-        messages=[{"role": "user", "content": prompt}],
+    # Stream the answer with the same fallback handling as safe_chat_completion
+    response = ""
+    for response in openai_client.safe_stream_chat_completion(
+        messages=messages,
         model="gpt-4o-mini",
         fallback_info=fallback_info,
         question=question
-    )
+    ):
+        set_progress([
+            dcc.Markdown(response, className="chat-item answer"),
+            dcc.Markdown(question, className="chat-item question"),
+        ])
 
     # Check if response contains error indicators
-    if "⚠️" in response or "API" in response or "quota" in response.lower():
+    if is_error_response(response) and facts is not None:
+        # The model is unavailable, but the computed answer still stands
+        question_response = [
+            create_error_notification("The AI service is unavailable, so only the computed answer is shown."),
+            dcc.Markdown(facts.markdown(), className="chat-item answer"),
+            dcc.Markdown(question, className="chat-item question"),
+        ]
+    elif is_error_response(response):
         # Show error notification
         error_notification = create_error_notification(response)
         question_response = [
@@ -147,6 +193,8 @@ def chat_window(n_clicks, data, question, cur):
             dcc.Markdown(response, className="chat-item answer"),
             dcc.Markdown(question, className="chat-item question"),
         ]
+        session.add_turn(question, response)
+        session_store.save(session)
 
     return (question_response + cur if cur else question_response), None
 
@@ -192,7 +240,8 @@ def save_figure(n_clicks, figure, cur):
     if not any(_has_points(t) for t in data):
         return no_update
 
-    item = [dmc.Paper([dcc.Graph(figure=figure)])]
+    # Keep saved (and shared) figures within the point budget
+    item = [dmc.Paper([dcc.Graph(figure=reduce_figure(figure))])]
 
     header = [
         html.Div(
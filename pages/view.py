@@ -1,46 +1,83 @@
-import json
-import pickle
+import logging
 
 import dash
 import dash_bootstrap_components as dbc
 import dash_mantine_components as dmc
-from dash import dcc, html
+from dash import Input, Output, State, callback, ctx, dcc, html
 
-from constants import redis_instance
-from openai_client import openai_client, create_error_notification
+from config import config
+from metrics import metrics
+from openai_client import openai_client, create_error_notification, is_error_response
+from prompt_builder import PromptBuilder, add_figures
+from storage import layout_store
 
-dash.register_page(__name__)
+logger = logging.getLogger(__name__)
 
+dash.register_page(__name__)
 
-def layout(layout=None):
-    layout = redis_instance.get(layout)
-    layout = pickle.loads(layout)
 
-    figures = [i["props"]["children"][0]["props"]["figure"] for i in layout[1:]]
+def summarize_figures(figures, use_cache=True):
+    """
+    Stream a summary of the charts.
 
+    Yields:
+        The accumulated response text after each delta
+    """
     question = (
         "The following is a Plotly Dash layout with several charts. Summarize "
         "the charts for me and provide some maximums, mimumuns, trends, "
-        "notable outliers, etc. Describe the data and content as the user doesn't know it's a layout."
-        "The data may be truncated to comply with a max character count. "
-        f"There should be {len(figures)} charts to follow:\n\n\n"
+        "notable outliers, etc. Describe the data and content as the user doesn't know it's a layout. "
+        "Each chart is described by its title, axes and summary statistics for each trace. "
+        f"There should be {len(figures)} charts to follow:"
     )
 
+    # Charts share the budget equally; a chart that needs less gives the rest away
+    builder = PromptBuilder(config.VIEW_SUMMARY_TOKEN_BUDGET).add("question", question, required=True)
+    prompt = add_figures(builder, figures).build()
+
     # Generate fallback info
     fallback_info = f"Layout contains {len(figures)} charts. Chart data has been processed and is ready for analysis."
-    
+
     # Use safe chat completion with error handling
-    response_content = openai_client.safe_chat_completion(
-        messages=[{"role": "user", "content": question + json.dumps(figures)[0:3900]}],
+    yield from openai_client.safe_stream_chat_completion(
+        messages=[{"role": "user", "content": prompt}],
         model="gpt-4o-mini",
         fallback_info=fallback_info,
-        question="Summarize the charts and provide insights"
+        question="Summarize the charts and provide insights",
+        use_cache=use_cache,
     )
 
+
+def get_summary(layout, refresh=False, on_progress=None):
+    """
+    Return the AI summary stored next to a shared layout.
+
+    The summary is generated on the first view (or on refresh) and stored
+    with the layout so later visits render without calling OpenAI. Error and
+    fallback responses are shown but not stored, so the next visit tries again.
+
+    Args:
+        layout: The shared layout
+        refresh: Generate a new summary even if one is stored
+        on_progress: Called with the partial summary as it streams in
+    """
+    if not refresh and layout.summary is not None:
+        return layout.summary
+
+    response_content = ""
+    for response_content in summarize_figures(layout.figures, use_cache=not refresh):
+        if on_progress is not None:
+            on_progress(response_content)
+    if not is_error_response(response_content):
+        layout_store.set_summary(layout, response_content)
+    return response_content
+
+
+def render_summary(response_content, figures):
     # Check if response contains error indicators
-    if "⚠️" in response_content or "API" in response_content or "quota" in response_content.lower():
+    if is_error_response(response_content):
         # Show error notification and fallback response
-        response = html.Div([
+        return html.Div([
             create_error_notification(response_content),
             dcc.Markdown(
                 f"**Basic Chart Summary** (AI service unavailable)\n\n"
@@ -50,16 +87,96 @@ def layout(layout=None):
                 className="chat-item answer"
             )
         ])
+    return dcc.Markdown(response_content)
+
+
+@metrics.timed("view.layout")
+def layout(layout=None):
+    layout_id = layout
+    home_button = dbc.Button(
+        children="Home",
+        href="/",
+        style={"background-color": "#238BE6", "margin": "10px"},
+    )
+
+    shared = layout_store.load(layout_id)
+    if shared is None:
+        return html.Div(
+            [
+                home_button,
+                html.Div(
+                    create_error_notification("This shared link doesn't exist or has expired."),
+                    style={"padding": "40px"},
+                ),
+            ]
+        )
+
+    if shared.summary is not None:
+        summary = render_summary(shared.summary, shared.figures)
     else:
-        response = dcc.Markdown(response_content)
+        # Replaced by the summary job; left showing if the job is cancelled
+        summary = html.Div("No summary yet. Use Refresh summary to generate one.", className="chat-item answer")
+    charts = [dmc.Paper([dcc.Graph(figure=figure)]) for figure in shared.figures]
 
-    return dmc.LoadingOverlay(
+    return html.Div(
         [
+            home_button,
+            dbc.Button(
+                children="Refresh summary",
+                id="refresh-summary",
+                outline=True,
+                color="primary",
+                style={"margin": "10px"},
+            ),
             dbc.Button(
-                children="Home",
-                href="/",
-                style={"background-color": "#238BE6", "margin": "10px"},
+                children="Cancel",
+                id="cancel-summary",
+                outline=True,
+                color="secondary",
+                style={"display": "none"},
+            ),
+            dcc.Store(id="view-layout-id", data=layout_id),
+            # Fires once to start the summary job when none is stored yet
+            dcc.Interval(
+                id="view-summary-start", interval=1, max_intervals=0 if shared.summary is not None else 1
+            ),
+            html.Div(
+                [html.Div(id="view-summary-stream"), html.Div(summary, id="view-summary"), html.Div(charts)],
+                style={"padding": "40px"},
             ),
-            html.Div([response, html.Div(layout[1:])], style={"padding": "40px"}),
         ]
     )
+
+
+@callback(
+    Output("view-summary", "children"),
+    Input("view-summary-start", "n_intervals"),
+    Input("refresh-summary", "n_clicks"),
+    State("view-layout-id", "data"),
+    # Runs as a background job so a slow completion doesn't hold a web
+    # worker: the page polls for the streamed text and the result
+    background=True,
+    progress=Output("view-summary-stream", "children"),
+    progress_default=None,
+    running=[
+        (Output("refresh-summary", "disabled"), True, False),
+        (Output("cancel-summary", "style"), {"margin": "10px"}, {"display": "none"}),
+        (Output("view-summary", "style"), {"display": "none"}, {}),
+    ],
+    cancel=[Input("cancel-summary", "n_clicks")],
+    interval=config.STREAM_PROGRESS_INTERVAL_MS,
+    prevent_initial_call=True,
+)
+@metrics.timed("load_summary", flush=True)
+def load_summary(set_progress, n_intervals, n_clicks, layout_id):
+    shared = layout_store.load(layout_id)
+    if shared is None:
+        return create_error_notification("This shared link doesn't exist or has expired.")
+
+    set_progress(html.Div("Summarizing charts…", className="chat-item answer"))
+    summary = get_summary(
+        shared,
+        refresh=ctx.triggered_id == "refresh-summary",
+        on_progress=lambda text: set_progress(dcc.Markdown(text)),
+    )
+    return render_summary(summary, shared.figures)
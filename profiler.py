@@ -0,0 +1,355 @@
+"""
+Chunked single-pass profiling engine for large frames.
+
+Each chunk of rows is visited once and folded into a mergeable per-column
+state: counts, nulls, running mean/variance, min/max, a distinct-count sketch
+(exact hash set that switches to HyperLogLog once it grows large), top-k value
+counts and a small reservoir sample for quartiles. Frames bigger than the row
+budget are profiled from a uniform random sample so time and memory stay
+bounded.
+"""
+
+import math
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from config import config
+
+_DESCRIBE_INDEX = ["count", "mean", "std", "min", "25%", "50%", "75%", "max"]
+
+
+def _bit_length(values: np.ndarray) -> np.ndarray:
+    """Exact bit length of uint64 values (0 for 0)."""
+    hi = (values >> np.uint64(32)).astype(np.float64)
+    lo = (values & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    with np.errstate(divide="ignore"):
+        # float64 represents 32-bit integers exactly, so floor(log2) is exact here
+        hi_bits = np.where(hi > 0, np.floor(np.log2(hi)) + 1 + 32, 0)
+        lo_bits = np.where(lo > 0, np.floor(np.log2(lo)) + 1, 0)
+    return np.where(hi > 0, hi_bits, lo_bits).astype(np.int64)
+
+
+class DistinctCounter:
+    """Distinct-value counter: exact up to a limit, HyperLogLog beyond it."""
+
+    def __init__(self, precision: int = None, exact_limit: int = None):
+        self.precision = precision or config.PROFILE_HLL_PRECISION
+        self.exact_limit = exact_limit or config.PROFILE_EXACT_DISTINCT_LIMIT
+        self.hashes: Optional[np.ndarray] = np.empty(0, dtype=np.uint64)
+        self.registers: Optional[np.ndarray] = None
+
+    def _to_registers(self, hashes: np.ndarray):
+        p = self.precision
+        registers = np.zeros(1 << p, dtype=np.uint8)
+        if len(hashes):
+            index = (hashes >> np.uint64(64 - p)).astype(np.int64)
+            remainder = hashes << np.uint64(p)
+            rank = np.minimum(64 - _bit_length(remainder) + 1, 64 - p + 1).astype(np.uint8)
+            np.maximum.at(registers, index, rank)
+        return registers
+
+    def update(self, hashes: np.ndarray):
+        if self.registers is None:
+            self.hashes = np.union1d(self.hashes, hashes)
+            if len(self.hashes) > self.exact_limit:
+                self.registers = self._to_registers(self.hashes)
+                self.hashes = None
+        else:
+            np.maximum(self.registers, self._to_registers(hashes), out=self.registers)
+
+    def merge(self, other: "DistinctCounter"):
+        if other.registers is None:
+            self.update(other.hashes)
+        else:
+            if self.registers is None:
+                self.registers = self._to_registers(self.hashes)
+                self.hashes = None
+            np.maximum(self.registers, other.registers, out=self.registers)
+
+    @property
+    def is_exact(self) -> bool:
+        return self.registers is None
+
+    def estimate(self) -> int:
+        if self.registers is None:
+            return int(len(self.hashes))
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # Small-range correction (linear counting)
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+
+class ColumnState:
+    """Mergeable statistics for a single column."""
+
+    def __init__(self, name, numeric: bool, categorical: bool):
+        self.name = name
+        self.numeric = numeric
+        self.categorical = categorical
+        self.count = 0
+        self.nulls = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.distinct = DistinctCounter()
+        self.top = pd.Series(dtype="int64")  # Counts keyed by value hash
+        self.top_values = {}
+        self.reservoir = np.empty(0, dtype=np.float64)
+        self.reservoir_weight = 0
+
+    def _merge_moments(self, count, mean, m2, minimum, maximum):
+        if not count:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        # Chan et al. parallel variance update
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.mean += delta * count / total
+        self.min = minimum if self.min is None else min(self.min, minimum)
+        self.max = maximum if self.max is None else max(self.max, maximum)
+
+    def _merge_top(self, keys: np.ndarray, counts: np.ndarray, values):
+        """Fold value counts (keyed by value hash) into the top-k summary."""
+        capacity = config.PROFILE_TOPK_CAPACITY
+        if len(keys) > capacity:
+            keep = np.argpartition(-counts, capacity)[:capacity]
+            keys, counts = keys[keep], counts[keep]
+            values = [values[i] for i in keep]
+        self.top_values.update(zip(keys.tolist(), values))
+
+        incoming = pd.Series(counts, index=keys, dtype="int64")
+        combined = self.top.add(incoming, fill_value=0) if len(self.top) else incoming
+        if len(combined) > capacity:
+            combined = combined.nlargest(capacity)
+            self.top_values = {key: self.top_values[key] for key in combined.index.tolist()}
+        self.top = combined.astype("int64")
+
+    def _merge_reservoir(self, sample: np.ndarray, weight: int, rng: np.random.Generator):
+        size = config.PROFILE_QUANTILE_SAMPLE
+        total = self.reservoir_weight + weight
+        if len(self.reservoir) + len(sample) <= size:
+            self.reservoir = np.concatenate([self.reservoir, sample])
+        else:
+            # Keep each side in proportion to the number of rows it represents
+            keep_own = min(len(self.reservoir), round(size * self.reservoir_weight / total))
+            keep_new = min(len(sample), size - keep_own)
+            self.reservoir = np.concatenate([
+                rng.choice(self.reservoir, keep_own, replace=False),
+                rng.choice(sample, keep_new, replace=False),
+            ])
+        self.reservoir_weight = total
+
+    def update(self, series: pd.Series, rng: np.random.Generator):
+        values = series.dropna()
+        count = len(values)
+        self.nulls += len(series) - count
+        if not count:
+            return
+
+        # One hash per value feeds both the distinct counter and the top-k counts
+        hashes = pd.util.hash_pandas_object(values, index=False).to_numpy()
+        if self.categorical:
+            keys, first, counts = np.unique(hashes, return_index=True, return_counts=True)
+            self.distinct.update(keys)
+            self._merge_top(keys, counts, values.iloc[first].tolist())
+        else:
+            self.distinct.update(hashes)
+
+        if self.numeric:
+            array = values.to_numpy(dtype=np.float64)
+            mean = float(array.mean())
+            self._merge_moments(
+                count, mean, float(np.square(array - mean).sum()),
+                float(array.min()), float(array.max()),
+            )
+            if len(array) > config.PROFILE_QUANTILE_SAMPLE:
+                array = rng.choice(array, config.PROFILE_QUANTILE_SAMPLE, replace=False)
+            self._merge_reservoir(array, count, rng)
+        self.count += count
+
+    def merge(self, other: "ColumnState", rng: np.random.Generator):
+        self.nulls += other.nulls
+        self.distinct.merge(other.distinct)
+        if self.categorical and len(other.top):
+            keys = other.top.index.to_numpy()
+            self._merge_top(keys, other.top.to_numpy(), [other.top_values[k] for k in keys.tolist()])
+        if self.numeric:
+            self._merge_moments(other.count, other.mean, other.m2, other.min, other.max)
+            if other.reservoir_weight:
+                self._merge_reservoir(other.reservoir, other.reservoir_weight, rng)
+        self.count += other.count
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else float("nan")
+
+    def mode(self):
+        if not len(self.top):
+            return None
+        tied = [self.top_values[key] for key in self.top.index[self.top == self.top.max()].tolist()]
+        try:
+            # Match pandas.Series.mode, which returns the smallest tied value
+            return sorted(tied)[0]
+        except TypeError:
+            return tied[0]
+
+
+class ProfileState:
+    """Mergeable profile of a whole frame."""
+
+    def __init__(self, columns: Dict[str, ColumnState], head: pd.DataFrame, seed: int = 0):
+        self.columns = columns
+        self.head = head
+        self.rows = 0
+        self.sampled_rows = 0
+        self.rng = np.random.default_rng(seed)
+
+    @classmethod
+    def empty_like(cls, df: pd.DataFrame) -> "ProfileState":
+        columns = {}
+        for col in df.columns:
+            dtype = df[col].dtype
+            numeric = pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype)
+            categorical = (
+                pd.api.types.is_object_dtype(dtype)
+                or pd.api.types.is_string_dtype(dtype)
+                or isinstance(dtype, pd.CategoricalDtype)
+            )
+            columns[col] = ColumnState(col, numeric, categorical)
+        return cls(columns, df.head())
+
+    @property
+    def scale(self) -> float:
+        """Factor from sampled counts to whole-frame counts."""
+        return self.rows / self.sampled_rows if self.sampled_rows else 1.0
+
+    def update(self, chunk: pd.DataFrame):
+        for col, state in self.columns.items():
+            state.update(chunk[col], self.rng)
+        self.sampled_rows += len(chunk)
+
+    def merge(self, other: "ProfileState"):
+        """Fold another profile of the same columns into this one."""
+        for col, state in self.columns.items():
+            if col in other.columns:
+                state.merge(other.columns[col], self.rng)
+        self.rows += other.rows
+        self.sampled_rows += other.sampled_rows
+
+
+def profile_frame(df: pd.DataFrame, chunk_rows: int = None, row_budget: int = None) -> ProfileState:
+    """
+    Profile a DataFrame in a single chunked pass.
+
+    Args:
+        df: Frame to profile
+        chunk_rows: Rows per chunk (defaults to config setting)
+        row_budget: Profile a uniform sample of at most this many rows
+            (defaults to config setting, None or 0 profiles every row)
+
+    Returns:
+        Mergeable profile state
+    """
+    chunk_rows = chunk_rows or config.PROFILE_CHUNK_ROWS
+    if row_budget is None:
+        row_budget = config.PROFILE_ROW_BUDGET
+
+    state = ProfileState.empty_like(df)
+    source = df
+    if row_budget and len(df) > row_budget:
+        positions = np.sort(state.rng.choice(len(df), row_budget, replace=False))
+        source = df.iloc[positions]
+
+    for start in range(0, len(source), chunk_rows):
+        state.update(source.iloc[start:start + chunk_rows])
+    state.rows = len(df)
+    return state
+
+
+def _describe(state: ProfileState) -> pd.DataFrame:
+    """Build a DataFrame laid out like DataFrame.describe()."""
+    scale = state.scale
+    numeric = [s for s in state.columns.values() if s.numeric]
+    if numeric:
+        table = {}
+        for s in numeric:
+            q25, q50, q75 = (
+                np.quantile(s.reservoir, [0.25, 0.5, 0.75]) if len(s.reservoir) else [np.nan] * 3
+            )
+            table[s.name] = [
+                float(round(s.count * scale)), s.mean if s.count else np.nan, s.std,
+                s.min, q25, q50, q75, s.max,
+            ]
+        return pd.DataFrame(table, index=_DESCRIBE_INDEX)
+
+    table = {}
+    for s in state.columns.values():
+        top = s.mode()
+        table[s.name] = [
+            round(s.count * scale), s.distinct.estimate(), top,
+            round(s.top.max() * scale) if top is not None else np.nan,
+        ]
+    return pd.DataFrame(table, index=["count", "unique", "top", "freq"])
+
+
+def render_sections(state: ProfileState) -> list:
+    """Render a profile as (name, text) prompt sections, in prompt order."""
+    scale = state.scale
+    sampled = state.sampled_rows < state.rows
+
+    # Basic DataFrame Information
+    overview = [f"The DataFrame contains {state.rows} rows and {len(state.columns)} columns."]
+    if sampled:
+        overview.append(
+            f"Statistics below are estimated from a random sample of {state.sampled_rows} rows."
+        )
+    overview.append("Here are the first 5 rows of the DataFrame:\n")
+    overview.append(state.head.to_string(index=False))
+
+    # Summary Statistics
+    statistics = ["\nSummary Statistics:", _describe(state).to_string()]
+
+    # Column Information
+    columns = ["\nColumn Information:"]
+    for s in state.columns.values():
+        unique = s.distinct.estimate()
+        if sampled:
+            columns.append(f"- Column '{s.name}' has at least {unique} unique values.")
+        elif s.distinct.is_exact:
+            columns.append(f"- Column '{s.name}' has {unique} unique values.")
+        else:
+            columns.append(f"- Column '{s.name}' has approximately {unique} unique values.")
+
+    # Missing Values
+    missing = ["\nMissing Values:"]
+    for s in state.columns.values():
+        if s.nulls > 0:
+            missing.append(f"- Column '{s.name}' has {round(s.nulls * scale)} missing values.")
+
+    # Most Common Values in Categorical Columns
+    common = [
+        f"\nMost common value in '{s.name}' column: {s.mode()}"
+        for s in state.columns.values()
+        if s.categorical and s.count
+    ]
+
+    sections = [
+        ("overview", overview),
+        ("statistics", statistics),
+        ("columns", columns),
+        ("missing", missing),
+        ("common values", common),
+    ]
+    return [(name, "\n".join(lines)) for name, lines in sections if lines]
+
+
+def render_insights(state: ProfileState) -> str:
+    """Render a profile as the insight sections used in the chat prompt."""
+    return "\n".join(text for _, text in render_sections(state))
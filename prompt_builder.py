@@ -0,0 +1,350 @@
+"""
+Token-budgeted prompt assembly.
+
+Prompts are built from named sections, each with a weight. Sections marked
+required (instructions, the question) are always sent whole; the remaining
+budget is shared between the other sections in proportion to their weights,
+and a section that needs less than its share hands the rest to the others.
+Oversized sections are cut at line boundaries where possible, never mid-token.
+
+Token counts come from tiktoken when it is installed and from a character
+based estimate otherwise. Charts are described by compact statistics
+(extrema, trend, outliers) instead of their raw JSON.
+"""
+
+import logging
+import math
+import re
+from dataclasses import dataclass
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+except ImportError:  # Optional; fall back to the estimate below
+    tiktoken = None
+
+TRUNCATION_MARK = "…"
+
+_WORD_RE = re.compile(r"\w+|[^\w\s]")
+_encodings = {}
+
+
+def _encoding(model: str):
+    if tiktoken is None:
+        return None
+    if model not in _encodings:
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except KeyError:
+            _encodings[model] = tiktoken.get_encoding("o200k_base")
+    return _encodings[model]
+
+
+def count_tokens(text: str, model: str = None) -> int:
+    """
+    Count the tokens in a piece of text.
+
+    Args:
+        text: Text to count
+        model: Model whose tokenizer to use (defaults to config setting)
+
+    Returns:
+        Exact count with tiktoken, otherwise an estimate that errs high
+    """
+    if not text:
+        return 0
+    encoding = _encoding(model or config.OPENAI_MODEL)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    # BPE vocabularies cover common words in one token and split long words
+    # and digit runs into ~4 character pieces; punctuation is usually its own
+    return sum(math.ceil(len(piece) / 4) for piece in _WORD_RE.findall(text))
+
+
+def truncate_to_tokens(text: str, budget: int, model: str = None) -> str:
+    """
+    Shorten text to fit a token budget, preferring whole lines.
+
+    Args:
+        text: Text to shorten
+        budget: Tokens allowed, including the truncation mark
+        model: Model whose tokenizer to use
+
+    Returns:
+        The text unchanged if it fits, otherwise a prefix ending in the truncation mark
+    """
+    if count_tokens(text, model) <= budget:
+        return text
+    if budget <= 1:
+        return ""
+
+    budget -= count_tokens(TRUNCATION_MARK, model)
+    lines = text.split("\n")
+    kept, used = [], 0
+    for line in lines:
+        cost = count_tokens(line + "\n", model)
+        if used + cost > budget:
+            break
+        kept.append(line)
+        used += cost
+
+    # Spend what's left on a prefix of the next line (e.g. a very wide table row)
+    remaining = budget - used
+    if len(kept) < len(lines) and remaining > 0:
+        line = lines[len(kept)]
+        low, high = 0, len(line)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if count_tokens(line[:middle], model) <= remaining:
+                low = middle
+            else:
+                high = middle - 1
+        if low:
+            kept.append(line[:low] + TRUNCATION_MARK)
+            return "\n".join(kept)
+    return "\n".join(kept + [TRUNCATION_MARK])
+
+
+@dataclass
+class Section:
+    """One part of a prompt."""
+
+    name: str
+    text: str
+    weight: float = 1.0
+    required: bool = False
+    tokens: int = 0
+
+
+class PromptBuilder:
+    """Assemble sections into a prompt that fits a token budget."""
+
+    def __init__(self, budget: int, model: str = None, separator: str = "\n\n"):
+        self.budget = budget
+        self.model = model or config.OPENAI_MODEL
+        self.separator = separator
+        self.sections: List[Section] = []
+        self.allocations = {}
+
+    def add(self, name: str, text: str, weight: float = 1.0, required: bool = False) -> "PromptBuilder":
+        """Append a section; required sections are never shortened."""
+        if text:
+            self.sections.append(
+                Section(name, text, weight, required, count_tokens(text, self.model))
+            )
+        return self
+
+    def _allocate(self) -> dict:
+        separators = count_tokens(self.separator, self.model) * max(0, len(self.sections) - 1)
+        fixed = sum(s.tokens for s in self.sections if s.required)
+        available = max(0, self.budget - fixed - separators)
+
+        allocations = {s.name: s.tokens for s in self.sections if s.required}
+        pending = [s for s in self.sections if not s.required and s.weight > 0]
+        # Water-filling: sections that fit in their share take only what they need
+        while pending:
+            total_weight = sum(s.weight for s in pending)
+            fits = [s for s in pending if s.tokens <= available * s.weight / total_weight]
+            if not fits:
+                for s in pending:
+                    allocations[s.name] = int(available * s.weight / total_weight)
+                break
+            for s in fits:
+                allocations[s.name] = s.tokens
+                available -= s.tokens
+            pending = [s for s in pending if s not in fits]
+        return allocations
+
+    def build(self) -> str:
+        """Render the prompt, shortening sections that exceed their allocation."""
+        self.allocations = self._allocate()
+        parts = []
+        for s in self.sections:
+            allowed = self.allocations.get(s.name, 0)
+            text = s.text if s.tokens <= allowed else truncate_to_tokens(s.text, allowed, self.model)
+            if text:
+                parts.append(text)
+        prompt = self.separator.join(parts)
+        if any(self.allocations.get(s.name, 0) < s.tokens for s in self.sections):
+            logger.info(
+                f"Prompt trimmed to {count_tokens(prompt, self.model)} tokens "
+                f"(budget {self.budget}, sections {self.allocations})"
+            )
+        return prompt
+
+
+def _format_number(value) -> str:
+    if isinstance(value, (int, np.integer)) or (isinstance(value, float) and value.is_integer() and abs(value) < 1e15):
+        return f"{int(value):,}"
+    return f"{value:,.4g}"
+
+
+def _format_label(value) -> str:
+    if isinstance(value, (float, np.floating)):
+        return _format_number(float(value))
+    return str(value)
+
+
+def _numeric(values) -> Optional[np.ndarray]:
+    if not isinstance(values, (list, tuple)) or not values:
+        return None
+    numeric = pd.to_numeric(pd.Series(values), errors="coerce")
+    if numeric.notna().sum() == 0:
+        return None
+    return numeric.to_numpy(dtype=np.float64)
+
+
+def _describe_values(labels: list, values: np.ndarray, ordered: bool) -> List[str]:
+    """Extrema, mean, trend and outliers of one series of values."""
+    finite = np.isfinite(values)
+    points = values[finite]
+    where = np.flatnonzero(finite)
+    lines = [
+        f"{len(values)} points, min {_format_number(points.min())} at {_format_label(labels[where[points.argmin()]])}, "
+        f"max {_format_number(points.max())} at {_format_label(labels[where[points.argmax()]])}, "
+        f"mean {_format_number(points.mean())}"
+    ]
+
+    if ordered and len(points) >= 3 and np.ptp(where):
+        slope = np.polyfit(where.astype(np.float64), points, 1)[0]
+        change = slope * (len(values) - 1)
+        direction = "upward" if slope > 0 else "downward"
+        base = abs(points.mean()) or 1.0
+        if abs(change) / base >= 0.05:
+            lines.append(
+                f"{direction} trend: about {_format_number(slope)} per point "
+                f"({_format_number(change)} across the series)"
+            )
+        else:
+            lines.append("roughly flat")
+
+    std = points.std()
+    if len(points) >= 8 and std > 0:
+        scores = np.abs(points - points.mean()) / std
+        outliers = np.flatnonzero(scores > config.FIGURE_OUTLIER_ZSCORE)
+        if len(outliers):
+            worst = outliers[np.argsort(-scores[outliers])][:3]
+            listed = ", ".join(
+                f"{_format_number(points[i])} at {_format_label(labels[where[i]])}" for i in worst
+            )
+            lines.append(f"{len(outliers)} outlier(s), e.g. {listed}")
+    return lines
+
+
+def _describe_categories(labels: list, values: np.ndarray, limit: int = 5) -> List[str]:
+    totals = pd.Series(values, index=[str(label) for label in labels]).dropna()
+    totals = totals.groupby(level=0, sort=False).sum()
+    lines = [f"{len(totals)} categories totalling {_format_number(totals.sum())}"]
+    if len(totals):
+        top = totals.nlargest(limit)
+        lines.append("largest: " + ", ".join(f"{k} ({_format_number(v)})" for k, v in top.items()))
+        if len(totals) > limit:
+            bottom = totals.nsmallest(min(3, len(totals) - limit))
+            lines.append("smallest: " + ", ".join(f"{k} ({_format_number(v)})" for k, v in bottom.items()))
+    return lines
+
+
+def _axis_title(layout: dict, axis: str) -> Optional[str]:
+    title = layout.get(axis, {}).get("title") if isinstance(layout.get(axis), dict) else None
+    if isinstance(title, dict):
+        title = title.get("text")
+    return title or None
+
+
+def summarize_trace(trace: dict) -> List[str]:
+    """Describe one Plotly trace as a few lines of statistics."""
+    kind = trace.get("type", "scatter")
+    header = f"{kind} trace" + (f" '{trace['name']}'" if trace.get("name") else "")
+
+    if kind == "pie":
+        labels, values = trace.get("labels") or [], _numeric(trace.get("values"))
+        if values is None:
+            values = np.ones(len(labels))
+        return [header] + _describe_categories(labels, values)
+
+    if kind == "histogram":
+        samples = trace.get("y") if "y" in trace and "x" not in trace else trace.get("x")
+        numeric = _numeric(samples)
+        if numeric is None:
+            labels = [str(v) for v in samples or []]
+            return [header] + _describe_categories(labels, np.ones(len(labels)))
+        finite = numeric[np.isfinite(numeric)]
+        quartiles = np.percentile(finite, [25, 50, 75])
+        return [
+            header,
+            f"{len(numeric)} samples, range {_format_number(finite.min())} to {_format_number(finite.max())}, "
+            f"median {_format_number(quartiles[1])}, "
+            f"IQR {_format_number(quartiles[0])}–{_format_number(quartiles[2])}",
+        ]
+
+    horizontal = trace.get("orientation") == "h"
+    label_key, value_key = ("y", "x") if horizontal else ("x", "y")
+    values = _numeric(trace.get(value_key))
+    if values is None:
+        # Only one axis given (e.g. a bare y list); plotly plots it against its index
+        values = _numeric(trace.get(label_key))
+        labels = list(range(len(values))) if values is not None else []
+    else:
+        labels = trace.get(label_key)
+        if not isinstance(labels, (list, tuple)) or len(labels) != len(values):
+            labels = list(range(len(values)))
+    if values is None:
+        return [header + " with no numeric data"]
+
+    if kind == "bar":
+        return [header] + _describe_categories(list(labels), values)
+
+    positions = _numeric(labels)
+    ordered = positions is None or bool(np.all(np.diff(positions[np.isfinite(positions)]) >= 0))
+    if positions is None:
+        dates = pd.to_datetime(pd.Series(labels), errors="coerce", format="mixed")
+        ordered = bool(dates.notna().all() and dates.is_monotonic_increasing) or ordered
+    return [header] + _describe_values(list(labels), values, ordered)
+
+
+def summarize_figure(figure: dict) -> str:
+    """
+    Describe a Plotly figure with compact statistics instead of raw arrays.
+
+    Args:
+        figure: Plotly figure dict
+
+    Returns:
+        A short multi-line description (title, axes, and per-trace statistics)
+    """
+    layout = figure.get("layout") or {}
+    title = layout.get("title")
+    if isinstance(title, dict):
+        title = title.get("text")
+
+    lines = [f"Title: {title}" if title else "Untitled chart"]
+    axes = [f"{axis[0]}: {name}" for axis in ("xaxis", "yaxis") if (name := _axis_title(layout, axis))]
+    if axes:
+        lines.append("Axes: " + ", ".join(axes))
+    for trace in figure.get("data") or []:
+        try:
+            trace_lines = summarize_trace(trace)
+        except (TypeError, ValueError) as e:
+            logger.info(f"Could not summarize {trace.get('type', 'scatter')} trace: {e}")
+            trace_lines = [f"{trace.get('type', 'scatter')} trace (not summarized)"]
+        lines.append("- " + trace_lines[0])
+        lines.extend(f"  {line}" for line in trace_lines[1:])
+    return "\n".join(lines)
+
+
+def add_figures(builder: PromptBuilder, figures: list):
+    """Add one equally weighted section per figure, each at least the per-chart floor."""
+    for i, figure in enumerate(figures, start=1):
+        builder.add(f"chart {i}", f"Chart {i}:\n{summarize_figure(figure)}")
+
+    # Keep every chart represented even when there are many of them
+    floor = config.VIEW_MIN_CHART_TOKENS * len(figures)
+    builder.budget = max(builder.budget, floor + sum(s.tokens for s in builder.sections if s.required))
+    return builder
@@ -0,0 +1,545 @@
+"""
+Deterministic answers to aggregation questions, computed with pandas.
+
+Questions like "total sum_upload for UF" or "which ga_name has the largest
+sum_eje" are answered exactly from the full server-side frame instead of
+being left to the model and a five-row sample. A small intent parser maps
+the question onto columns, values named in it, and an aggregation, and
+writes the answer as a pandas expression. Expressions (the parser's, or the
+model's when QUERY_LLM_EXPRESSIONS is on) only run after an AST whitelist
+check, in a forked child process with CPU and memory limits that is killed
+if it runs past its time limit. The computed facts go into the prompt so the
+model only writes the narrative around them.
+"""
+
+import ast
+import logging
+import math
+import multiprocessing
+import re
+import resource
+from dataclasses import dataclass, field
+from numbers import Number
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from cache import TTLCache
+from config import config
+from financial_cube import FinancialCube, get_cube
+
+logger = logging.getLogger(__name__)
+
+
+class QueryError(ValueError):
+    """Raised when an expression is not allowed, fails, or runs too long."""
+
+
+# --- Sandboxed evaluation ----------------------------------------------------
+
+_ALLOWED_NODES = (
+    ast.Expression, ast.Call, ast.Attribute, ast.Name, ast.Subscript, ast.Slice,
+    ast.Constant, ast.List, ast.Tuple, ast.Compare, ast.BoolOp, ast.BinOp,
+    ast.UnaryOp, ast.keyword, ast.Load,
+    ast.And, ast.Or, ast.Not, ast.Invert, ast.USub, ast.UAdd,
+    ast.BitAnd, ast.BitOr, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod,
+    ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE,
+)
+
+_ALLOWED_ATTRIBUTES = {
+    # Aggregations
+    "sum", "mean", "median", "min", "max", "count", "size", "nunique", "std", "var",
+    "quantile", "idxmax", "idxmin", "cumsum", "diff", "pct_change", "describe",
+    # Selection and reshaping
+    "groupby", "sort_values", "sort_index", "head", "tail", "nlargest", "nsmallest",
+    "loc", "iloc", "isin", "between", "notna", "isna", "dropna", "fillna", "unique",
+    "value_counts", "reset_index", "abs", "round", "first", "last",
+    # Accessors
+    "shape", "columns", "index", "dt", "year", "month", "str", "contains",
+    "startswith", "endswith", "lower", "upper",
+}
+
+# Method names passed as strings (e.g. agg("to_csv", ...)) would bypass the
+# attribute check above, so only plain option keywords are accepted
+_ALLOWED_KEYWORDS = {
+    "ascending", "by", "case", "dropna", "inclusive", "keep", "n", "na", "normalize",
+    "numeric_only", "observed", "q", "regex", "skipna",
+}
+
+# Integer multipliers above this are rejected: a column of text times a large
+# number repeats every string that many times
+_MAX_INT_MULTIPLIER = 1_000
+
+_SAFE_BUILTINS = {"len": len, "abs": abs, "round": round}
+
+
+def check_expression(expression: str) -> ast.Expression:
+    """
+    Parse an expression and reject anything outside the pandas whitelist.
+
+    Args:
+        expression: Python expression over a DataFrame named ``df``
+
+    Returns:
+        The parsed expression
+
+    Raises:
+        QueryError: If the expression is too long, malformed, or not allowed
+    """
+    if len(expression) > config.QUERY_MAX_EXPRESSION_CHARS:
+        raise QueryError("Expression is too long")
+    try:
+        tree = ast.parse(expression, mode="eval")
+    except SyntaxError as e:
+        raise QueryError(f"Not a valid expression: {e.msg}") from e
+
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_NODES):
+            raise QueryError(f"{type(node).__name__} is not allowed")
+        if isinstance(node, ast.Name) and node.id != "df" and node.id not in _SAFE_BUILTINS:
+            raise QueryError(f"Name '{node.id}' is not allowed")
+        if isinstance(node, ast.Attribute) and (
+            node.attr.startswith("_") or node.attr not in _ALLOWED_ATTRIBUTES
+        ):
+            raise QueryError(f"Attribute '{node.attr}' is not allowed")
+        if isinstance(node, ast.Call) and not isinstance(node.func, (ast.Attribute, ast.Name)):
+            raise QueryError("Only method and builtin calls are allowed")
+        if isinstance(node, ast.keyword) and node.arg not in _ALLOWED_KEYWORDS:
+            raise QueryError(f"Keyword argument '{node.arg or '**'}' is not allowed")
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (str, int, float, bool, type(None))):
+            raise QueryError("Unsupported constant")
+        if isinstance(node, ast.BinOp):
+            for operand in (node.left, node.right):
+                if isinstance(operand, (ast.List, ast.Tuple)) or (
+                    isinstance(operand, ast.Constant) and isinstance(operand.value, (str, bool, type(None)))
+                ):
+                    raise QueryError("Arithmetic on text or lists is not allowed")
+                if (
+                    isinstance(node.op, ast.Mult) and isinstance(operand, ast.Constant)
+                    and isinstance(operand.value, int) and abs(operand.value) > _MAX_INT_MULTIPLIER
+                ):
+                    raise QueryError(f"Integer multipliers above {_MAX_INT_MULTIPLIER} are not allowed")
+    return tree
+
+
+def _limit_resources(timeout: float):
+    """Cap the evaluating child's CPU time and the memory it adds to what it forked with."""
+    cpu_seconds = math.ceil(timeout) + 1
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds))
+    try:
+        with open("/proc/self/statm") as f:
+            inherited = int(f.read().split()[0]) * resource.getpagesize()
+    except OSError:
+        return
+    limit = inherited + config.QUERY_EVAL_MEMORY_BYTES
+    hard = resource.getrlimit(resource.RLIMIT_AS)[1]
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+def _evaluate(code, df: pd.DataFrame, conn, timeout: float):
+    """Child process: evaluate the expression and send back (ok, value or error message)."""
+    try:
+        _limit_resources(timeout)
+        value = eval(code, {"__builtins__": {}, **_SAFE_BUILTINS}, {"df": df})
+        conn.send((True, value))
+    except MemoryError:
+        conn.send((False, "used too much memory"))
+    except Exception as e:
+        conn.send((False, str(e)))
+    finally:
+        conn.close()
+
+
+def safe_eval(expression: str, df: pd.DataFrame, timeout: float = None):
+    """
+    Evaluate a whitelisted pandas expression against a frame.
+
+    The evaluation runs in a forked child process, which shares the frame
+    copy-on-write and has its CPU time and added memory capped
+    (QUERY_EVAL_MEMORY_BYTES). The child is killed if it hasn't answered
+    within the timeout, so a runaway expression can't hold on to the
+    worker's threads or memory.
+
+    Args:
+        expression: Python expression over a DataFrame named ``df``
+        df: The dataset
+        timeout: Seconds to wait (defaults to config setting)
+
+    Returns:
+        The expression's value
+
+    Raises:
+        QueryError: If the expression is rejected, raises, or times out
+    """
+    code = compile(check_expression(expression), "<query>", "eval")
+    timeout = timeout or config.QUERY_EVAL_TIMEOUT_SECONDS
+    context = multiprocessing.get_context("fork")
+    receiver, sender = context.Pipe(duplex=False)
+    child = context.Process(target=_evaluate, args=(code, df, sender, timeout))
+    child.start()
+    sender.close()
+    try:
+        if not receiver.poll(timeout):
+            raise QueryError("Expression took too long")
+        ok, value = receiver.recv()
+    except (EOFError, OSError) as e:
+        # The child died without answering, e.g. on its CPU limit
+        raise QueryError("Expression was stopped by its resource limits") from e
+    finally:
+        child.kill()
+        child.join()
+        receiver.close()
+    if not ok:
+        raise QueryError(f"Expression failed: {value}")
+    return value
+
+
+# --- Intent parsing ----------------------------------------------------------
+
+_STAT_PATTERNS = [
+    ("count", re.compile(r"\b(how many|count|number of)\b")),
+    ("mean", re.compile(r"\b(average|mean|avg)\b")),
+    ("median", re.compile(r"\bmedian\b")),
+    ("sum", re.compile(r"\b(total|sum|overall)\b")),
+]
+_MAX_RE = re.compile(r"\b(max|maximum|highest|largest|biggest|greatest|most|top)\b")
+_MIN_RE = re.compile(r"\b(min|minimum|lowest|smallest|least|fewest|bottom)\b")
+_LIMIT_RE = re.compile(r"\b(?:top|bottom) (\d+)\b")
+_GROUP_RE = re.compile(r"\b(?:which|what|by|per|each|every|across|top \d+|bottom \d+) (?:\w+ )??col(\d+)\b")
+_ID_NAME_RE = re.compile(r"(^| )(id|code|key|number|no)$")
+
+_value_indexes = TTLCache(8)
+
+
+def _tokens(text) -> tuple:
+    return tuple(re.findall(r"[a-z0-9]+", str(text).lower()))
+
+
+def _variants(tokens: tuple) -> List[tuple]:
+    """A column name and its simple plurals ("company" -> "companies")."""
+    *head, last = tokens
+    forms = [last, last + "s", last + "es"]
+    if last.endswith("y"):
+        forms.append(last[:-1] + "ies")
+    return [tuple(head) + (form,) for form in forms]
+
+
+def measure_columns(df: pd.DataFrame) -> List[str]:
+    """Numeric columns worth aggregating (codes and IDs are left out)."""
+    return [
+        col for col in df.columns
+        if pd.api.types.is_numeric_dtype(df[col])
+        and not pd.api.types.is_bool_dtype(df[col])
+        and not _ID_NAME_RE.search(" ".join(_tokens(col)))
+    ]
+
+
+def _value_index(df: pd.DataFrame, dataset_id: Optional[str]) -> dict:
+    """Map the normalized values of low-cardinality text columns to (column, value)."""
+    index = _value_indexes.get(dataset_id) if dataset_id else None
+    if index is not None:
+        return index
+
+    index = {}
+    for col in df.columns:
+        if pd.api.types.is_numeric_dtype(df[col]) or pd.api.types.is_bool_dtype(df[col]):
+            continue
+        values = df[col].dropna().unique()
+        if len(values) > config.QUERY_MAX_FILTER_CARDINALITY:
+            continue
+        for value in values:
+            tokens = _tokens(value)
+            if tokens and (len(tokens) > 1 or len(tokens[0]) > 1):
+                index.setdefault(tokens, (col, value))
+    if dataset_id:
+        _value_indexes.set(dataset_id, index)
+    return index
+
+
+@dataclass
+class Query:
+    """
+    A parsed question: the pandas expression that answers it and a label.
+
+    Sums (optionally filtered and grouped) also carry their plan, so they
+    can be answered from a pre-aggregated cube instead of the expression.
+    """
+
+    expression: str
+    label: str
+    filters: Dict[str, list] = field(default_factory=dict)
+    group: Optional[str] = None
+    measures: List[str] = field(default_factory=list)
+    direction: Optional[str] = None
+    limit: int = 1
+    summable: bool = False
+
+
+def _match_spans(words: tuple, df: pd.DataFrame, values: dict) -> list:
+    """Replace column names and known values in the question with placeholders."""
+    candidates = []
+    for col in df.columns:
+        for variant in _variants(_tokens(col)) if _tokens(col) else []:
+            candidates.append((len(variant), 1, variant, ("col", col)))
+    # Look up the question's n-grams rather than scanning every known value
+    for length in range(1, min(len(words), 6) + 1):
+        for start in range(len(words) - length + 1):
+            tokens = words[start:start + length]
+            if tokens in values:
+                candidates.append((length, 0, tokens, ("val", values[tokens])))
+    # Longest names first; column names win ties with values
+    candidates.sort(key=lambda c: (-c[0], -c[1]))
+
+    slots = list(words)
+    taken = [False] * len(words)
+    for length, _, tokens, match in candidates:
+        for start in range(len(words) - length + 1):
+            if words[start:start + length] == tokens and not any(taken[start:start + length]):
+                slots[start] = match
+                for i in range(start + 1, start + length):
+                    slots[i] = None
+                taken[start:start + length] = [True] * length
+    return [slot for slot in slots if slot is not None]
+
+
+def parse_question(df: pd.DataFrame, question: str, dataset_id: str = None) -> Optional[Query]:
+    """
+    Turn an aggregation question into a pandas expression.
+
+    Args:
+        df: The dataset the question is about
+        question: The user's question
+        dataset_id: Dataset store ID, used to cache the value index
+
+    Returns:
+        The query, or None if the question isn't a recognisable aggregation
+    """
+    slots = _match_spans(_tokens(question), df, _value_index(df, dataset_id))
+    columns, filters, words = [], {}, []
+    for slot in slots:
+        if isinstance(slot, tuple) and slot[0] == "col":
+            if slot[1] not in columns:
+                columns.append(slot[1])
+            words.append(f"col{columns.index(slot[1])}")
+        elif isinstance(slot, tuple):
+            col, value = slot[1]
+            filters.setdefault(col, [])
+            if value not in filters[col]:
+                filters[col].append(value)
+            words.append("val")
+        else:
+            words.append(slot)
+    text = " ".join(words)
+
+    stat = next((name for name, pattern in _STAT_PATTERNS if pattern.search(text)), None)
+    direction = "max" if _MAX_RE.search(text) else "min" if _MIN_RE.search(text) else None
+    limit = int(_LIMIT_RE.search(text).group(1)) if _LIMIT_RE.search(text) else 1
+
+    measures = [col for col in columns if col in measure_columns(df)]
+    groups = [
+        columns[int(i)] for i in _GROUP_RE.findall(text) if columns[int(i)] not in measures
+    ]
+    others = [col for col in columns if col not in measures and col not in groups]
+    # A breakdown ("Revenue by company") is a sum even without "total"
+    if stat is None and direction is None and not groups:
+        return None
+
+    # Rows named by values in the question, e.g. "for UF" -> company == "UF"
+    filters = {col: vals for col, vals in filters.items() if col not in groups}
+    conditions, described = [], []
+    for col, vals in filters.items():
+        if len(vals) == 1:
+            conditions.append(f"(df[{col!r}] == {vals[0]!r})")
+            described.append(f"{col} = {vals[0]}")
+        else:
+            conditions.append(f"(df[{col!r}].isin({list(vals)!r}))")
+            described.append(f"{col} in {', '.join(map(str, vals))}")
+    base = f"df[{' & '.join(conditions)}]" if conditions else "df"
+    where = f" where {' and '.join(described)}" if described else ""
+
+    if groups:
+        group = groups[0]
+        if not measures and stat is None and filters:
+            measures = measure_columns(df)
+        if not measures:
+            if stat not in (None, "count"):
+                return None
+            how, series, what, order = "count", f"{base}.groupby({group!r}, observed=True).size()", "rows", ""
+        else:
+            how = stat if stat in ("mean", "median", "count") else "sum"
+            selected = repr(measures[0]) if len(measures) == 1 else repr(measures)
+            series = f"{base}.groupby({group!r}, observed=True)[{selected}].{how}()"
+            what = f"{how} of {', '.join(measures)}"
+            order = "" if len(measures) == 1 else f"{measures[0]!r}, "
+        plan = dict(
+            filters=filters, group=group, measures=measures or ["rows"], direction=direction,
+            limit=limit, summable=how == "sum" or not measures,
+        )
+        if direction:
+            rank = "nlargest" if direction == "max" else "nsmallest"
+            return Query(
+                f"{series}.{rank}({limit}{', ' + repr(measures[0]) if len(measures) > 1 else ''})",
+                f"{group} with the {direction} {what}{where}",
+                **plan,
+            )
+        return Query(
+            f"{series}.sort_values({order}ascending=False).head({config.QUERY_MAX_RESULT_ROWS})",
+            f"{what} by {group}{where}",
+            **plan,
+        )
+
+    if stat == "count":
+        if others and not filters.get(others[0]):
+            return Query(f"{base}[{others[0]!r}].nunique()", f"distinct {others[0]} values{where}")
+        if measures:
+            return Query(f"{base}[{measures[0]!r}].count()", f"count of {measures[0]}{where}")
+        return Query(f"len({base})", f"rows{where}", filters=filters, measures=["rows"], summable=True)
+
+    if not measures:
+        # "total Revenue for UF": no measure named, so report every measure
+        if not filters or not measure_columns(df):
+            return None
+        measures = measure_columns(df)
+
+    if stat is None:
+        if len(measures) == 1:
+            rank = "nlargest" if direction == "max" else "nsmallest"
+            return Query(f"{base}.{rank}(1, {measures[0]!r})", f"row with the {direction} {measures[0]}{where}")
+        stat = direction
+
+    selected = f"{base}[{measures[0]!r}]" if len(measures) == 1 else f"{base}[{measures!r}]"
+    return Query(
+        f"{selected}.{stat}()",
+        f"{stat} of {', '.join(measures)}{where}",
+        filters=filters, measures=measures, summable=stat == "sum",
+    )
+
+
+# --- Model-written expressions -------------------------------------------------
+
+def _llm_expression(df: pd.DataFrame, question: str) -> Optional[str]:
+    from openai_client import openai_client
+
+    schema = "\n".join(f"- {col!r}: {dtype}" for col, dtype in df.dtypes.items())
+    prompt = (
+        "Write one pandas expression over a DataFrame named `df` that computes the answer "
+        "to the question below. Use only DataFrame/Series methods (no imports, no lambdas, "
+        "no assignments). Reply with the expression alone, or NONE if the question can't be "
+        f"answered by a computation.\n\nColumns:\n{schema}\n\nQuestion: {question}"
+    )
+    response = openai_client.chat_completion(
+        messages=[{"role": "user", "content": prompt}], temperature=0
+    )
+    if not response:
+        return None
+    expression = response.strip().strip("`").removeprefix("python").strip()
+    return None if expression.upper() == "NONE" else expression
+
+
+# --- Answers -------------------------------------------------------------------
+
+def _format_value(value) -> str:
+    if isinstance(value, (bool, np.bool_)):
+        return str(value)
+    if isinstance(value, (int, np.integer)):
+        return f"{int(value):,}"
+    if isinstance(value, Number):
+        value = float(value)
+        return f"{value:,.0f}" if value.is_integer() else f"{value:,.2f}"
+    return str(value)
+
+
+@dataclass
+class QueryResult:
+    """An exactly computed answer to a question."""
+
+    label: str
+    expression: str
+    lines: List[str] = field(default_factory=list)
+
+    @property
+    def text(self) -> str:
+        return f"{self.label}:\n" + "\n".join(f"- {line}" for line in self.lines)
+
+    def markdown(self) -> str:
+        return f"**Computed answer** ({self.label})\n\n" + "\n".join(f"- {line}" for line in self.lines)
+
+
+def _result_lines(value) -> List[str]:
+    limit = config.QUERY_MAX_RESULT_ROWS
+    if isinstance(value, pd.DataFrame):
+        # Grouped results are labelled by their index; plain row lookups aren't
+        labelled = not isinstance(value.index, pd.RangeIndex) and value.index.name is not None
+        return [
+            (f"{index}: " if labelled else "")
+            + ", ".join(f"{col} = {_format_value(row[col])}" for col in value.columns)
+            for index, row in value.head(limit).iterrows()
+        ]
+    if isinstance(value, pd.Series):
+        lines = [f"{index}: {_format_value(item)}" for index, item in value.head(limit).items()]
+        if len(value) > limit:
+            lines.append(f"({len(value) - limit} more not shown)")
+        return lines
+    if isinstance(value, (tuple, list)):
+        return [", ".join(_format_value(item) for item in value)]
+    return [_format_value(value)]
+
+
+def _from_cube(cube: Optional[FinancialCube], query: Query):
+    """Answer a sum from the financial cube, shaped like the expression's result."""
+    if cube is None:
+        return None
+    totals = cube.query(query.filters, query.group, query.measures)
+    if totals is None:
+        return None
+
+    if query.group is None:
+        row = totals.iloc[0]
+        return row.iloc[0] if len(query.measures) == 1 else row
+    if len(query.measures) == 1:
+        totals = totals[query.measures[0]]
+        if query.direction:
+            return totals.nlargest(query.limit) if query.direction == "max" else totals.nsmallest(query.limit)
+        return totals.sort_values(ascending=False).head(config.QUERY_MAX_RESULT_ROWS)
+    if query.direction:
+        rank = totals.nlargest if query.direction == "max" else totals.nsmallest
+        return rank(query.limit, query.measures[0])
+    return totals.sort_values(query.measures[0], ascending=False).head(config.QUERY_MAX_RESULT_ROWS)
+
+
+def answer_question(df: pd.DataFrame, question: str, dataset_id: str = None) -> Optional[QueryResult]:
+    """
+    Compute the answer to an aggregation question, if it is one.
+
+    Args:
+        df: The dataset the question is about
+        question: The user's question
+        dataset_id: Dataset store ID, used for caching
+
+    Returns:
+        The computed answer, or None when the question needs the model
+    """
+    if not config.QUERY_ENGINE_ENABLED or not question:
+        return None
+
+    query = parse_question(df, question, dataset_id)
+    if query is None and config.QUERY_LLM_EXPRESSIONS:
+        expression = _llm_expression(df, question)
+        query = Query(expression, "result") if expression else None
+    if query is None:
+        return None
+
+    value = _from_cube(get_cube(df, dataset_id), query) if query.summable else None
+    if value is None:
+        try:
+            value = safe_eval(query.expression, df)
+        except QueryError as e:
+            logger.info(f"Could not compute {query.expression!r}: {e}")
+            return None
+    if isinstance(value, (pd.Series, pd.DataFrame)) and value.empty:
+        return None
+    logger.info(f"Answered {question!r} locally with {query.expression}")
+    return QueryResult(query.label, query.expression, _result_lines(value))
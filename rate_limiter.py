@@ -0,0 +1,229 @@
+"""
+Token-bucket rate limiting for OpenAI requests.
+
+Two buckets are enforced together: requests per minute and tokens per
+minute. Buckets live in Redis so every gunicorn worker draws from the same
+budget; if Redis is unreachable each worker falls back to an in-process
+bucket holding its share of the budget. Callers wait for capacity instead
+of firing requests that would come back as RateLimitError.
+"""
+
+import asyncio
+import logging
+import math
+import threading
+import time
+from typing import Optional
+
+import redis
+
+from config import config
+from constants import redis_instance
+
+logger = logging.getLogger(__name__)
+
+# KEYS: request bucket, token bucket, usage counter
+# ARGV: request capacity, request refill per ms, token capacity, token refill
+#       per ms, request cost, token cost, force (charge even if it must wait)
+_ACQUIRE_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000)
+
+local function refill(key, capacity, rate)
+    local bucket = redis.call('HMGET', key, 'level', 'ts')
+    local level = tonumber(bucket[1])
+    local ts = tonumber(bucket[2])
+    if level == nil then
+        return capacity
+    end
+    return math.min(capacity, level + (now - ts) * rate)
+end
+
+local req_capacity, req_rate = tonumber(ARGV[1]), tonumber(ARGV[2])
+local tok_capacity, tok_rate = tonumber(ARGV[3]), tonumber(ARGV[4])
+local req_cost, tok_cost = tonumber(ARGV[5]), tonumber(ARGV[6])
+local force = ARGV[7] == '1'
+
+local req_level = refill(KEYS[1], req_capacity, req_rate)
+local tok_level = refill(KEYS[2], tok_capacity, tok_rate)
+
+local wait = 0
+if req_level < req_cost then
+    wait = math.max(wait, (req_cost - req_level) / req_rate)
+end
+local tok_needed = math.min(tok_cost, tok_capacity)
+if tok_cost > 0 and tok_level < tok_needed then
+    wait = math.max(wait, (tok_needed - tok_level) / tok_rate)
+end
+
+if wait == 0 or force then
+    req_level = req_level - req_cost
+    tok_level = tok_level - tok_cost
+    if req_cost > 0 or tok_cost ~= 0 then
+        redis.call('HINCRBY', KEYS[3], 'requests', req_cost)
+        redis.call('HINCRBY', KEYS[3], 'tokens', tok_cost)
+        redis.call('EXPIRE', KEYS[3], 120)
+    end
+end
+
+redis.call('HSET', KEYS[1], 'level', tostring(req_level), 'ts', now)
+redis.call('HSET', KEYS[2], 'level', tostring(tok_level), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], 120000)
+redis.call('PEXPIRE', KEYS[2], 120000)
+
+return {math.ceil(wait), math.floor(req_level), math.floor(tok_level)}
+"""
+
+
+def estimate_tokens(messages: list, max_tokens: Optional[int] = None) -> int:
+    """Rough token cost of a request: ~4 characters per prompt token plus the completion budget."""
+    prompt_chars = sum(len(str(message.get("content", ""))) for message in messages)
+    completion = max_tokens or config.RATE_LIMIT_COMPLETION_TOKENS
+    return prompt_chars // 4 + 4 * len(messages) + completion
+
+
+class _LocalBuckets:
+    """In-process twin of the Redis script, used when Redis is unavailable."""
+
+    def __init__(self, request_capacity: float, token_capacity: float):
+        self.request_capacity = request_capacity
+        self.token_capacity = token_capacity
+        self.request_level = request_capacity
+        self.token_level = token_capacity
+        self.updated = time.monotonic()
+        self.usage = {}  # minute -> [requests, tokens]
+        self._lock = threading.Lock()
+
+    def take(self, request_cost: int, token_cost: int, force: bool = False):
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self.updated
+            self.updated = now
+            self.request_level = min(
+                self.request_capacity, self.request_level + elapsed * self.request_capacity / 60
+            )
+            self.token_level = min(
+                self.token_capacity, self.token_level + elapsed * self.token_capacity / 60
+            )
+
+            wait = 0.0
+            if self.request_level < request_cost:
+                wait = max(wait, (request_cost - self.request_level) * 60 / self.request_capacity)
+            token_needed = min(token_cost, self.token_capacity)
+            if token_cost > 0 and self.token_level < token_needed:
+                wait = max(wait, (token_needed - self.token_level) * 60 / self.token_capacity)
+
+            if wait == 0 or force:
+                self.request_level -= request_cost
+                self.token_level -= token_cost
+                minute = int(time.time() // 60)
+                counts = self.usage.setdefault(minute, [0, 0])
+                counts[0] += request_cost
+                counts[1] += token_cost
+                for old in [m for m in self.usage if m < minute - 1]:
+                    del self.usage[old]
+            return wait, self.request_level, self.token_level
+
+
+class TokenBucketLimiter:
+    """Requests-per-minute and tokens-per-minute limiter shared across workers."""
+
+    def __init__(self):
+        self.enabled = config.RATE_LIMIT_ENABLED
+        self.request_capacity = config.MAX_REQUESTS_PER_MINUTE
+        self.token_capacity = config.MAX_TOKENS_PER_MINUTE
+        self.max_wait = config.RATE_LIMIT_MAX_WAIT
+        self._script = None
+        # Without a shared bucket each worker may only use its share of the budget
+        workers = max(1, config.WORKER_COUNT)
+        self._local = _LocalBuckets(self.request_capacity / workers, self.token_capacity / workers)
+        self._using_local = False
+
+    def _usage_key(self) -> str:
+        return f"ratelimit:usage:{int(time.time() // 60)}"
+
+    def _take(self, request_cost: int, token_cost: int, force: bool = False):
+        """Try to take capacity; returns (wait seconds, request level, token level)."""
+        try:
+            if self._script is None:
+                self._script = redis_instance.register_script(_ACQUIRE_SCRIPT)
+            wait_ms, request_level, token_level = self._script(
+                keys=["ratelimit:requests", "ratelimit:tokens", self._usage_key()],
+                args=[
+                    self.request_capacity, self.request_capacity / 60000,
+                    self.token_capacity, self.token_capacity / 60000,
+                    request_cost, token_cost, "1" if force else "0",
+                ],
+            )
+            if self._using_local:
+                logger.info("Rate limiter reconnected to Redis")
+                self._using_local = False
+            return wait_ms / 1000, request_level, token_level
+        except redis.RedisError as e:
+            if not self._using_local:
+                logger.warning(f"Rate limiter falling back to in-process buckets: {e}")
+                self._using_local = True
+            return self._local.take(request_cost, token_cost, force)
+
+    async def acquire(self, tokens: int, max_wait: float = None) -> bool:
+        """
+        Wait until one request and the given number of tokens are available.
+
+        Args:
+            tokens: Estimated tokens for the request (prompt plus completion)
+            max_wait: Longest time to queue, in seconds (defaults to config setting)
+
+        Returns:
+            True if capacity was taken, False if it wasn't available in time
+        """
+        if not self.enabled:
+            return True
+        if max_wait is None:
+            max_wait = self.max_wait
+
+        deadline = time.monotonic() + max_wait
+        while True:
+            wait, _, _ = await asyncio.to_thread(self._take, 1, tokens)
+            if wait <= 0:
+                return True
+            if time.monotonic() + wait > deadline:
+                logger.warning(f"Rate limit: no capacity within {max_wait}s for {tokens} tokens")
+                return False
+            logger.info(f"Rate limit: queueing request for {wait:.2f}s")
+            await asyncio.sleep(wait)
+
+    def reconcile(self, estimated: int, actual: int):
+        """Charge (or refund) the difference between estimated and actual token usage."""
+        if self.enabled and actual != estimated:
+            self._take(0, actual - estimated, force=True)
+
+    def state(self) -> dict:
+        """Current bucket levels and last-minute usage, for monitoring."""
+        _, request_level, token_level = self._take(0, 0)
+        request_capacity, token_capacity = self.request_capacity, self.token_capacity
+        if self._using_local:
+            request_capacity = self._local.request_capacity
+            token_capacity = self._local.token_capacity
+            minute = self._local.usage.get(int(time.time() // 60), [0, 0])
+            requests_this_minute, tokens_this_minute = minute
+        else:
+            try:
+                usage = redis_instance.hgetall(self._usage_key())
+            except redis.RedisError:
+                usage = {}
+            requests_this_minute = int(usage.get(b"requests", 0))
+            tokens_this_minute = int(usage.get(b"tokens", 0))
+        return {
+            "enabled": self.enabled,
+            "backend": "local" if self._using_local else "redis",
+            "requests_available": math.floor(request_level),
+            "requests_per_minute": request_capacity,
+            "tokens_available": math.floor(token_level),
+            "tokens_per_minute": token_capacity,
+            "requests_this_minute": requests_this_minute,
+            "tokens_this_minute": tokens_this_minute,
+        }
+
+
+# Global instance
+rate_limiter = TokenBucketLimiter()
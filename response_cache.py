@@ -0,0 +1,133 @@
+"""
+Redis cache of LLM answers keyed on the model and a normalized prompt hash.
+
+The same canned questions get asked against the same datasets over and over;
+serving them from the cache skips a paid round trip. Entries expire after a
+TTL and the cache is kept to a bounded number of entries, evicting the least
+recently used first. Only real model answers are stored: callers never pass
+fallback or error text in.
+"""
+
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from typing import Optional
+
+import redis
+
+from config import config
+from constants import redis_instance
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_INDEX_KEY = "llmcache:index"
+_STATS_KEY = "llmcache:stats"
+
+
+def _normalize(text: str) -> str:
+    # Only whitespace: case carries meaning in codes, values and column names
+    return _WHITESPACE_RE.sub(" ", str(text)).strip()
+
+
+def cache_key(model: str, messages: list, **kwargs) -> str:
+    """Hash of the model, the whitespace-normalized messages and any sampling parameters."""
+    payload = {
+        "model": model,
+        "messages": [(m.get("role"), _normalize(m.get("content", ""))) for m in messages],
+        "params": {k: kwargs[k] for k in sorted(kwargs)},
+    }
+    digest = hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """TTL and size bounded answer cache with hit/miss counters."""
+
+    def __init__(self):
+        self.enabled = config.RESPONSE_CACHE_ENABLED
+        self.ttl = config.RESPONSE_CACHE_TTL_SECONDS
+        self.max_entries = config.RESPONSE_CACHE_MAX_ENTRIES
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _entry_key(self, key: str) -> str:
+        return f"llmcache:entry:{key}"
+
+    def _count(self, field: str):
+        metrics.cache_lookup("llm_response", "shared" if field == "hits" else "miss")
+        with self._lock:
+            if field == "hits":
+                self.hits += 1
+            else:
+                self.misses += 1
+        try:
+            redis_instance.hincrby(_STATS_KEY, field, 1)
+        except redis.RedisError:
+            pass
+
+    def get(self, key: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        try:
+            pipe = redis_instance.pipeline()
+            pipe.get(self._entry_key(key))
+            # Touch the entry so eviction is least-recently-used
+            pipe.zadd(_INDEX_KEY, {key: time.time()}, xx=True)
+            value, _ = pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Response cache lookup failed: {e}")
+            value = None
+
+        if value is None:
+            self._count("misses")
+            return None
+        self._count("hits")
+        return value.decode("utf-8")
+
+    def set(self, key: str, response: str):
+        if not self.enabled or not response:
+            return
+        try:
+            pipe = redis_instance.pipeline()
+            pipe.set(self._entry_key(key), response.encode("utf-8"), ex=self.ttl)
+            pipe.zadd(_INDEX_KEY, {key: time.time()})
+            pipe.zcard(_INDEX_KEY)
+            size = pipe.execute()[-1]
+
+            overflow = size - self.max_entries
+            if overflow > 0:
+                evicted = [member for member, _ in redis_instance.zpopmin(_INDEX_KEY, overflow)]
+                redis_instance.delete(*[self._entry_key(m.decode()) for m in evicted])
+        except redis.RedisError as e:
+            logger.warning(f"Response cache write failed: {e}")
+
+    def stats(self) -> dict:
+        """Hit/miss counts for this worker and across all workers."""
+        try:
+            shared = redis_instance.hgetall(_STATS_KEY)
+            entries = redis_instance.zcard(_INDEX_KEY)
+        except redis.RedisError:
+            shared, entries = {}, None
+        total_hits = int(shared.get(b"hits", 0))
+        total_misses = int(shared.get(b"misses", 0))
+        lookups = total_hits + total_misses
+        return {
+            "enabled": self.enabled,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "worker_hits": self.hits,
+            "worker_misses": self.misses,
+            "hits": total_hits,
+            "misses": total_misses,
+            "hit_rate": round(total_hits / lookups, 4) if lookups else None,
+        }
+
+
+# Global instance
+response_cache = ResponseCache()
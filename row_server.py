@@ -0,0 +1,150 @@
+"""
+Serves row blocks for AgGrid's infinite row model from server-held frames.
+
+The grid asks for one block of rows at a time with its current sort and
+filter models; only that block crosses the wire. The sorted/filtered row
+order for a dataset is cached so scrolling through blocks doesn't re-sort
+the frame on every request.
+"""
+
+import json
+import logging
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from cache import TTLCache
+from config import config
+from datastore import dataset_store
+
+logger = logging.getLogger(__name__)
+
+_row_orders = TTLCache(config.PREVIEW_ORDER_CACHE_SIZE, ttl=config.PREVIEW_ORDER_CACHE_TTL_SECONDS)
+
+
+def column_defs(df: pd.DataFrame) -> list:
+    """AgGrid column definitions with a filter matching each column's dtype."""
+    return [
+        {
+            "field": str(col),
+            "filter": (
+                "agNumberColumnFilter"
+                if pd.api.types.is_numeric_dtype(df[col]) and not pd.api.types.is_bool_dtype(df[col])
+                else "agTextColumnFilter"
+            ),
+        }
+        for col in df.columns
+    ]
+
+
+def _condition_mask(series: pd.Series, condition: dict) -> pd.Series:
+    kind = condition.get("type")
+    value = condition.get("filter")
+
+    if kind == "blank":
+        return series.isna() | (series.astype(str) == "")
+    if kind == "notBlank":
+        return series.notna() & (series.astype(str) != "")
+
+    if condition.get("filterType") == "number":
+        if kind == "equals":
+            return series == value
+        if kind == "notEqual":
+            return series != value
+        if kind == "lessThan":
+            return series < value
+        if kind == "lessThanOrEqual":
+            return series <= value
+        if kind == "greaterThan":
+            return series > value
+        if kind == "greaterThanOrEqual":
+            return series >= value
+        if kind == "inRange":
+            return series.between(value, condition.get("filterTo"))
+    else:
+        text = series.astype(str).str.lower()
+        value = str(value or "").lower()
+        if kind == "contains":
+            return text.str.contains(value, regex=False)
+        if kind == "notContains":
+            return ~text.str.contains(value, regex=False)
+        if kind == "equals":
+            return text == value
+        if kind == "notEqual":
+            return text != value
+        if kind == "startsWith":
+            return text.str.startswith(value)
+        if kind == "endsWith":
+            return text.str.endswith(value)
+
+    logger.info(f"Ignoring unsupported grid filter {condition}")
+    return pd.Series(True, index=series.index)
+
+
+def _filter_mask(series: pd.Series, model: dict) -> pd.Series:
+    # Combined filters: "conditions" (AG Grid 29+) or condition1/condition2 (older)
+    conditions = model.get("conditions") or [
+        model[key] for key in ("condition1", "condition2") if key in model
+    ]
+    if not conditions:
+        return _condition_mask(series, model)
+
+    masks = [_condition_mask(series, condition) for condition in conditions]
+    combined = masks[0]
+    for mask in masks[1:]:
+        combined = combined | mask if model.get("operator") == "OR" else combined & mask
+    return combined
+
+
+def _row_order(dataset_id: str, df: pd.DataFrame, sort_model: list, filter_model: dict) -> np.ndarray:
+    """Positions of the rows that pass the filters, in sorted order."""
+    key = (dataset_id, json.dumps(sort_model, sort_keys=True), json.dumps(filter_model, sort_keys=True))
+    order = _row_orders.get(key)
+    if order is not None:
+        return order
+
+    view = df
+    if filter_model:
+        mask = pd.Series(True, index=df.index)
+        for col, model in filter_model.items():
+            if col in df.columns:
+                mask &= _filter_mask(df[col], model).fillna(False).astype(bool)
+        view = df[mask.to_numpy()]
+
+    sort_model = [s for s in sort_model or [] if s.get("colId") in df.columns]
+    if sort_model:
+        view = view.sort_values(
+            [s["colId"] for s in sort_model],
+            ascending=[s.get("sort") != "desc" for s in sort_model],
+            kind="stable",
+        )
+
+    order = df.index.get_indexer(view.index) if view is not df else np.arange(len(df))
+    _row_orders.set(key, order)
+    return order
+
+
+def get_rows(dataset_id: str, request: dict) -> Optional[dict]:
+    """
+    Build a getRowsResponse for an infinite-model AgGrid.
+
+    Args:
+        dataset_id: Dataset store ID of the previewed frame
+        request: The grid's getRowsRequest (startRow, endRow, sortModel, filterModel)
+
+    Returns:
+        {"rowData": [...], "rowCount": n}, or None if the dataset is gone
+    """
+    df = dataset_store.get(dataset_id)
+    if df is None:
+        return None
+
+    order = _row_order(dataset_id, df, request.get("sortModel"), request.get("filterModel"))
+    start = max(0, int(request.get("startRow") or 0))
+    end = min(int(request.get("endRow") or start + config.PREVIEW_BLOCK_ROWS), start + config.PREVIEW_BLOCK_ROWS)
+
+    block = df.iloc[order[start:end]]
+    # NaN isn't valid JSON; send blanks instead
+    block = block.astype(object).where(block.notna(), None)
+    return {"rowData": block.to_dict("records"), "rowCount": len(order)}
@@ -0,0 +1,236 @@
+"""
+Single-flight coalescing of identical concurrent LLM requests.
+
+A shared /view link sent to a whole team makes many identical completion
+requests within seconds of each other. Only one of them (the leader) calls
+OpenAI; the rest wait for its answer instead of spending tokens and rate
+limit budget on the same prompt.
+
+Requests in one process wait on the leader's future. Across workers the
+leader holds a Redis lock (SET NX PX) and publishes the answer, tagged with
+its lock token, under a result key before releasing it; waiters in other
+workers poll for that key and only accept an answer from a leader they saw
+holding the lock, never one left over from an earlier flight. The lock has
+a short TTL that the leader refreshes from a heartbeat thread while its call
+runs, so a leader that is killed outright (a background job cancelled or
+replaced by Dash) leaves a lock that expires within seconds, after which a
+waiter takes over. If Redis is unreachable, requests are only coalesced
+within a process.
+Refreshes (use_cache=False) always make their own call.
+"""
+
+import concurrent.futures
+import json
+import logging
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import redis
+
+from config import config
+from constants import redis_instance
+
+logger = logging.getLogger(__name__)
+
+# KEYS: lock  ARGV: token
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# KEYS: lock  ARGV: token, ttl in ms
+_REFRESH_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class _Abandoned(Exception):
+    """The leader stopped without an answer; a waiter should lead instead."""
+
+
+@dataclass
+class Flight:
+    """A request this caller leads; finish or abandon it when done."""
+
+    key: str
+    future: Optional[concurrent.futures.Future] = None  # Set when leading for this process
+    token: Optional[str] = None  # Set when holding the Redis lock
+    heartbeat: Optional[threading.Event] = None  # Set to stop refreshing the lock
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key within and across workers."""
+
+    def __init__(self):
+        self.enabled = config.COALESCE_ENABLED
+        self.lock_ttl = config.COALESCE_LOCK_TTL_SECONDS
+        self.max_wait = config.COALESCE_MAX_WAIT_SECONDS
+        self.poll_interval = config.COALESCE_POLL_INTERVAL
+        self.led = 0
+        self.coalesced = 0
+        self._flights: Dict[str, concurrent.futures.Future] = {}
+        self._lock = threading.Lock()
+        self._release = None
+        self._refresh = None
+
+    def _lock_key(self, key: str) -> str:
+        return f"llmflight:lock:{key}"
+
+    def _result_key(self, key: str) -> str:
+        return f"llmflight:result:{key}"
+
+    def _count(self, field: str):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def _lead_or_poll(self, key: str, future, deadline: float) -> Tuple[Optional[Flight], Optional[str]]:
+        """Take the Redis lock, or wait for the lock holder's published answer."""
+        token = str(uuid.uuid4())
+        # Answers are published with the leader's token, so one left behind by
+        # an earlier flight is never taken for the current flight's answer
+        holders = set()
+        while time.monotonic() < deadline:
+            try:
+                pipe = redis_instance.pipeline(transaction=False)
+                pipe.get(self._lock_key(key))
+                pipe.get(self._result_key(key))
+                holder, payload = pipe.execute()
+                if holder is not None:
+                    holders.add(holder.decode())
+                if payload is not None:
+                    result = json.loads(payload)
+                    if result["token"] in holders:
+                        self._resolve(key, future, result["answer"])
+                        return None, result["answer"]
+                if holder is None and redis_instance.set(
+                    self._lock_key(key), token, nx=True, px=int(self.lock_ttl * 1000)
+                ):
+                    flight = Flight(key, future, token, threading.Event())
+                    threading.Thread(target=self._keep_lock, args=(flight,), daemon=True).start()
+                    return flight, None
+            except redis.RedisError as e:
+                logger.warning(f"Request coalescing limited to this worker: {e}")
+                break
+            time.sleep(self.poll_interval)
+        # Redis is down or the leader is taking too long; make the call ourselves
+        return Flight(key, future), None
+
+    def _keep_lock(self, flight: Flight):
+        """Refresh the leader's lock until the flight ends or the lock is lost."""
+        while not flight.heartbeat.wait(self.lock_ttl / 3):
+            try:
+                if self._refresh is None:
+                    self._refresh = redis_instance.register_script(_REFRESH_SCRIPT)
+                if not self._refresh(
+                    keys=[self._lock_key(flight.key)], args=[flight.token, int(self.lock_ttl * 1000)]
+                ):
+                    return
+            except redis.RedisError as e:
+                logger.warning(f"Could not refresh coalescing lock: {e}")
+
+    def join(self, key: str, fresh: bool = False) -> Tuple[Optional[Flight], Optional[str]]:
+        """
+        Lead the call for a key, or wait for the current leader's answer.
+
+        Args:
+            key: Hash identifying the request (model, prompt and parameters)
+            fresh: Always make the call, e.g. for a refresh that must not get
+                an answer to a request made before it
+
+        Returns:
+            (flight, None) if the caller should make the call, and must then
+            pass the flight to finish() or abandon(); otherwise (None, answer)
+            with the leader's answer, which is None if the leader's call failed
+        """
+        if not self.enabled:
+            return Flight(key), None
+        if fresh:
+            self._count("led")
+            return Flight(key), None
+
+        deadline = time.monotonic() + self.max_wait
+        while time.monotonic() < deadline:
+            with self._lock:
+                future = self._flights.get(key)
+                leading = future is None
+                if leading:
+                    future = self._flights[key] = concurrent.futures.Future()
+
+            if leading:
+                flight, answer = self._lead_or_poll(key, future, deadline)
+                if flight is not None:
+                    self._count("led")
+                else:
+                    self._count("coalesced")
+                return flight, answer
+
+            try:
+                answer = future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except _Abandoned:
+                continue
+            except concurrent.futures.TimeoutError:
+                break
+            self._count("coalesced")
+            return None, answer
+        return Flight(key), None
+
+    def _resolve(self, key: str, future, answer: Optional[str] = None, error: Exception = None):
+        if future is None:
+            return
+        with self._lock:
+            if self._flights.get(key) is future:
+                del self._flights[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(answer)
+
+    def _unlock(self, flight: Flight, answer: Optional[str] = None, publish: bool = False):
+        if flight.token is None:
+            return
+        flight.heartbeat.set()
+        try:
+            if self._release is None:
+                self._release = redis_instance.register_script(_RELEASE_SCRIPT)
+            if publish:
+                # Published before the lock goes, so no waiter sees neither
+                redis_instance.set(
+                    self._result_key(flight.key),
+                    json.dumps({"token": flight.token, "answer": answer}),
+                    px=int(self.lock_ttl * 1000),
+                )
+            self._release(keys=[self._lock_key(flight.key)], args=[flight.token])
+        except redis.RedisError as e:
+            logger.warning(f"Could not publish coalesced answer: {e}")
+
+    def finish(self, flight: Flight, answer: Optional[str]):
+        """Share the leader's answer (None if the call failed) with its waiters."""
+        self._unlock(flight, answer, publish=True)
+        self._resolve(flight.key, flight.future, answer)
+
+    def abandon(self, flight: Flight):
+        """Give up leading without an answer, e.g. because the caller went away."""
+        self._unlock(flight)
+        self._resolve(flight.key, flight.future, error=_Abandoned())
+
+    def stats(self) -> dict:
+        """Calls made and calls served by another caller's answer, for this worker."""
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "led": self.led,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._flights),
+            }
+
+
+# Global instance
+single_flight = SingleFlight()
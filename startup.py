@@ -0,0 +1,141 @@
+"""
+Startup timing: how long the app took to build and to serve its first request.
+
+app.py imports this module first and marks phases as it is built (imports,
+app construction, warm-up). Each worker also records the time from its
+start (or fork, under gunicorn's --preload) to its first served request.
+The report is logged and served at /status/startup.
+
+Per-module import cost isn't measured in-process, since an import hook
+would slow every import down. Run ``python startup.py`` instead: it imports
+the app in a fresh interpreter under ``-X importtime`` and prints the
+slowest packages, then times the first request against a test client.
+"""
+
+import logging
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+
+class StartupReport:
+    """Phase timings for this process and its first served request."""
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.first_request_seconds = None
+        self.first_request_latency = None
+        self.worker_started = self.started
+        self._first_request_started = None
+        self._last_mark = self.started
+        self._lock = threading.Lock()
+
+    def mark(self, phase: str):
+        """Record the time since the previous mark under a phase name."""
+        now = time.perf_counter()
+        self.phases[phase] = round(now - self._last_mark, 4)
+        self._last_mark = now
+
+    def _after_fork(self):
+        # A preloaded app was built in the master; the worker's clock starts at fork
+        self.pid = os.getpid()
+        self.worker_started = time.perf_counter()
+        self.first_request_seconds = None
+        self.first_request_latency = None
+        self._first_request_started = None
+        self._lock = threading.Lock()
+
+    def _first_request(self):
+        if self._first_request_started is None:
+            self._first_request_started = time.perf_counter()
+
+    def _first_response(self, response):
+        if self.first_request_seconds is None:
+            with self._lock:
+                if self.first_request_seconds is None:
+                    now = time.perf_counter()
+                    self.first_request_seconds = round(now - self.worker_started, 4)
+                    # The first request also pays for Dash's lazy per-app setup
+                    self.first_request_latency = round(now - self._first_request_started, 4)
+                    logger.info(f"Startup: {self.as_dict()}")
+        return response
+
+    def install(self, server):
+        """Record the first response and serve the report at /status/startup."""
+        from flask import jsonify
+
+        server.before_request(self._first_request)
+        server.after_request(self._first_response)
+        server.add_url_rule("/status/startup", "startup_status", lambda: jsonify(self.as_dict()))
+
+    def as_dict(self) -> dict:
+        return {
+            "pid": self.pid,
+            "preloaded": self.pid != _BUILD_PID,
+            "phases": self.phases,
+            "build_seconds": round(sum(self.phases.values()), 4),
+            "first_request_seconds": self.first_request_seconds,
+            "first_request_latency": self.first_request_latency,
+        }
+
+
+_BUILD_PID = os.getpid()
+startup_report = StartupReport()
+os.register_at_fork(after_in_child=startup_report._after_fork)
+
+
+_IMPORTTIME_RE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|\s*(\S+)")
+
+
+def import_costs(module: str = "app") -> Counter:
+    """
+    Self import time in seconds per top-level package for a fresh ``import module``.
+
+    Args:
+        module: Module to import in the child interpreter
+
+    Returns:
+        Counter of package -> seconds
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    costs = Counter()
+    for match in _IMPORTTIME_RE.finditer(result.stderr):
+        costs[match.group(3).split(".")[0]] += int(match.group(1)) / 1e6
+    return costs
+
+
+def main(top: int = 20):
+    costs = import_costs()
+    print(f"Import cost by package (total {sum(costs.values()):.3f}s):")
+    for package, seconds in costs.most_common(top):
+        print(f"  {seconds * 1000:8.1f} ms  {package}")
+
+    start = time.perf_counter()
+    import app
+    # When run as a script this module is __main__; the app uses the imported copy
+    from startup import startup_report as report
+
+    client = app.server.test_client()
+    for path in ("/", "/_dash-layout", "/_dash-dependencies"):
+        client.get(path)
+    print(f"\nImport and build: {report.as_dict()['phases']}")
+    print(f"Time to first served request: {report.first_request_seconds}s")
+    print(f"First request latency: {report.first_request_latency}s")
+    print(f"Import to first three requests: {time.perf_counter() - start:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""
+Managed Redis access: pooled clients and the shared-layout store.
+
+Every worker process gets its own bounded, blocking connection pool with
+connect/command timeouts and idle health checks, so a slow or unreachable
+Redis fails a request quickly with a RedisError instead of hanging the
+worker. ``REDIS_URL=memory://`` swaps in an in-process fake (fakeredis) for
+local runs and tests without a Redis server. The fake also listens on a
+loopback port, so background jobs forked from the process that created it
+read and write its data rather than a copy that is lost when they exit.
+
+Shared layouts are stored as three keys written and read in one pipelined
+round trip: the encoded figures, the AI summary and a metadata hash. Hot
+links are served from a per-worker LRU, which also keeps them readable
+while Redis is down; a summary refreshed by another worker shows up here
+once the local entry expires.
+"""
+
+import functools
+import logging
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import redis
+
+from cache import TTLCache
+from config import config
+from layout_codec import LayoutDecodeError, decode_figures, encode_figures
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+MEMORY_URL = "memory://"
+
+_memory_server = None  # TcpFakeServer behind memory://, served by _memory_server_pid
+_memory_server_pid = None
+
+
+def create_redis_client(url: str) -> redis.StrictRedis:
+    """
+    Create a Redis client for a URL with this worker's pool settings.
+
+    Args:
+        url: redis:// or rediss:// URL, or memory:// for an in-process fake
+
+    Returns:
+        The client
+
+    Raises:
+        ImportError: If memory:// is requested but fakeredis isn't installed
+    """
+    if url.startswith(MEMORY_URL):
+        try:
+            import fakeredis
+        except ImportError as e:
+            raise ImportError("REDIS_URL=memory:// needs the fakeredis package (pip install fakeredis)") from e
+        global _memory_server, _memory_server_pid
+        if _memory_server is None:
+            _memory_server = fakeredis.TcpFakeServer(("127.0.0.1", 0))
+            _memory_server.daemon_threads = True
+            threading.Thread(target=_memory_server.serve_forever, name="fakeredis", daemon=True).start()
+            _memory_server_pid = os.getpid()
+        if _memory_server_pid == os.getpid():
+            return fakeredis.FakeStrictRedis(server=_memory_server.fake_server)
+        # A forked child: the serving thread only runs in the parent, so
+        # connect to it over the socket
+        host, port = _memory_server.server_address
+        return redis.StrictRedis(
+            host=host, port=port,
+            socket_timeout=config.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=config.REDIS_CONNECT_TIMEOUT,
+        )
+
+    pool = redis.BlockingConnectionPool.from_url(
+        url,
+        max_connections=config.REDIS_MAX_CONNECTIONS,
+        timeout=config.REDIS_POOL_TIMEOUT,
+        socket_timeout=config.REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=config.REDIS_CONNECT_TIMEOUT,
+        health_check_interval=config.REDIS_HEALTH_CHECK_INTERVAL,
+    )
+    return redis.StrictRedis(connection_pool=pool)
+
+
+class _TimedPipeline:
+    """Pipeline whose execute() is timed as a single Redis operation."""
+
+    def __init__(self, pipeline):
+        self._pipeline = pipeline
+
+    def execute(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self._pipeline.execute(*args, **kwargs)
+        finally:
+            metrics.observe("dolfin_redis_seconds", time.perf_counter() - start, command="pipeline")
+
+    def __getattr__(self, name):
+        return getattr(self._pipeline, name)
+
+
+def _timed(name: str, fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            metrics.observe("dolfin_redis_seconds", time.perf_counter() - start, command=name)
+
+    return wrapper
+
+
+class LazyRedis:
+    """
+    Redis client created on first use in each process rather than at import.
+
+    Commands, pipelines and registered scripts called through it are timed
+    under dolfin_redis_seconds.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self) -> redis.StrictRedis:
+        if self._client is None or self._pid != os.getpid():
+            with self._lock:
+                # A forked worker builds its own pool rather than sharing the parent's sockets
+                if self._client is None or self._pid != os.getpid():
+                    self._client = create_redis_client(self.url)
+                    self._pid = os.getpid()
+        return self._client
+
+    def pipeline(self, *args, **kwargs):
+        return _TimedPipeline(self.client.pipeline(*args, **kwargs))
+
+    def register_script(self, script: str):
+        return _timed("script", self.client.register_script(script))
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        return _timed(name, attr) if callable(attr) else attr
+
+
+redis_instance = LazyRedis(config.REDIS_URL)
+
+
+@dataclass
+class SharedLayout:
+    """A saved layout with its summary and metadata."""
+
+    layout_id: str
+    figures: List[dict]
+    summary: Optional[str] = None
+    metadata: dict = field(default_factory=dict)
+    expires_at: Optional[float] = None  # Wall-clock expiry, None if it never expires
+
+    @property
+    def ttl(self) -> Optional[int]:
+        if self.expires_at is None:
+            return None
+        return max(1, int(self.expires_at - time.time()))
+
+
+class LayoutStore:
+    """Pipelined reads/writes of shared layouts with a local read-through LRU."""
+
+    def __init__(self):
+        self.ttl = config.SHARED_LAYOUT_TTL_SECONDS
+        self._local = TTLCache(config.LAYOUT_LOCAL_CACHE_SIZE, ttl=config.LAYOUT_LOCAL_CACHE_TTL_SECONDS)
+
+    @staticmethod
+    def _summary_key(layout_id: str) -> str:
+        return f"{layout_id}:summary"
+
+    @staticmethod
+    def _meta_key(layout_id: str) -> str:
+        return f"{layout_id}:meta"
+
+    def save(self, figures: List[dict]) -> str:
+        """
+        Store a layout's figures and return its ID.
+
+        Raises:
+            redis.RedisError: If the layout couldn't be written
+        """
+        layout_id = str(uuid.uuid4())
+        blob = encode_figures(figures)
+        metadata = {"created": int(time.time()), "figures": len(figures), "bytes": len(blob)}
+
+        pipe = redis_instance.pipeline(transaction=False)
+        pipe.set(layout_id, blob, ex=self.ttl)
+        pipe.hset(self._meta_key(layout_id), mapping=metadata)
+        if self.ttl:
+            pipe.expire(self._meta_key(layout_id), self.ttl)
+        pipe.execute()
+
+        expires_at = time.time() + self.ttl if self.ttl else None
+        self._local.set(layout_id, SharedLayout(layout_id, figures, None, metadata, expires_at))
+        return layout_id
+
+    def load(self, layout_id: str) -> Optional[SharedLayout]:
+        """
+        Return a shared layout, or None if it doesn't exist, has expired or can't be read.
+        """
+        if not layout_id:
+            return None
+        cached = self._local.get(layout_id)
+        # Summaries are written by background jobs in other processes, so a
+        # layout still waiting for one is re-read
+        if cached is not None and cached.summary is not None:
+            metrics.cache_lookup("layout", "local")
+            return cached
+
+        try:
+            pipe = redis_instance.pipeline(transaction=False)
+            pipe.get(layout_id)
+            pipe.get(self._summary_key(layout_id))
+            pipe.hgetall(self._meta_key(layout_id))
+            pipe.ttl(layout_id)
+            blob, summary, metadata, ttl = pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Shared layout lookup failed: {e}")
+            return cached
+        if blob is None:
+            metrics.cache_lookup("layout", "miss")
+            return None
+        metrics.cache_lookup("layout", "shared")
+
+        try:
+            figures = decode_figures(blob)
+        except LayoutDecodeError as e:
+            logger.warning(f"Unreadable saved layout {layout_id}: {e}")
+            return None
+
+        layout = SharedLayout(
+            layout_id=layout_id,
+            figures=figures,
+            summary=summary.decode("utf-8") if summary is not None else None,
+            metadata={k.decode(): v.decode() for k, v in metadata.items()},
+            expires_at=time.time() + ttl if ttl and ttl > 0 else None,
+        )
+        self._local.set(layout_id, layout)
+        return layout
+
+    def set_summary(self, layout: SharedLayout, summary: str):
+        """Store a layout's summary so it expires together with the layout."""
+        layout.summary = summary
+        self._local.set(layout.layout_id, layout)
+        try:
+            pipe = redis_instance.pipeline(transaction=False)
+            pipe.set(self._summary_key(layout.layout_id), summary, ex=layout.ttl)
+            pipe.hset(self._meta_key(layout.layout_id), "summarized", int(time.time()))
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Summary write failed: {e}")
+
+
+layout_store = LayoutStore()
@@ -0,0 +1,38 @@
+"""
+Test setup: the app's modules are imported from the repository root, with
+Redis replaced by an in-process fake (REDIS_URL=memory://, needs fakeredis).
+"""
+
+import os
+import sys
+
+os.environ.setdefault("OPEN_AI_KEY", "sk-test")
+os.environ["REDIS_URL"] = "memory://"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fakeredis  # noqa: E402
+import pytest  # noqa: E402
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    """A fresh fake Redis server behind the shared client, for one test."""
+    import storage
+
+    client = fakeredis.FakeStrictRedis(server=fakeredis.FakeServer())
+    monkeypatch.setattr(storage.redis_instance, "_client", client)
+    monkeypatch.setattr(storage.redis_instance, "_pid", os.getpid())
+    return client
+
+
+@pytest.fixture
+def dataset_dir(monkeypatch, tmp_path):
+    """An empty on-disk dataset store, for one test."""
+    from cache import TTLCache
+    from datastore import dataset_store
+
+    monkeypatch.setattr(dataset_store, "backend", "disk")
+    monkeypatch.setattr(dataset_store, "directory", str(tmp_path))
+    monkeypatch.setattr(dataset_store, "_frames", TTLCache(4))
+    return tmp_path
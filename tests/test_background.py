@@ -0,0 +1,42 @@
+import multiprocessing
+
+import pytest
+
+from background import create_background_manager
+from config import Config
+from storage import create_redis_client
+
+
+@pytest.mark.parametrize(
+    "settings",
+    [
+        {"REDIS_URL": "memory://", "DATASET_STORE_BACKEND": "redis"},
+        {"REDIS_URL": "redis://redis:6379", "DATASET_STORE_BACKEND": "disk"},
+    ],
+)
+def test_celery_needs_shared_redis(monkeypatch, settings):
+    monkeypatch.setattr(Config, "BACKGROUND_BACKEND", "celery")
+    for name, value in settings.items():
+        monkeypatch.setattr(Config, name, value)
+    with pytest.raises(RuntimeError, match="BACKGROUND_BACKEND=celery"):
+        create_background_manager()
+
+
+def test_celery_with_shared_redis_is_valid(monkeypatch):
+    monkeypatch.setattr(Config, "BACKGROUND_BACKEND", "celery")
+    monkeypatch.setattr(Config, "REDIS_URL", "redis://redis:6379")
+    monkeypatch.setattr(Config, "DATASET_STORE_BACKEND", "redis")
+    assert Config.validate_background_config() == (True, "")
+
+
+def _write_from_job():
+    create_redis_client("memory://").set("written-by-job", "summary")
+
+
+def test_memory_redis_keeps_forked_jobs_writes():
+    # Background jobs in diskcache mode are forked from the web worker
+    job = multiprocessing.get_context("fork").Process(target=_write_from_job)
+    job.start()
+    job.join()
+    assert job.exitcode == 0
+    assert create_redis_client("memory://").get("written-by-job") == b"summary"
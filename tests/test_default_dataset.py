@@ -0,0 +1,30 @@
+import os
+
+import pytest
+
+import default_dataset
+from config import config
+from datastore import dataset_store
+
+
+@pytest.fixture
+def fresh_default(dataset_dir, monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "DEFAULT_DATASET_CACHE_DIR", str(tmp_path / "default"))
+    monkeypatch.setattr(default_dataset, "_loaded", None)
+
+
+def test_expired_default_dataset_is_stored_again(fresh_default, dataset_dir):
+    dataset = default_dataset.load_default_dataset()
+    stored = dataset_dir / f"{dataset.dataset_id}.parquet"
+    assert stored.exists()
+
+    # The stored copy expires while the frame is still in this worker's memory
+    os.remove(stored)
+    assert default_dataset.load_default_dataset() is dataset
+    assert stored.exists()
+    assert dataset_store.get(dataset.dataset_id) is not None
+
+
+def test_default_dataset_is_solar(fresh_default):
+    df = default_dataset.load_default_dataset().df
+    assert "State" in df.columns and len(df) == 8
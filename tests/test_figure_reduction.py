@@ -0,0 +1,58 @@
+import pandas as pd
+
+from config import config
+from figure_reduction import reduce_figure
+
+
+def bar(x, y, **kwargs):
+    return {"data": [{"type": "bar", "x": x, "y": y, **kwargs}], "layout": {}}
+
+
+def test_text_categories_keep_largest_plus_other():
+    names = [f"account {i}" for i in range(2_000)]
+    trace = reduce_figure(bar(names, list(range(2_000))), point_budget=1_000)["data"][0]
+    assert len(trace["x"]) == config.FIGURE_MAX_CATEGORIES
+    assert trace["x"][-1] == "Other"
+    assert sum(trace["y"]) == sum(range(2_000))
+
+
+def test_large_negative_categories_are_kept():
+    names = [f"ga {i}" for i in range(2_000)]
+    values = [-1_000_000.0 if i % 100 == 0 else float(i % 10) for i in range(2_000)]
+    trace = reduce_figure(bar(names, values), point_budget=1_000)["data"][0]
+    kept = dict(zip(trace["x"], trace["y"]))
+    assert all(kept[f"ga {i}"] == -1_000_000.0 for i in range(0, 2_000, 100))
+
+
+def test_bars_within_budget_are_left_alone():
+    names = [f"account {i}" for i in range(200)]
+    figure = bar(names, list(range(200)))
+    assert reduce_figure(figure)["data"][0] == figure["data"][0]
+
+
+def test_short_date_axis_is_left_alone():
+    days = pd.date_range("2024-01-01", periods=500).strftime("%Y-%m-%d").tolist()
+    figure = bar(days, [float(i % 37) for i in range(500)])
+    assert reduce_figure(figure)["data"][0] == figure["data"][0]
+
+
+def test_long_date_axis_keeps_order_and_type():
+    days = pd.date_range("2000-01-01", periods=20_000).strftime("%Y-%m-%d").tolist()
+    values = [float(i % 101) for i in range(20_000)]
+    trace = reduce_figure(bar(days, values))["data"][0]
+    assert len(trace["x"]) <= config.FIGURE_POINT_BUDGET
+    assert "Other" not in trace["x"]
+    assert trace["x"] == sorted(trace["x"]) and set(trace["x"]) <= set(days)
+    assert max(trace["y"]) == 100.0 and min(trace["y"]) == 0.0
+
+
+def test_integer_axis_stays_numeric():
+    trace = reduce_figure(bar(list(range(20_000)), [i % 7 for i in range(20_000)]))["data"][0]
+    assert all(isinstance(x, int) for x in trace["x"])
+    assert trace["x"] == sorted(trace["x"])
+
+
+def test_horizontal_bars_reduce_the_category_axis():
+    names = [f"ga {i}" for i in range(2_000)]
+    trace = reduce_figure(bar(list(range(2_000)), names, orientation="h"), point_budget=1_000)["data"][0]
+    assert len(trace["y"]) == config.FIGURE_MAX_CATEGORIES
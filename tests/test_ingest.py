@@ -0,0 +1,79 @@
+import base64
+import io
+
+import openpyxl
+import pytest
+import redis
+from dash import no_update
+
+from ingest import IngestError, ingest_upload
+
+
+def workbook_upload(*rows) -> str:
+    workbook = openpyxl.Workbook()
+    for row in rows:
+        workbook.active.append(row)
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return "data:application/octet-stream;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+def csv_upload(text: str) -> str:
+    return "data:text/csv;base64," + base64.b64encode(text.encode()).decode()
+
+
+def test_duplicate_headers_are_mangled(dataset_dir):
+    result = ingest_upload(workbook_upload(["a", "a", "b"], ["x", "y", 1], ["x", "z", 2]), "dupes.xlsx")
+    assert list(result.df.columns) == ["a", "a.1", "b"]
+    assert list(result.df["a.1"]) == ["y", "z"]
+
+
+def test_blank_headers_are_named_uniquely(dataset_dir):
+    rows = [[None, None, "", "Unnamed: 0"], [1, 2, 3, 4], [5, 6, 7, 8]]
+    result = ingest_upload(workbook_upload(*rows), "blanks.xlsx")
+    assert list(result.df.columns) == ["Unnamed: 0", "Unnamed: 1", "Unnamed: 2", "Unnamed: 0.1"]
+    assert result.df["Unnamed: 0.1"].tolist() == [4, 8]
+
+
+def test_csv_duplicate_headers_match_workbooks(dataset_dir):
+    result = ingest_upload(csv_upload("a,a,b\nx,y,1\nx,z,2\n"), "dupes.csv")
+    assert list(result.df.columns) == ["a", "a.1", "b"]
+
+
+def test_identical_upload_is_served_from_the_store(dataset_dir):
+    contents = workbook_upload(["a", "b"], [1, 2])
+    first = ingest_upload(contents, "same.xlsx")
+    second = ingest_upload(contents, "same.xlsx")
+    assert second.cached and second.dataset_id == first.dataset_id
+
+
+def test_unsupported_extension(dataset_dir):
+    with pytest.raises(IngestError):
+        ingest_upload(csv_upload("a\n1\n"), "data.json")
+
+
+@pytest.fixture
+def failing_redis_store(dataset_dir, fake_redis, monkeypatch):
+    from datastore import dataset_store
+
+    def out_of_memory(*args, **kwargs):
+        raise redis.ResponseError("OOM command not allowed when used memory > 'maxmemory'")
+
+    monkeypatch.setattr(dataset_store, "backend", "redis")
+    monkeypatch.setattr(fake_redis, "set", out_of_memory)
+    return dataset_store
+
+
+def test_store_failure_is_an_ingest_error(failing_redis_store):
+    with pytest.raises(IngestError, match="couldn't be saved"):
+        ingest_upload(csv_upload("a,b\n1,2\n"), "data.csv")
+    # Recording the upload fails quietly; it only costs a re-parse next time
+    failing_redis_store.put_upload("0" * 32, [("Sheet1", "1" * 32, 1)])
+
+
+def test_upload_callback_reports_store_failure(failing_redis_store):
+    import utils
+
+    charts, summary, dataset_id = utils.update_output(csv_upload("a,b\n1,2\n"), "data.csv", False, None)
+    assert charts is no_update and dataset_id is no_update
+    assert "couldn't be saved" in str(summary.to_plotly_json())
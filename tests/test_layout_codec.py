@@ -0,0 +1,38 @@
+import msgpack
+import pytest
+import zstandard
+
+from layout_codec import _HEADER, MAGIC, VERSION, LayoutDecodeError, decode_figures, encode_figures
+from storage import LayoutStore
+
+FIGURES = [
+    {"data": [{"type": "scatter", "x": list(range(50)), "y": [v * 1.5 for v in range(50)]}], "layout": {}},
+]
+
+
+def test_round_trip():
+    assert decode_figures(encode_figures(FIGURES)) == FIGURES
+
+
+@pytest.mark.parametrize("blob", [
+    b"DLF",
+    b"XXXX\x01" + b"payload",
+    _HEADER.pack(MAGIC, VERSION + 1),
+    # Valid header, truncated zstd frame
+    encode_figures(FIGURES)[:-8],
+    # Valid header, garbage instead of a zstd frame
+    _HEADER.pack(MAGIC, VERSION) + b"\x00" * 32,
+    # Valid zstd frame, not msgpack
+    _HEADER.pack(MAGIC, VERSION) + zstandard.ZstdCompressor().compress(b"\xc1\xc1\xc1"),
+    # Valid msgpack, wrong shape
+    _HEADER.pack(MAGIC, VERSION) + zstandard.ZstdCompressor().compress(msgpack.packb({"figures": 1})),
+], ids=["short", "magic", "version", "truncated", "not-zstd", "not-msgpack", "wrong-shape"])
+def test_bad_blobs_raise_decode_error(blob):
+    with pytest.raises(LayoutDecodeError):
+        decode_figures(blob)
+
+
+def test_corrupt_layout_loads_as_expired(fake_redis):
+    layout_id = LayoutStore().save(FIGURES)
+    fake_redis.set(layout_id, fake_redis.get(layout_id)[:-8])
+    assert LayoutStore().load(layout_id) is None
@@ -0,0 +1,68 @@
+import multiprocessing
+import time
+
+import pandas as pd
+import pytest
+
+from query_engine import QueryError, check_expression, safe_eval
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame({"company": ["UF", "UFF", "UF"], "sum_eje": [1.0, 2.0, 3.0]})
+
+
+@pytest.mark.parametrize(
+    "expression",
+    [
+        'df.agg("to_pickle", 0, "{path}")',
+        'df["sum_eje"].agg("to_csv", 0, "{path}")',
+        'df.agg("to_csv", path_or_buf="{path}")',
+        'df.agg("eval", expr="sum_eje + 1")',
+        'df.describe(include="all")',
+        'df.quantile(q=0.5, interpolation="lower")',
+    ],
+)
+def test_string_dispatch_and_unknown_keywords_are_rejected(df, tmp_path, expression):
+    path = tmp_path / "written"
+    with pytest.raises(QueryError):
+        safe_eval(expression.format(path=path), df)
+    assert not path.exists()
+
+
+def test_parser_style_expressions_still_run(df):
+    result = safe_eval('df.groupby("company", observed=True)["sum_eje"].sum().sort_values(ascending=False)', df)
+    assert result.to_dict() == {"UF": 4.0, "UFF": 2.0}
+    assert safe_eval('df["sum_eje"].nlargest(n=1).iloc[0]', df) == 3.0
+    assert safe_eval("df.quantile(q=0.5, numeric_only=True)", df)["sum_eje"] == 2.0
+
+
+@pytest.mark.parametrize(
+    "expression",
+    [
+        '"x" * 100000000000',
+        'df["company"] * 100000000',
+        "[0] * 1000",
+        "10 ** 100",
+    ],
+)
+def test_repetition_is_rejected(df, expression):
+    with pytest.raises(QueryError):
+        check_expression(expression)
+
+
+def test_runaway_memory_is_stopped_in_a_child(df):
+    # Allowed by the AST check: every string repeated by a per-row count
+    df = df.assign(times=[10 ** 10, 1, 1])
+    with pytest.raises(QueryError):
+        safe_eval('df["company"].astype(object) * df["times"]', df)
+    assert multiprocessing.active_children() == []
+
+
+def test_slow_expression_is_killed():
+    df = pd.DataFrame({"company": [str(i) for i in range(200_000)]})
+    started = time.monotonic()
+    with pytest.raises(QueryError, match="too long"):
+        safe_eval('df["company"].str.contains("9").groupby(df["company"]).describe()', df, timeout=0.05)
+    assert time.monotonic() - started < 2
+    assert multiprocessing.active_children() == []
@@ -0,0 +1,16 @@
+from response_cache import cache_key
+
+
+def messages(context, question):
+    return [{"role": "system", "content": context}, {"role": "user", "content": question}]
+
+
+def test_whitespace_differences_share_a_key():
+    assert cache_key("m", messages("Columns: company", "total  sum_eje\nfor UF ")) == cache_key(
+        "m", messages("Columns:   company", "total sum_eje for UF")
+    )
+
+
+def test_case_differences_do_not_share_a_key():
+    assert cache_key("m", messages("ctx", "total for UF")) != cache_key("m", messages("ctx", "total for uf"))
+    assert cache_key("m", messages("Columns: Sum_Eje", "q")) != cache_key("m", messages("Columns: sum_eje", "q"))
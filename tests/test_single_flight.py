@@ -0,0 +1,101 @@
+import json
+import threading
+import time
+
+import pytest
+
+from single_flight import SingleFlight
+
+KEY = "prompt-hash"
+
+
+@pytest.fixture
+def flights(fake_redis):
+    flights = SingleFlight()
+    flights.enabled = True
+    flights.max_wait = 5
+    flights.poll_interval = 0.01
+    return flights
+
+
+def publish(client, token, answer):
+    client.set(f"llmflight:result:{KEY}", json.dumps({"token": token, "answer": answer}))
+
+
+def test_leader_answer_is_shared_across_workers(flights, fake_redis):
+    fake_redis.set(f"llmflight:lock:{KEY}", "other-worker")
+
+    def other_worker_finishes():
+        time.sleep(0.1)
+        publish(fake_redis, "other-worker", "shared answer")
+        fake_redis.delete(f"llmflight:lock:{KEY}")
+
+    threading.Thread(target=other_worker_finishes).start()
+    assert flights.join(KEY) == (None, "shared answer")
+
+
+def test_earlier_flights_answer_is_ignored(flights, fake_redis):
+    # A result left by the previous flight while a new flight holds the lock
+    publish(fake_redis, "previous-flight", "stale answer")
+    fake_redis.set(f"llmflight:lock:{KEY}", "current-flight")
+
+    def current_flight_finishes():
+        time.sleep(0.1)
+        publish(fake_redis, "current-flight", "current answer")
+        fake_redis.delete(f"llmflight:lock:{KEY}")
+
+    threading.Thread(target=current_flight_finishes).start()
+    assert flights.join(KEY) == (None, "current answer")
+
+
+def test_earlier_failure_does_not_stop_a_new_call(flights, fake_redis):
+    publish(fake_redis, "previous-flight", None)
+    flight, answer = flights.join(KEY)
+    assert flight is not None and flight.token is not None
+    flights.finish(flight, "new answer")
+    assert json.loads(fake_redis.get(f"llmflight:result:{KEY}")) == {"token": flight.token, "answer": "new answer"}
+    assert fake_redis.get(f"llmflight:lock:{KEY}") is None
+
+
+def test_fresh_callers_never_wait(flights, fake_redis):
+    fake_redis.set(f"llmflight:lock:{KEY}", "other-worker")
+    publish(fake_redis, "other-worker", "earlier answer")
+    flight, answer = flights.join(KEY, fresh=True)
+    assert flight is not None and answer is None
+
+
+def test_waiters_in_one_process_share_the_leaders_future(flights):
+    flight, _ = flights.join(KEY)
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(flights.join(KEY)))
+    waiter.start()
+    time.sleep(0.1)
+    flights.finish(flight, "answer")
+    waiter.join()
+    assert results == [(None, "answer")]
+    assert flights.stats()["coalesced"] == 1
+
+
+def test_live_leader_keeps_its_lock(flights, fake_redis):
+    flights.lock_ttl = 0.3
+    flight, _ = flights.join(KEY)
+    time.sleep(1.0)
+    assert fake_redis.get(f"llmflight:lock:{KEY}").decode() == flight.token
+    flights.finish(flight, "answer")
+    assert fake_redis.get(f"llmflight:lock:{KEY}") is None
+
+
+def test_killed_leader_is_taken_over(flights, fake_redis):
+    # A background job killed mid-call: no finish() or abandon(), and its
+    # heartbeat dies with the process
+    other_worker = SingleFlight()
+    other_worker.enabled = True
+    other_worker.lock_ttl = 0.3
+    killed, _ = other_worker.join(KEY)
+    killed.heartbeat.set()
+
+    started = time.monotonic()
+    flight, answer = flights.join(KEY)
+    assert flight is not None and flight.token != killed.token
+    assert time.monotonic() - started < 1.0
+    flights.finish(flight, "answer")
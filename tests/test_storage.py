@@ -0,0 +1,115 @@
+import pytest
+import redis
+
+from storage import LayoutStore, create_redis_client
+
+FIGURES = [
+    {"data": [{"type": "bar", "x": ["a", "b", "c"], "y": [1, 2, 3]}], "layout": {"title": {"text": "Totals"}}},
+    {"data": [{"type": "scatter", "x": list(range(20)), "y": [v * 0.5 for v in range(20)]}], "layout": {}},
+]
+
+
+def count_round_trips(client, monkeypatch):
+    """Count direct commands and pipeline executions sent through a fake client."""
+    calls = {"commands": 0, "pipelines": 0}
+    execute_command = client.execute_command
+    pipeline = client.pipeline
+
+    def counting_execute_command(*args, **kwargs):
+        calls["commands"] += 1
+        return execute_command(*args, **kwargs)
+
+    def counting_pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        def counting_execute(*execute_args, **execute_kwargs):
+            calls["pipelines"] += 1
+            return execute(*execute_args, **execute_kwargs)
+
+        pipe.execute = counting_execute
+        return pipe
+
+    monkeypatch.setattr(client, "execute_command", counting_execute_command)
+    monkeypatch.setattr(client, "pipeline", counting_pipeline)
+    return calls
+
+
+def test_memory_url_clients_share_data():
+    first = create_redis_client("memory://")
+    second = create_redis_client("memory://")
+    first.set("shared-key", b"value")
+    assert second.get("shared-key") == b"value"
+
+
+def test_save_and_load_are_single_pipelines(fake_redis, monkeypatch):
+    calls = count_round_trips(fake_redis, monkeypatch)
+    layout_id = LayoutStore().save(FIGURES)
+    assert calls == {"commands": 0, "pipelines": 1}
+
+    # A fresh store has nothing cached locally, so it reads from Redis
+    layout = LayoutStore().load(layout_id)
+    assert calls == {"commands": 0, "pipelines": 2}
+    assert layout.figures == FIGURES
+    assert layout.summary is None
+    assert layout.metadata["figures"] == "2"
+    assert layout.ttl is not None and layout.ttl > 0
+
+
+def test_set_summary_is_shared_and_expires_with_layout(fake_redis):
+    layout_id = LayoutStore().save(FIGURES)
+    writer = LayoutStore()
+    writer.set_summary(writer.load(layout_id), "Totals rise steadily.")
+
+    layout = LayoutStore().load(layout_id)
+    assert layout.summary == "Totals rise steadily."
+    assert "summarized" in layout.metadata
+    assert abs(fake_redis.ttl(f"{layout_id}:summary") - fake_redis.ttl(layout_id)) <= 1
+
+
+def test_load_waits_for_summary_written_elsewhere(fake_redis):
+    store = LayoutStore()
+    layout_id = store.save(FIGURES)
+    assert store.load(layout_id).summary is None
+
+    # Written by a background job in another process
+    fake_redis.set(f"{layout_id}:summary", "From the job.")
+    assert store.load(layout_id).summary == "From the job."
+
+
+def test_summarized_layout_is_served_locally(fake_redis, monkeypatch):
+    store = LayoutStore()
+    layout_id = store.save(FIGURES)
+    store.set_summary(store.load(layout_id), "Done.")
+
+    calls = count_round_trips(fake_redis, monkeypatch)
+    assert store.load(layout_id).summary == "Done."
+    assert calls == {"commands": 0, "pipelines": 0}
+
+
+def test_load_falls_back_to_local_copy_when_redis_fails(fake_redis, monkeypatch):
+    store = LayoutStore()
+    layout_id = store.save(FIGURES)
+
+    def unreachable(*args, **kwargs):
+        raise redis.ConnectionError("Redis is down")
+
+    monkeypatch.setattr(fake_redis, "pipeline", unreachable)
+    layout = store.load(layout_id)
+    assert layout is not None and layout.figures == FIGURES
+    assert store.load("not-cached-anywhere") is None
+    assert LayoutStore().load(layout_id) is None
+
+
+def test_save_raises_when_redis_fails(fake_redis, monkeypatch):
+    def unreachable(*args, **kwargs):
+        raise redis.ConnectionError("Redis is down")
+
+    monkeypatch.setattr(fake_redis, "pipeline", unreachable)
+    with pytest.raises(redis.RedisError):
+        LayoutStore().save(FIGURES)
+
+
+def test_missing_layout_is_none(fake_redis):
+    assert LayoutStore().load("00000000-0000-0000-0000-000000000000") is None
+    assert LayoutStore().load("") is None
@@ -1,12 +1,20 @@
-import base64
-import io
 import os
 
 import dash_ag_grid as dag
 import dash_bootstrap_components as dbc
 import dash_mantine_components as dmc
-import pandas as pd
-from dash import Input, Output, State, callback, dcc, html
+from dash import Input, Output, State, callback, dcc, html, no_update
+
+import row_server
+from config import config
+from dataset_append import append_upload
+from dataset_profile import get_profile
+from datastore import dataset_store
+from financial_cube import get_cube
+from ingest import IngestError, ingest_upload
+from metrics import metrics
+from openai_client import create_error_notification
+from prompt_builder import PromptBuilder
 
 
 def chat_container(text, type_):
@@ -105,7 +113,7 @@ def jumbotron():
                             href="https://plotly.com/examples/generative-ai-chatgpt/",
                         ),
                         dbc.Button(
-                            "Upload your own CSV",
+                            "Upload your own CSV or Excel file",
                             id="modal-demo-button",
                             style={
                                 "background-color": "#238BE6",
@@ -150,9 +158,16 @@ def upload_modal():
                             "font-family": "-apple-system, BlinkMacSystemFont, Segoe UI, Roboto, Helvetica, Arial,"
                             " sans-serif, Apple Color Emoji, Segoe UI Emoji",
                         },
+                        accept=".csv,.txt,.xlsx,.xlsm",
                         # Allow multiple files to be uploaded
                         multiple=False,
                     ),
+                    dmc.Switch(
+                        id="append-mode",
+                        label="Append to the current dataset (new and changed rows only)",
+                        checked=False,
+                        size="sm",
+                    ),
                     dmc.Space(h=20),
                     html.Div(id="summary"),
                     dmc.Group(
@@ -172,45 +187,39 @@ def upload_modal():
     )
 
 
-def generate_prompt(df, question):
-    # Generate insights
-    insights = []
-
-    # Basic DataFrame Information
-    insights.append(
-        f"The DataFrame contains {len(df)} rows and {len(df.columns)} columns."
-    )
-    insights.append("Here are the first 5 rows of the DataFrame:\n")
-    insights.append(df.head().to_string(index=False))
+_CONTEXT_WEIGHTS = {
+    "overview": 3.0, "columns": 2.0, "statistics": 2.0, "missing": 1.0, "common values": 1.0, "rollups": 2.0,
+}
 
-    # Summary Statistics
-    insights.append("\nSummary Statistics:")
-    insights.append(df.describe().to_string())
 
-    # Column Information
-    insights.append("\nColumn Information:")
-    for col in df.columns:
-        insights.append(f"- Column '{col}' has {df[col].nunique()} unique values.")
+def data_sources(df, dataset_id=None):
+    """Chart editor data sources: the dataset's columns, plus agg_* roll-ups for financial ledgers."""
+    sources = df.to_dict("list")
+    cube = get_cube(df, dataset_id)
+    if cube is not None:
+        sources.update(cube.data_source())
+    return sources
 
-    # Missing Values
-    missing_values = df.isnull().sum()
-    insights.append("\nMissing Values:")
-    for col, count in missing_values.items():
-        if count > 0:
-            insights.append(f"- Column '{col}' has {count} missing values.")
 
-    # Most Common Values in Categorical Columns
-    categorical_columns = df.select_dtypes(include=["object"]).columns
-    for col in categorical_columns:
-        top_value = df[col].mode().iloc[0]
-        insights.append(f"\nMost common value in '{col}' column: {top_value}")
-
-    insights_text = "\n".join(insights)
+@metrics.timed("generate_context")
+def generate_context(df, dataset_id=None):
+    """System prompt for chatting about a dataset; the same for every question about it."""
+    # Dataset insights are computed once per dataset and cached; wide datasets
+    # are trimmed to the context budget, keeping the overview and column list
+    # ahead of the summary statistics table
+    builder = PromptBuilder(config.CHAT_CONTEXT_TOKEN_BUDGET, separator="\n")
+    for name, text in get_profile(df, dataset_id).sections:
+        builder.add(name, text, weight=_CONTEXT_WEIGHTS.get(name, 1.0))
+    cube = get_cube(df, dataset_id)
+    if cube is not None:
+        builder.add("rollups", cube.render_context(), weight=_CONTEXT_WEIGHTS["rollups"])
+    insights_text = builder.build()
 
     # Compliment and Prompt
     prompt = (
         "You are a data analyst and chart design expert helping users build charts and answer "
-        "questions about arbitrary datasets. The user's question will be provided. Ensure you "
+        "questions about arbitrary datasets. The user's questions will be provided; follow-up "
+        "questions may refer to earlier answers in the conversation. Ensure you "
         "answer the user's question accurately and given the context of the dataset. The user "
         "will use the results of your commentary to work on a chart or to research the data "
         "using Dash Chart Editor, a product built by Plotly. If the user's question doesn't "
@@ -219,35 +228,114 @@ def generate_prompt(df, question):
         "user directly as they can see your response."
     )
 
-    prompt = f"{prompt}\n\nContext:\n\n{insights_text}\n\nUser's Question: {question}"
+    return f"{prompt}\n\nContext:\n\n{insights_text}"
+
+
+def generate_question(question, facts=None):
+    """The user message for one question, with any figures computed for it."""
+    message = ""
+    # Exact figures computed from the full dataset (see query_engine)
+    if facts is not None:
+        message += (
+            "Computed from the full dataset (these numbers are exact; quote them as given "
+            f"rather than estimating from the context above):\n{facts.text}\n\n"
+        )
 
-    return prompt
+    message += f"User's Question: {question}"
+
+    return message
+
+
+def preview_grid(df):
+    # Rows are fetched block by block from the server as the user scrolls
+    return dag.AgGrid(
+        id="upload-preview",
+        rowModelType="infinite",
+        columnDefs=row_server.column_defs(df),
+        defaultColDef={"sortable": True, "resizable": True, "editable": True},
+        dashGridOptions={
+            "cacheBlockSize": config.PREVIEW_BLOCK_ROWS,
+            "maxBlocksInCache": 10,
+            "rowBuffer": 0,
+        },
+    )
 
 
 @callback(
     Output("chart-editor", "dataSources"),
     Output("summary", "children"),
+    Output("dataset-id", "data"),
     Input("upload-data", "contents"),
     State("upload-data", "filename"),
+    State("append-mode", "checked"),
+    State("dataset-id", "data"),
     prevent_initial_call=True,
 )
-def update_output(contents, filename):
-    content_type, content_string = contents.split(",")
-    decoded = base64.b64decode(content_string)
-    df = pd.read_csv(io.StringIO(decoded.decode("utf-8")))
+def update_output(contents, filename, append, current_id):
+    try:
+        result = ingest_upload(contents, filename)
+        df = result.df
+        dataset_id = result.dataset_id
+        summary = result.summary()
+        if append:
+            current = dataset_store.get(current_id)
+            if current is None:
+                raise IngestError("The current dataset has expired; upload the full file instead of appending.")
+            appended = append_upload(current, current_id, df)
+            df, dataset_id = appended.df, appended.dataset_id
+            summary = f"{summary}. {appended.summary()}"
+    except IngestError as e:
+        return no_update, create_error_notification(str(e)), no_update
+
+    # Every sheet is already stored, so switching sheets doesn't re-parse
+    sheet_select = dmc.Select(
+        id="sheet-select",
+        label="Sheet",
+        data=[{"label": f"{name} ({rows} rows)", "value": sheet_id} for name, sheet_id, rows in result.sheets],
+        value=dataset_id,
+        style={"display": "block" if len(result.sheets) > 1 and not append else "none", "marginBottom": 10},
+    )
 
     preview = html.Div(
         [
             html.H5(filename),
-            dag.AgGrid(
-                rowData=df.to_dict("records"),
-                columnDefs=[{"field": i} for i in df.columns],
-                defaultColDef={"sortable": True, "resizable": True, "editable": True},
-            ),
+            html.P(summary, style={"fontSize": "0.85rem", "color": "#666"}),
+            sheet_select,
+            html.Div(preview_grid(df), id="sheet-preview"),
         ]
     )
 
-    return df.to_dict("list"), preview
+    return data_sources(df, dataset_id), preview, dataset_id
+
+
+@callback(
+    Output("chart-editor", "dataSources", allow_duplicate=True),
+    Output("sheet-preview", "children"),
+    Output("dataset-id", "data", allow_duplicate=True),
+    Input("sheet-select", "value"),
+    State("dataset-id", "data"),
+    prevent_initial_call=True,
+)
+def select_sheet(sheet_id, dataset_id):
+    if not sheet_id or sheet_id == dataset_id:
+        return no_update, no_update, no_update
+    df = dataset_store.get(sheet_id)
+    if df is None:
+        return no_update, create_error_notification("This sheet has expired; upload the file again."), no_update
+    return data_sources(df, sheet_id), preview_grid(df), sheet_id
+
+
+@callback(
+    Output("upload-preview", "getRowsResponse"),
+    Input("upload-preview", "getRowsRequest"),
+    State("dataset-id", "data"),
+    prevent_initial_call=True,
+)
+def serve_preview_rows(request, dataset_id):
+    if not request:
+        return no_update
+    response = row_server.get_rows(dataset_id, request)
+    return response if response is not None else {"rowData": [], "rowCount": 0}
 
 
 @callback(